@@ -0,0 +1,72 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Benchmark building a data frame exploding the info of the task runs.
+
+Run it from the root of the repository:
+
+    $ PYTHONPATH=. python benchmarks/explode_info.py [n_task_runs]
+
+It compares dataframer.create_data_frame with exploding the info of
+every task run in a Python loop, as it used to be done.
+"""
+import sys
+import time
+import pandas
+import pbclient
+from enki import dataframer
+
+
+def build_task_runs(n_task_runs):
+    return [pbclient.TaskRun(dict(id=n, task_id=n // 30, project_id=1,
+                                  user_id=n % 1000, user_ip=None,
+                                  info=dict(answer=n % 3, id=n,
+                                            comment='answer %s' % n,
+                                            bbox=dict(x=n % 7, y=n % 11))))
+            for n in range(n_task_runs)]
+
+
+def explode_in_loop(items):
+    data = []
+    for item in items:
+        item_data = dict(item.data)
+        for k, v in item_data['info'].items():
+            item_data['_' + k if k in item.data else k] = v
+        data.append(item_data)
+    return pandas.DataFrame(data, [item.data['id'] for item in items])
+
+
+def timed(func, *args):
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+
+def main():
+    n_task_runs = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    items = build_task_runs(n_task_runs)
+    print("%d task runs" % n_task_runs)
+    print("%-32s %8.2f s" % ('python loop', timed(explode_in_loop, items)))
+    print("%-32s %8.2f s" % ('create_data_frame',
+                             timed(dataframer.create_data_frame, items)))
+    print("%-32s %8.2f s" % ('create_data_frame, max_depth=2',
+                             timed(dataframer.create_data_frame, items, 2)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Benchmark JsonTaskRunsLoader grouping the task runs by task.
+
+Run it from the root of the repository:
+
+    $ PYTHONPATH=. python benchmarks/group_task_runs.py
+
+The time per task run should stay flat while the project grows.
+"""
+import time
+import pbclient
+from enki.task_run_loaders import JsonTaskRunsLoader
+
+ANSWERS_PER_TASK = 30
+
+
+def build_loader(n_tasks):
+    tasks = [pbclient.Task({'id': t, 'project_id': 1})
+             for t in range(n_tasks)]
+    loader = JsonTaskRunsLoader(1, tasks, json_file=None)
+    loader.task_runs = {}
+    loader.task_runs_file = [
+        pbclient.TaskRun({'id': n, 'task_id': n % n_tasks, 'project_id': 1})
+        for n in range(n_tasks * ANSWERS_PER_TASK)]
+    return loader
+
+
+def main():
+    print("%10s %12s %10s %20s" % ('tasks', 'task runs', 'seconds',
+                                   'us per task run'))
+    for n_tasks in (1000, 10000, 100000):
+        loader = build_loader(n_tasks)
+        start = time.time()
+        loader._group_json_task_runs_by_task_id()
+        elapsed = time.time() - start
+        n_task_runs = len(loader.task_runs_file)
+        print("%10d %12d %10.3f %20.3f" % (n_tasks, n_task_runs, elapsed,
+                                           elapsed * 1e6 / n_task_runs))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Benchmark the memory kept by the task runs once their frame is built.
+
+Run it from the root of the repository:
+
+    $ PYTHONPATH=. python benchmarks/items_memory.py [n_task_runs]
+
+It compares dataframer.create_data_frame with exploding the info into
+the data of every task run, as it used to be done.
+"""
+import sys
+import tracemalloc
+import pandas
+import pbclient
+from enki import dataframer
+
+
+def build_task_runs(n_task_runs, n_keys):
+    # The fields of a PyBossa task run, with an info of n_keys answers.
+    return [pbclient.TaskRun(dict(id=n, created='2016-01-01T00:00:00',
+                                  project_id=1, task_id=n // 30,
+                                  user_id=n % 1000, user_ip=None,
+                                  finish_time='2016-01-01T00:01:00',
+                                  timeout=None, calibration=None,
+                                  external_uid=None, media_url=None,
+                                  info=dict(('q%s' % k, n % (k + 2))
+                                            for k in range(n_keys))))
+            for n in range(n_task_runs)]
+
+
+def explode_into_items(items):
+    for item in items:
+        item_data = item.data
+        for k, v in list(item_data['info'].items()):
+            item_data['_' + k if k in item_data else k] = v
+    return pandas.DataFrame([item.data for item in items],
+                            [item.data['id'] for item in items])
+
+
+def measure(build, n_task_runs, n_keys):
+    """Return the MB of the items and the MB they grew building a frame."""
+    tracemalloc.start()
+    items = build_task_runs(n_task_runs, n_keys)
+    size = tracemalloc.get_traced_memory()[0]
+    data_frame = build(items)
+    del data_frame
+    grown = tracemalloc.get_traced_memory()[0] - size
+    tracemalloc.stop()
+    return size / 1e6, grown / 1e6
+
+
+def main():
+    n_task_runs = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    print("%d task runs" % n_task_runs)
+    print("%-34s %12s %12s" % ('', 'items MB', 'grown MB'))
+    for n_keys in (4, 12):
+        for name, build in (('exploding into the items', explode_into_items),
+                            ('create_data_frame',
+                             dataframer.create_data_frame)):
+            result = measure(build, n_task_runs, n_keys)
+            print("%-34s %12.1f %12.1f"
+                  % (('%s, %d keys' % (name, n_keys),) + result))
+
+
+if __name__ == '__main__':
+    main()
@@ -22,10 +22,21 @@ This module exports:
     * Enki Class: to import an project, its tasks and task runs
 
 """
+import asyncio
+import os
 import pbclient
-from .task_loaders import create_tasks_loader
-from .task_run_loaders import create_task_runs_loader
+from .task_loaders import create_tasks_loader, create_async_tasks_loader
+from .task_run_loaders import create_task_runs_loader, \
+    create_async_task_runs_loader
+from .pagination import map_ordered
+from . import aggregation
 from . import dataframer
+from . import session
+from . import snapshot
+from .cache import Cache
+from .checkpoint import Checkpoint
+from .records import Projection
+from .scheduler import RequestScheduler
 from .exceptions import ProjectNotFound, ProjectError, \
     ProjectWithoutTasks, ProjectWithoutTaskRuns
 from functools import reduce
@@ -36,14 +47,51 @@ class Enki(object):
     """General class for Enki."""
 
     def __init__(self, api_key, endpoint,
-                 project_short_name, all=0):
-        """Initiate."""
+                 project_short_name, all=0, max_workers=1, pool_size=None,
+                 max_page_size=100, cache_dir=None, cache_max_age=None,
+                 checkpoint_dir=None, max_retries=None,
+                 task_runs_layout='per_task', info_max_depth=1, info_sep='.',
+                 max_task_run_frames=1000, optimize_dtypes=False,
+                 compact_records=False, processes=None):
+        """Initiate.
+
+        The options to load, cache and lay out the data are described in
+        the README.
+        """
+        if task_runs_layout not in ('per_task', 'combined', 'lazy'):
+            raise ValueError("Unknown task_runs_layout %s" % task_runs_layout)
+        self.task_runs_layout = task_runs_layout
+        self.info_max_depth = info_max_depth
+        self.info_sep = info_sep
+        self.max_task_run_frames = max_task_run_frames
+        self.processes = processes
+        self.optimizer = None
+        if optimize_dtypes:
+            self.optimizer = dataframer.DtypeOptimizer()
         self.project = None
         self.all = all
+        self.max_workers = max_workers
+        self.max_page_size = max_page_size
+        self.session = None
+        if pool_size is not None:
+            self.session = session.PooledSession(pool_size)
+        self.scheduler = None
+        if max_retries is not None:
+            self.scheduler = RequestScheduler(self.session, max_retries)
+        if self.scheduler is not None or self.session is not None:
+            session.install(self.scheduler or self.session)
         pbclient.set('api_key', api_key)
         pbclient.set('endpoint', endpoint)
         if self.project is None:
             self.project = self.get_project(project_short_name)
+        self.cache = None
+        if cache_dir is not None:
+            self.cache = Cache(cache_dir, endpoint, self.project.id,
+                               cache_max_age)
+        self.checkpoint_dir = checkpoint_dir
+        self.compact_records = compact_records
+        self.task_projection = Projection(compact=compact_records)
+        self.task_run_projection = Projection(compact=compact_records)
 
     def get_project(self, project_short_name):
         """Return project object."""
@@ -54,38 +102,331 @@ class Enki(object):
         else:
             raise ProjectNotFound(project_short_name)
 
+    def pool_stats(self):
+        """Return the connection pool statistics, if there is a pool."""
+        if self.session is None:
+            return None
+        return self.session.stats()
+
+    def scheduler_stats(self):
+        """Return the retries and waits of the scheduler, if there is one."""
+        if self.scheduler is None:
+            return None
+        return self.scheduler.stats()
+
+    def memory_stats(self):
+        """Return the memory saved by optimize_dtypes, if it is on."""
+        if self.optimizer is None:
+            return None
+        return self.optimizer.stats()
+
+    def clear_cache(self):
+        """Remove the cached tasks and task runs of the project."""
+        if self.cache is not None:
+            self.cache.invalidate()
+
+    def _checkpoint(self, name, resume):
+        """Return the Checkpoint of the load called name, if enabled."""
+        if self.checkpoint_dir is None:
+            if resume:
+                raise ValueError("resume needs a checkpoint_dir")
+            return None
+        if not os.path.exists(self.checkpoint_dir):
+            os.makedirs(self.checkpoint_dir)
+        path = os.path.join(self.checkpoint_dir, '%s-%s.checkpoint'
+                            % (self.project.id, name))
+        return Checkpoint(path, resume)
+
     def explode_info(self, item):
         """Return the a dict of the object but with info field exploded."""
         return dataframer.explode_info(item)
 
-    def get_tasks(self, task_id=None, state='completed', json_file=None):
-        """Load all project Tasks."""
+    def get_tasks(self, task_id=None, state='completed', json_file=None,
+                  stream=False, resume=False, columns=None, info_keys=None):
+        """Load all project Tasks.
+
+        With stream=True the json_file is parsed one task at a time, so
+        only the matching tasks are kept in memory. With resume=True an
+        interrupted download goes on from its checkpoint. With columns
+        and info_keys only those fields and keys of info are kept, as
+        soon as every page or task of the file is parsed.
+        """
         if self.project is None:
             raise ProjectError
 
+        projection = Projection(columns, info_keys, self.compact_records)
+        checkpoint = None
+        if json_file is None and task_id is None:
+            checkpoint = self._checkpoint(
+                projection.name('tasks-%s' % state), resume)
         loader = create_tasks_loader(self.project.id, task_id,
-                                     state, json_file, self.all)
-        self.tasks = loader.load()
+                                     state, json_file, self.all,
+                                     max_workers=self.max_workers,
+                                     max_page_size=self.max_page_size,
+                                     stream=stream, cache=self.cache,
+                                     checkpoint=checkpoint,
+                                     projection=projection)
+        self.task_projection = projection
+        self.state = state
+        self._set_tasks(loader.load())
 
-        self._check_project_has_tasks()
-        self.tasks_df = dataframer.create_data_frame(self.tasks)
+    async def get_tasks_async(self, task_id=None, state='completed',
+                              json_file=None, stream=False, columns=None,
+                              info_keys=None):
+        """Load all project Tasks without blocking the event loop.
 
-    def get_task_runs(self, json_file=None):
-        """Load all project Task Runs from Tasks."""
+        At most max_workers requests are sent at the same time. The local
+        cache is not used.
+        """
         if self.project is None:
             raise ProjectError
+
+        projection = Projection(columns, info_keys, self.compact_records)
+        loader = create_async_tasks_loader(self.project.id, task_id,
+                                           state, json_file, self.all,
+                                           max_workers=self.max_workers,
+                                           max_page_size=self.max_page_size,
+                                           stream=stream,
+                                           projection=projection)
+        tasks = await loader.load()
+        self.task_projection = projection
+        self.state = state
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._set_tasks, tasks)
+
+    def get_task_runs(self, json_file=None, project_wide=False,
+                      stream=False, resume=False, columns=None,
+                      info_keys=None):
+        """Load all project Task Runs from Tasks.
+
+        With project_wide=True the task runs are downloaded paging through
+        the whole project instead of doing one query per task. With
+        stream=True the json_file is parsed one task run at a time and
+        only the task runs of the loaded tasks are kept, also in
+        task_runs_file. With resume=True an interrupted download goes on
+        from its checkpoint, without fetching again the pages in it. With
+        columns and info_keys only those fields and keys of info are
+        kept, as soon as every page or task run of the file is parsed.
+        """
+        if self.project is None:
+            raise ProjectError
+        projection = Projection(columns, info_keys, self.compact_records)
+        checkpoint = None
+        if json_file is None:
+            name = 'project_task_runs' if project_wide else 'task_runs'
+            checkpoint = self._checkpoint(projection.name(name), resume)
         loader = create_task_runs_loader(self.project.id, self.tasks,
-                                         json_file, self.all)
-        self.task_runs, self.task_runs_file = loader.load()
+                                         json_file, self.all,
+                                         project_wide=project_wide,
+                                         max_workers=self.max_workers,
+                                         max_page_size=self.max_page_size,
+                                         stream=stream, cache=self.cache,
+                                         checkpoint=checkpoint,
+                                         projection=projection)
+        task_runs, task_runs_file = loader.load()
+        self.task_run_projection = projection
+        self._set_task_runs(task_runs, task_runs_file)
 
-        self._check_project_has_taskruns()
-        self.task_runs_df = dataframer.create_task_run_data_frames(self.tasks, self.task_runs)
+    async def get_task_runs_async(self, json_file=None, project_wide=False,
+                                  stream=False, columns=None, info_keys=None):
+        """Load all project Task Runs without blocking the event loop.
+
+        At most max_workers requests are sent at the same time. The local
+        cache is not used.
+        """
+        if self.project is None:
+            raise ProjectError
+        projection = Projection(columns, info_keys, self.compact_records)
+        loader = create_async_task_runs_loader(self.project.id, self.tasks,
+                                               json_file, self.all,
+                                               project_wide=project_wide,
+                                               max_workers=self.max_workers,
+                                               max_page_size=self.max_page_size,
+                                               stream=stream,
+                                               projection=projection)
+        task_runs, task_runs_file = await loader.load()
+        self.task_run_projection = projection
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._set_task_runs, task_runs,
+                                   task_runs_file)
+
+    def iter_task_runs(self, chunk_size=10000, json_file=None, columns=None,
+                       info_keys=None):
+        """Yield the task runs of the loaded tasks in data frame chunks.
+
+        Every chunk has all the task runs of its tasks, at least
+        chunk_size of them unless it is the last one, indexed by (task_id,
+        taskrun_id) like in the combined layout. They are downloaded task
+        by task, or streamed from json_file, and neither task_runs nor
+        task_runs_df are set, so a project of any size can be aggregated
+        chunk by chunk. columns and info_keys are as in get_task_runs.
+        """
+        if self.project is None:
+            raise ProjectError
+        projection = Projection(columns, info_keys, self.compact_records)
+        loader = create_task_runs_loader(self.project.id, self.tasks,
+                                         json_file, self.all,
+                                         max_workers=self.max_workers,
+                                         max_page_size=self.max_page_size,
+                                         stream=True, projection=projection)
+        tasks, task_runs, size = [], {}, 0
+        for task, task_task_runs in loader.iter_task_runs():
+            if len(task_task_runs) == 0:
+                continue
+            tasks.append(task)
+            task_runs[task.id] = task_task_runs
+            size += len(task_task_runs)
+            if size >= chunk_size:
+                yield self._task_runs_chunk(tasks, task_runs)
+                tasks, task_runs, size = [], {}, 0
+        if len(tasks) != 0:
+            yield self._task_runs_chunk(tasks, task_runs)
+
+    def refresh(self):
+        """Load the tasks and task runs created since the last load.
+
+        The new tasks (with the state of the last get_tasks) are appended
+        to tasks and tasks_df, and the new task runs to task_runs and to
+        the task_runs_df entries of their tasks; the other entries are
+        not rebuilt. The older tasks that got new task runs and now have
+        that state, e.g. the ones completed since the last load, are
+        appended too, with all their task runs. The columns and info_keys
+        of the last loads are kept. Returns the sorted ids of the tasks
+        that are new or got new task runs.
+        """
+        if self.project is None:
+            raise ProjectError
+        last_task_id = max([t.id for t in self.tasks] + [0])
+        last_task_run_id = max([tr.id for trs in self.task_runs.values()
+                                for tr in trs] + [0])
+        loader = create_tasks_loader(self.project.id, None, self.state,
+                                     None, self.all,
+                                     max_workers=self.max_workers,
+                                     max_page_size=self.max_page_size,
+                                     last_id=last_task_id,
+                                     projection=self.task_projection)
+        new_tasks = loader.load()
+        loader = create_task_runs_loader(self.project.id, None, None,
+                                         self.all, project_wide=True,
+                                         max_workers=self.max_workers,
+                                         max_page_size=self.max_page_size,
+                                         last_id=last_task_run_id,
+                                         projection=self.task_run_projection)
+        new_task_runs, _ = loader.load()
+        known = set(t.id for t in self.tasks + new_tasks)
+        unknown = sorted(task_id for task_id in new_task_runs
+                         if task_id not in known)
+        completed = self._find_tasks(unknown)
+        if len(completed) != 0:
+            # Their older task runs were left out by the last loads.
+            loader = create_task_runs_loader(
+                self.project.id, completed, None, self.all,
+                max_workers=self.max_workers,
+                max_page_size=self.max_page_size,
+                projection=self.task_run_projection)
+            completed_task_runs, _ = loader.load()
+            new_task_runs.update(completed_task_runs)
+        new_tasks = new_tasks + completed
+
+        if len(new_tasks) != 0:
+            self.tasks = self.tasks + new_tasks
+            self.tasks_df = dataframer.append_data_frame(
+                self.tasks_df, self._create_data_frame(new_tasks))
+        changed = set(t.id for t in new_tasks)
+        changed_tasks = []
+        for task in self.tasks:
+            task_runs = new_task_runs.get(task.id, [])
+            if len(task_runs) == 0 and task.id not in changed:
+                continue
+            new_task_runs[task.id] = task_runs
+            changed.add(task.id)
+            changed_tasks.append(task)
+            self.task_runs[task.id] = self.task_runs.get(task.id, []) + task_runs
+        if self.task_runs_layout == 'combined':
+            self.task_runs_df.append(
+                [t.id for t in changed_tasks],
+                dataframer.create_combined_task_run_data_frames(
+                    changed_tasks, new_task_runs, self.info_max_depth,
+                    self.info_sep, self.optimizer).frame)
+            return sorted(changed)
+        if self.task_runs_layout == 'lazy':
+            self.task_runs_df.append([t.id for t in changed_tasks])
+            return sorted(changed)
+        for task in changed_tasks:
+            self.task_runs_df[task.id] = dataframer.append_data_frame(
+                self.task_runs_df.get(task.id),
+                self._create_data_frame(new_task_runs[task.id]))
+        return sorted(changed)
 
     def get_all(self):  # pragma: no cover
         """Get task and task_runs from project."""
         self.get_tasks()
         self.get_task_runs()
 
+    async def get_all_async(self):  # pragma: no cover
+        """Get task and task_runs from project without blocking."""
+        await self.get_tasks_async()
+        await self.get_task_runs_async()
+
+    def save_snapshot(self, path, format='feather'):
+        """Write tasks_df and task_runs_df to the directory path.
+
+        format is 'feather' (the default, fastest to load) or 'parquet'
+        (smaller). Needs pyarrow.
+        """
+        snapshot.save_snapshot(path, self.tasks, self.task_runs,
+                               self.tasks_df, self.task_runs_df, format,
+                               project_id=self.project.id, state=self.state)
+
+    def load_snapshot(self, path):
+        """Load the data frames, tasks and task runs of a snapshot.
+
+        The snapshot must be of the same project. Needs pyarrow.
+        """
+        tasks_df, task_runs_df, metadata = snapshot.load_snapshot(path)
+        if metadata['project_id'] != self.project.id:
+            raise ValueError("The snapshot is of the project %s, not %s"
+                             % (metadata['project_id'], self.project.id))
+        self.state = metadata['state']
+        record = Projection(compact=self.compact_records).record
+        self.tasks = [record(pbclient.Task, data) for data in
+                      snapshot.records(tasks_df, metadata['task_fields'])]
+        self.task_runs = dict((task_id, []) for task_id in task_runs_df)
+        task_ids = task_runs_df.frame.index.get_level_values('task_id')
+        rows = snapshot.records(task_runs_df.frame,
+                                metadata['task_run_fields'])
+        for task_id, data in zip(task_ids, rows):
+            self.task_runs[task_id].append(record(pbclient.TaskRun, data))
+        self.task_runs_file = None
+        if self.task_runs_layout == 'per_task':
+            task_runs_df = snapshot.split_task_frames(task_runs_df, metadata)
+        elif self.task_runs_layout == 'lazy':
+            task_runs_df = self._lazy_task_run_frames(list(task_runs_df))
+        self.tasks_df, self.task_runs_df = tasks_df, task_runs_df
+
+    def answers_frame(self, keys=('answer',), fields=()):
+        """Return a frame with the task_id and the info keys of every task run.
+
+        It is built from task_runs, for every layout, without building the
+        frames of the tasks, with the fields of the task runs too, like
+        user_id. The functions of enki.aggregation, enki.agreement and
+        enki.inference work on it.
+        """
+        return aggregation.answers_frame(self.task_runs, keys, self.info_sep,
+                                         fields)
+
+    def aggregate(self, answer='answer', numeric=()):
+        """Return tasks_df with the consensus of the task runs of every task.
+
+        Adds the majority vote of the answer info key, with its votes and
+        confidence, and the mean and median of the numeric info keys,
+        computed for all the task runs at once. See enki.aggregation.
+        """
+        keys = [] if answer is None else [answer]
+        keys.extend(key for key in numeric if key not in keys)
+        frame = self.answers_frame(keys)
+        return aggregation.aggregate(frame, answer, numeric, self.tasks_df)
+
     def describe(self, element):  # pragma: no cover
         """Return tasks or task_runs Panda describe."""
         if (element == 'tasks'):
@@ -95,6 +436,53 @@ class Enki(object):
         else:
             return "ERROR: %s not found" % element
 
+    def _set_tasks(self, tasks):
+        self.tasks = tasks
+        self._check_project_has_tasks()
+        self.tasks_df = self._create_data_frame(self.tasks)
+
+    def _set_task_runs(self, task_runs, task_runs_file):
+        self.task_runs, self.task_runs_file = task_runs, task_runs_file
+        self._check_project_has_taskruns()
+        if self.task_runs_layout == 'combined':
+            self.task_runs_df = dataframer.create_combined_task_run_data_frames(
+                self.tasks, self.task_runs, self.info_max_depth, self.info_sep,
+                self.optimizer)
+        elif self.task_runs_layout == 'lazy':
+            self.task_runs_df = self._lazy_task_run_frames(
+                [t.id for t in self.tasks])
+        else:
+            self.task_runs_df = dataframer.create_task_run_data_frames(
+                self.tasks, self.task_runs, self.info_max_depth, self.info_sep,
+                self.optimizer, self.processes)
+
+    def _find_tasks(self, task_ids):
+        """Return the tasks task_ids that have the state of the last load."""
+        def find_task(task_id):
+            loader = create_tasks_loader(self.project.id, task_id, None,
+                                         None, self.all,
+                                         projection=self.task_projection)
+            return loader.load()
+
+        found = map_ordered(find_task, task_ids, self.max_workers)
+        return [task for tasks in found for task in tasks
+                if self.state in (None, task.state)]
+
+    def _lazy_task_run_frames(self, task_ids):
+        return dataframer.LazyTaskRunFrames(task_ids, self.task_runs,
+                                            self.info_max_depth, self.info_sep,
+                                            self.max_task_run_frames,
+                                            self.optimizer)
+
+    def _task_runs_chunk(self, tasks, task_runs):
+        return dataframer.create_combined_task_run_data_frames(
+            tasks, task_runs, self.info_max_depth, self.info_sep,
+            self.optimizer).frame
+
+    def _create_data_frame(self, items):
+        return dataframer.create_data_frame(items, self.info_max_depth,
+                                            self.info_sep, self.optimizer)
+
     def _check_project_has_tasks(self):
         if len(self.tasks) == 0:
             raise ProjectWithoutTasks
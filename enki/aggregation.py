@@ -0,0 +1,148 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Consensus of the answers of the task runs of every task, in bulk.
+
+The module exports:
+    * answers_frame: a frame with the task id and some info keys of every
+      task run, built in one pass over the loaded task runs
+    * vote_counts: a task x answer matrix with the votes of every answer
+    * majority_vote: the most voted answer of every task, its votes and
+      the confidence in it
+    * numeric_summary: the mean and median of a numeric info key
+    * aggregate: all of them, joined to the tasks frame
+
+They work on a frame with a task_id column and a column per info key, like
+answers_frame, the frame of the 'combined' layout or the chunks of
+iter_task_runs, grouping all the task runs at once instead of task by task.
+"""
+import pandas
+
+
+def answers_frame(task_runs, keys, sep='.', fields=()):
+    """Return a frame with the task_id and the keys of the task runs info.
+
+    task_runs is a dict with the list of task runs of every task, like
+    Enki.task_runs. Keys of nested info dicts are joined by sep, e.g.
+    bbox.x. Task runs without a key get None. Lists, like the answers of
+    multiple choice questions, become tuples so they can be voted. The
+    fields of the task runs, like user_id, are added as columns too.
+    """
+    task_ids = []
+    items = []
+    for task_id, task_task_runs in task_runs.items():
+        task_ids.extend([task_id] * len(task_task_runs))
+        items.extend(task_task_runs)
+    columns = dict(task_id=task_ids)
+    for field in fields:
+        columns[field] = [getattr(tr, field, None) for tr in items]
+    infos = [getattr(tr, 'info', None) for tr in items]
+    infos = [info if type(info) == dict else {} for info in infos]
+    for key in keys:
+        columns[key] = [_info_value(info, key, sep) for info in infos]
+    return pandas.DataFrame(columns)
+
+
+def _info_value(info, key, sep):
+    value = info.get(key)
+    if key not in info:
+        value = info
+        for part in key.split(sep):
+            if type(value) != dict or part not in value:
+                return None
+            value = value[part]
+    if type(value) == list:
+        return tuple(value)
+    return value
+
+
+def vote_counts(frame, key, normalize=False):
+    """Return a frame indexed by task id with the votes of every answer.
+
+    The answers of key are the columns. With normalize=True, the votes
+    are divided by the votes of the task, giving the distribution of the
+    answers. Missing answers are not votes.
+    """
+    counts = _counts(frame, key).unstack(fill_value=0)
+    counts.columns.name = key
+    if normalize:
+        counts = counts.div(counts.sum(axis=1), axis=0)
+    return counts
+
+
+def majority_vote(frame, key):
+    """Return a frame indexed by task id with the majority answer of key.
+
+    The columns are <key>_majority, the most voted answer, with ties
+    broken by the first answer given; <key>_votes, its votes;
+    <key>_count, the answers of the task; and <key>_confidence, the share
+    of them that voted the majority answer.
+    """
+    counts = _counts(frame, key)
+    ordered = counts.sort_values(ascending=False, kind='stable')
+    task_ids = ordered.index.get_level_values(0)
+    top = ordered[~task_ids.duplicated()]
+    index = pandas.Index(top.index.get_level_values(0), name='task_id')
+    result = pandas.DataFrame({
+        '%s_majority' % key: top.index.get_level_values(1),
+        '%s_votes' % key: top.values}, index=index)
+    count = counts.groupby(level=0, sort=False).sum()
+    result['%s_count' % key] = count
+    result['%s_confidence' % key] = (result['%s_votes' % key]
+                                     / result['%s_count' % key])
+    return result.sort_index()
+
+
+def numeric_summary(frame, key):
+    """Return a frame indexed by task id with the mean and median of key.
+
+    Values that are not numbers are ignored.
+    """
+    values = pandas.to_numeric(frame[key], errors='coerce')
+    result = values.groupby(frame['task_id'].values).agg(['mean', 'median'])
+    result.index.name = 'task_id'
+    result.columns = ['%s_mean' % key, '%s_median' % key]
+    return result
+
+
+def aggregate(frame, answer='answer', numeric=(), tasks_df=None):
+    """Return a frame with the consensus of the task runs of every task.
+
+    It has the majority_vote of the answer key, if any, and the
+    numeric_summary of the numeric keys. With tasks_df, they are joined
+    to it by task id, with missing values for tasks without task runs.
+    """
+    results = []
+    if answer is not None:
+        results.append(majority_vote(frame, answer))
+    results.extend(numeric_summary(frame, key) for key in numeric)
+    result = pandas.concat(results, axis=1) if results else \
+        pandas.DataFrame(index=pandas.Index([], name='task_id'))
+    if tasks_df is None:
+        return result
+    return tasks_df.join(result)
+
+
+def _counts(frame, key):
+    # Without the index of frame, which in the combined layout is named
+    # task_id too.
+    answers = pandas.DataFrame({'task_id': frame['task_id'].values,
+                                key: frame[key].values}).dropna()
+    counts = answers.groupby(['task_id', key], sort=False,
+                             observed=True).size()
+    return counts
@@ -0,0 +1,124 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Inter-annotator agreement of the task runs, for all the tasks at once.
+
+The module exports:
+    * Agreement: the agreement of the project and of every task
+    * fleiss_kappa: Fleiss' kappa of a nominal info key
+    * krippendorff_alpha: Krippendorff's alpha of a nominal or interval
+      info key
+
+They work on a frame with a task_id column and a column per info key, like
+enki.aggregation.answers_frame. The nominal metrics use its task x answer
+matrix of votes, the interval ones the sums of the values of every task,
+so they take a few vectorized passes whatever the number of task runs.
+Tasks with fewer than two answers have no agreement and are not counted.
+"""
+import numpy
+import pandas
+from .aggregation import vote_counts
+
+LEVELS = ('nominal', 'interval')
+
+
+class Agreement(object):
+
+    """The agreement of the project and of every task.
+
+    value is the agreement of the project and tasks a frame indexed by
+    task id with the answers of every task and its agreement.
+    """
+
+    def __init__(self, metric, value, tasks):
+        """Init method."""
+        self.metric = metric
+        self.value = value
+        self.tasks = tasks
+
+    def __repr__(self):
+        return '%s(%s=%.4f, tasks=%s)' % (type(self).__name__, self.metric,
+                                          self.value, len(self.tasks))
+
+
+def fleiss_kappa(frame, key):
+    """Return the Agreement with Fleiss' kappa of the answers of key.
+
+    The tasks can have different numbers of answers. The tasks frame has
+    their answers, their agreement, the share of pairs of answers that
+    agree, and their kappa, the agreement above the one expected by
+    chance.
+    """
+    counts = _pairable(vote_counts(frame, key))
+    raters = counts.sum(axis=1)
+    agreement = ((counts * (counts - 1)).sum(axis=1)
+                 / (raters * (raters - 1)))
+    shares = counts.sum(axis=0) / raters.sum()
+    expected = (shares ** 2).sum()
+    tasks = pandas.DataFrame(dict(answers=raters.astype(int),
+                                  agreement=agreement,
+                                  kappa=(agreement - expected)
+                                  / (1 - expected)))
+    value = (agreement.mean() - expected) / (1 - expected)
+    return Agreement('kappa', value, tasks)
+
+
+def krippendorff_alpha(frame, key, level='nominal'):
+    """Return the Agreement with Krippendorff's alpha of the answers of key.
+
+    level is 'nominal' for answers that are categories or 'interval' for
+    numbers, whose distance is their difference squared. The tasks frame
+    has their answers, their disagreement, the mean distance between
+    their answers, and their alpha, one minus their disagreement over the
+    one expected in the project.
+    """
+    if level not in LEVELS:
+        raise ValueError("Unknown level %s" % level)
+    if level == 'nominal':
+        counts = _pairable(vote_counts(frame, key))
+        answers = counts.sum(axis=1)
+        observed = ((answers ** 2 - (counts ** 2).sum(axis=1))
+                    / (answers * (answers - 1)))
+        total = answers.sum()
+        expected = ((total ** 2 - (counts.sum(axis=0) ** 2).sum())
+                    / (total * (total - 1)))
+    else:
+        values = pandas.to_numeric(frame[key], errors='coerce').values
+        values = pandas.Series(values, frame['task_id'].values).dropna()
+        answers = values.groupby(level=0).size()
+        values = values[answers.reindex(values.index).values >= 2]
+        answers = answers[answers >= 2]
+        # Centered, so the sums of squares do not lose precision.
+        values = values - values.mean()
+        sums = values.groupby(level=0).sum()
+        squares = (values ** 2).groupby(level=0).sum()
+        observed = (2 * (answers * squares - sums ** 2)
+                    / (answers * (answers - 1)))
+        total = answers.sum()
+        expected = (2 * (total * squares.sum() - sums.sum() ** 2)
+                    / (total * (total - 1)))
+    observed.index.name = 'task_id'
+    tasks = pandas.DataFrame(dict(answers=answers.astype(int),
+                                  disagreement=observed,
+                                  alpha=1 - observed / expected))
+    value = 1 - (answers * observed).sum() / total / expected
+    return Agreement('alpha', value, tasks)
+
+
+def _pairable(counts):
+    return counts[counts.sum(axis=1) >= 2].astype(numpy.float64)
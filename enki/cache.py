@@ -0,0 +1,82 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Local cache of the tasks and task runs downloaded from a PyBossa server.
+
+The module exports:
+    * Cache: the entries of one project of one server in a directory
+
+Every entry stores the records fetched by a loader and the highest id
+seen, so the next load only asks the server for newer records.
+"""
+import hashlib
+import json
+import os
+import time
+
+
+class Cache(object):
+
+    """Cached tasks and task runs of a project."""
+
+    def __init__(self, cache_dir, endpoint, project_id, max_age=None):
+        """Init method.
+
+        Entries older than max_age seconds are ignored and downloaded
+        again from scratch.
+        """
+        server = hashlib.sha1(endpoint.encode('utf-8')).hexdigest()[:16]
+        self.path = os.path.join(cache_dir, '%s-%s' % (server, project_id))
+        self.max_age = max_age
+
+    def load(self, name):
+        """Return the entry called name, or None if there is no valid one."""
+        path = self._entry_path(name)
+        if not os.path.exists(path):
+            return None
+        with open(path) as entry_file:
+            entry = json.load(entry_file)
+        if (self.max_age is not None
+                and time.time() - entry['updated'] > self.max_age):
+            return None
+        return entry
+
+    def save(self, name, records, last_id, **extra):
+        """Store the records of name, replacing the previous entry."""
+        entry = dict(extra, records=records, last_id=last_id,
+                     updated=time.time())
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        self._write(name, entry)
+
+    def invalidate(self, name=None):
+        """Remove the entry called name, or all of them if name is None."""
+        if not os.path.exists(self.path):
+            return
+        for filename in os.listdir(self.path):
+            if name is None or filename == '%s.json' % name:
+                os.remove(os.path.join(self.path, filename))
+
+    def _entry_path(self, name):
+        return os.path.join(self.path, '%s.json' % name)
+
+    def _write(self, name, entry):
+        path = self._entry_path(name)
+        with open(path + '.tmp', 'w') as entry_file:
+            json.dump(entry, entry_file)
+        os.replace(path + '.tmp', path)
@@ -0,0 +1,152 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Checkpoints of the server loaders, to resume interrupted downloads.
+
+The module exports:
+    * Checkpoint: the progress of a load, appended to a local file
+    * NullCheckpoint: a checkpoint that does not record anything
+
+A load is made of streams, each one a keyset paginated query (all the
+task runs of a task, one range of ids, ...). The checkpoint file has one
+JSON line per fetched page of a stream, with its records and last id,
+one per finished stream and one with the plan of id ranges, if any.
+"""
+import json
+import os
+import threading
+
+
+class Progress(object):
+
+    """Progress of one stream of a checkpoint."""
+
+    def __init__(self, checkpoint, key, cls, state):
+        self.checkpoint = checkpoint
+        self.key = key
+        self.items = [cls(data) for data in state.get('records', [])]
+        self.last_id = state.get('last_id')
+        self.done = state.get('done', False)
+
+    def add(self, page):
+        """Record a fetched page of the stream."""
+        if len(page) != 0:
+            self.checkpoint.write(dict(key=self.key,
+                                       records=[item.data for item in page],
+                                       last_id=page[-1].id))
+
+    def finish(self):
+        """Record that the stream is complete."""
+        self.checkpoint.write(dict(key=self.key, done=True))
+
+
+class Checkpoint(object):
+
+    """Progress of a load, periodically appended to path."""
+
+    def __init__(self, path, resume=False, every=10):
+        """Init method.
+
+        With resume the progress in path is loaded, otherwise it is
+        discarded. Lines are written every `every` pages.
+        """
+        self.path = path
+        self.every = every
+        self.plan = None
+        self._state = {}
+        self._pending = []
+        self._lock = threading.Lock()
+        if resume and os.path.exists(path):
+            self._read()
+        else:
+            open(path, 'w').close()
+
+    def track(self, key, cls):
+        """Return the Progress of the stream key, with its records as cls."""
+        return Progress(self, key, cls, self._state.get(key, {}))
+
+    def set_plan(self, ranges):
+        """Record the id ranges the load is split in."""
+        self.plan = [list(r) for r in ranges]
+        self.write(dict(plan=self.plan))
+
+    def write(self, line):
+        with self._lock:
+            self._pending.append(line)
+            if len(self._pending) >= self.every:
+                self._flush()
+
+    def flush(self):
+        """Write the pending lines to the file."""
+        with self._lock:
+            self._flush()
+
+    def remove(self):
+        """Remove the checkpoint once the load is complete."""
+        with self._lock:
+            self._pending = []
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def _flush(self):
+        if len(self._pending) == 0:
+            return
+        with open(self.path, 'a') as checkpoint_file:
+            for line in self._pending:
+                checkpoint_file.write(json.dumps(line) + '\n')
+        self._pending = []
+
+    def _read(self):
+        with open(self.path) as checkpoint_file:
+            for line in checkpoint_file:
+                try:
+                    line = json.loads(line)
+                except ValueError:
+                    # The last line may be cut if the process was killed.
+                    break
+                if 'plan' in line:
+                    self.plan = line['plan']
+                    continue
+                state = self._state.setdefault(line['key'], dict(records=[]))
+                if line.get('done'):
+                    state['done'] = True
+                else:
+                    state['records'] += line['records']
+                    state['last_id'] = line['last_id']
+
+
+class NullCheckpoint(object):
+
+    """Checkpoint used when the progress is not recorded."""
+
+    plan = None
+
+    def track(self, key, cls):
+        return Progress(self, key, cls, {})
+
+    def set_plan(self, ranges):
+        pass
+
+    def write(self, line):
+        pass
+
+    def flush(self):
+        pass
+
+    def remove(self):
+        pass
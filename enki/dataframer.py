@@ -16,30 +16,430 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
 
+import multiprocessing
+import os
+from collections import OrderedDict
+from collections.abc import Mapping
+from operator import itemgetter
+import numpy
 import pandas
+import pbclient
+from .records import compact_columns
 
+NUMPY_KINDS = {bool: 'b', int: 'i', float: 'f'}
+TIMESTAMP_FIELDS = ('created', 'finish_time')
+# Partitions per process, so the processes finish at about the same time.
+PARTITIONS_PER_PROCESS = 4
 
-def create_task_run_data_frames(tasks, task_runs):
+
+def create_task_run_data_frames(tasks, task_runs, max_depth=1, sep='.',
+                                optimizer=None, processes=None):
+    """Return a dict with the frame of the task runs of every task.
+
+    With processes, the tasks are split in partitions built by a pool of
+    that many processes, with the same frames as the serial build. The
+    processes are at most the CPUs available, so with one CPU the frames
+    are built serially.
+    """
+    if processes is not None:
+        processes = min(processes, _available_cpus())
+    if processes is not None and processes > 1 and len(tasks) > 1:
+        return _create_task_run_data_frames_in_pool(
+            tasks, task_runs, max_depth, sep, optimizer, processes)
     task_runs_df = {}
     for task in tasks:
-        task_runs_df[task.id] = create_data_frame(task_runs[task.id])
+        task_runs_df[task.id] = create_data_frame(task_runs[task.id],
+                                                  max_depth, sep, optimizer)
     return task_runs_df
 
 
-def create_data_frame(item):
-    data = [explode_info(tr) for tr in item]
-    index = [tr.__dict__['data']['id'] for tr in item]
-    return pandas.DataFrame(data, index)
+def _create_task_run_data_frames_in_pool(tasks, task_runs, max_depth, sep,
+                                         optimizer, processes):
+    """Build the task frames in a pool of processes.
+
+    Every partition is sent with the data of its task runs, and its
+    frames are sent back pickled. The processes are started by a fork
+    server where there is one, as forking a process with threads is not
+    safe, and with the default start method elsewhere.
+    """
+    task_ids = [task.id for task in tasks]
+    size = -(-len(task_ids) // (processes * PARTITIONS_PER_PROCESS))
+    partitions = [task_ids[start:start + size]
+                  for start in range(0, len(task_ids), size)]
+    ratio = None if optimizer is None else optimizer.max_category_ratio
+    jobs = ((partition, [[tr.data for tr in task_runs[task_id]]
+                         for task_id in partition], max_depth, sep, ratio)
+            for partition in partitions)
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context(
+        'forkserver' if 'forkserver' in methods else None)
+    task_runs_df = {}
+    with context.Pool(processes) as pool:
+        for frames, stats in pool.imap(_build_partition, jobs):
+            task_runs_df.update(frames)
+            if optimizer is not None:
+                optimizer.add_stats(stats)
+    return dict((task_id, task_runs_df[task_id]) for task_id in task_ids)
+
+
+def _available_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _build_partition(job):
+    partition, data, max_depth, sep, ratio = job
+    optimizer = None if ratio is None else DtypeOptimizer(ratio)
+    frames = dict((task_id, create_data_frame(
+        [pbclient.TaskRun(tr) for tr in task_task_runs], max_depth, sep,
+        optimizer)) for task_id, task_task_runs in zip(partition, data))
+    return frames, None if optimizer is None else optimizer.stats()
+
+
+def create_combined_task_run_data_frames(tasks, task_runs, max_depth=1,
+                                         sep='.', optimizer=None):
+    """Return a TaskRunFrames with the task runs of all the tasks.
+
+    A single frame is built, indexed by (task_id, taskrun_id).
+    """
+    items, task_ids = [], []
+    for task in tasks:
+        items += task_runs[task.id]
+        task_ids += [task.id] * len(task_runs[task.id])
+    data_frame = create_data_frame(items, max_depth, sep, optimizer)
+    data_frame.index = pandas.MultiIndex.from_arrays(
+        [task_ids, [tr.id for tr in items]],
+        names=['task_id', 'taskrun_id'])
+    return TaskRunFrames([task.id for task in tasks], data_frame)
+
+
+def combine_task_run_data_frames(task_runs_df):
+    """Return a TaskRunFrames with the rows of a dict of task frames."""
+    frames = dict((task_id, data_frame) for task_id, data_frame
+                  in task_runs_df.items() if len(data_frame) != 0)
+    if len(frames) == 0:
+        empty = create_combined_task_run_data_frames([], {}).frame
+        return TaskRunFrames(task_runs_df.keys(), empty)
+    data_frame = pandas.concat(frames.values(), keys=frames.keys(),
+                               names=['task_id', 'taskrun_id'])
+    return TaskRunFrames(task_runs_df.keys(), data_frame)
+
+
+class TaskRunFrames(Mapping):
+
+    """Read only dict of the task runs frame of every task.
+
+    All the task runs are in frame, indexed by (task_id, taskrun_id), to
+    use vectorized operations across tasks. The frame of a task, indexed
+    by taskrun_id, is a selection of its rows, with all the columns.
+    """
+
+    def __init__(self, task_ids, frame):
+        """Init method."""
+        self.frame = frame
+        self._task_ids = dict.fromkeys(task_ids)
+        self._positions = self._group_positions(frame, 0)
+
+    def __getitem__(self, task_id):
+        if task_id not in self._task_ids:
+            raise KeyError(task_id)
+        positions = self._positions.get(task_id, [])
+        return self.frame.iloc[positions].droplevel('task_id')
+
+    def __iter__(self):
+        return iter(self._task_ids)
+
+    def __len__(self):
+        return len(self._task_ids)
+
+    def positions(self):
+        """Return a dict with the positions of the rows of every task."""
+        return self._positions
+
+    def append(self, task_ids, frame):
+        """Add the task_ids and the task runs in frame, indexed the same."""
+        offset = len(self.frame)
+        self.frame = append_data_frame(self.frame, frame)
+        for task_id, positions in self._group_positions(frame, offset).items():
+            if task_id in self._positions:
+                positions = numpy.concatenate([self._positions[task_id],
+                                               positions])
+            self._positions[task_id] = positions
+        for task_id in task_ids:
+            self._task_ids.setdefault(task_id)
+
+    def _group_positions(self, frame, offset):
+        if len(frame) == 0:
+            return {}
+        groups = frame.groupby(level='task_id', sort=False).indices
+        return dict((task_id, positions + offset)
+                    for task_id, positions in groups.items())
+
+
+class LazyTaskRunFrames(Mapping):
+
+    """Read only dict of the task runs frame of every task, built on use.
+
+    The frame of a task is built from task_runs the first time it is
+    looked up, and kept while it is one of the max_frames most recently
+    used, so the memory stays bounded however many tasks are iterated.
+    """
+
+    def __init__(self, task_ids, task_runs, max_depth=1, sep='.',
+                 max_frames=1000, optimizer=None):
+        """Init method.
+
+        task_runs is the dict of the task runs of every task, it is read
+        when a frame is built, not copied.
+        """
+        self.task_runs = task_runs
+        self.max_depth = max_depth
+        self.sep = sep
+        self.max_frames = max_frames
+        self.optimizer = optimizer
+        self._task_ids = dict.fromkeys(task_ids)
+        self._frames = OrderedDict()
+
+    def __getitem__(self, task_id):
+        if task_id not in self._task_ids:
+            raise KeyError(task_id)
+        if task_id in self._frames:
+            self._frames.move_to_end(task_id)
+            return self._frames[task_id]
+        data_frame = create_data_frame(self.task_runs.get(task_id, []),
+                                       self.max_depth, self.sep,
+                                       self.optimizer)
+        self._frames[task_id] = data_frame
+        if len(self._frames) > self.max_frames:
+            self._frames.popitem(last=False)
+        return data_frame
+
+    def __iter__(self):
+        return iter(self._task_ids)
+
+    def __len__(self):
+        return len(self._task_ids)
+
+    def cached(self):
+        """Return the ids of the tasks with a built frame, oldest first."""
+        return list(self._frames.keys())
+
+    def append(self, task_ids):
+        """Add the task_ids and rebuild their frames on the next use."""
+        for task_id in task_ids:
+            self._task_ids.setdefault(task_id)
+            self._frames.pop(task_id, None)
+
+
+def create_data_frame(item, max_depth=1, sep='.', optimizer=None):
+    """Return a DataFrame of the items with their info exploded.
+
+    The keys of info become columns, escaped with a _ prefix when the
+    item already has them. Nested info dicts are flattened up to
+    max_depth levels, naming the columns with their keys joined by sep,
+    e.g. bbox.x. The columns are built in bulk, not item by item, and
+    the items are not modified. With a DtypeOptimizer, the frame gets
+    the dtypes that take less memory.
+    """
+    data_frame = _create_data_frame(item, max_depth, sep)
+    if optimizer is not None:
+        data_frame = optimizer.optimize(data_frame)
+    return data_frame
+
+
+def _create_data_frame(item, max_depth, sep):
+    columns = compact_columns(item)
+    if columns is not None:
+        # Compact records with the same fields give their columns as they
+        # are, without building a dict per record.
+        index = pandas.Index(_column(columns['id']))
+        data_frame = pandas.DataFrame(
+            dict((key, _column(values)) for key, values in columns.items()),
+            index)
+        infos = columns.get('info', [None] * len(index))
+    else:
+        records = [tr.data for tr in item]
+        ids = [record['id'] for record in records]
+        index = pandas.Index(_column(ids) if ids else ids)
+        data_frame = records_frame(records, index)
+        infos = [record.get('info') for record in records]
+    infos = [info if type(info) == dict else {} for info in infos]
+    info_frame = flatten_info(records_frame(infos, index), max_depth, sep)
+    if len(info_frame.columns) == 0:
+        return data_frame
+    protected = set(data_frame.columns)
+    info_frame.columns = ['_%s' % column if column in protected else column
+                          for column in info_frame.columns]
+    return pandas.concat([data_frame, info_frame], axis=1)
+
+
+def records_frame(records, index):
+    """Return a DataFrame with a row per dict in records.
+
+    When all the dicts have the same keys, the frame is built column by
+    column, which is much faster for many records, and the columns of
+    bools, ints or floats are converted straight to numpy arrays.
+    """
+    if len(records) == 0:
+        return pandas.DataFrame(records, index)
+    keys = list(records[0].keys())
+    if set(map(len, records)) != set([len(keys)]):
+        return pandas.DataFrame(records, index)
+    try:
+        columns = dict((key, _column(list(map(itemgetter(key), records))))
+                       for key in keys)
+    except KeyError:
+        return pandas.DataFrame(records, index)
+    return pandas.DataFrame(columns, index)
+
+
+def _column(values):
+    first = type(values[0])
+    kind = NUMPY_KINDS.get(first)
+    # Only when all the values are of the same type, as numpy would turn
+    # the bools of a column of numbers into numbers.
+    if kind is not None and all(type(value) is first for value in values):
+        array = numpy.array(values)
+        if array.ndim == 1 and array.dtype.kind == kind:
+            return array
+    return values
+
+
+def flatten_info(info_frame, max_depth=1, sep='.'):
+    """Return info_frame with its dict columns expanded max_depth - 1 times.
+
+    Every key of the dicts of a column becomes a column named with the
+    column, sep and the key. The values that are not dicts are kept in
+    the column itself.
+    """
+    for _ in range(max_depth - 1):
+        parts = []
+        expanded = False
+        for column in info_frame.columns:
+            values = info_frame[column]
+            is_dict = values.map(type) == dict
+            if values.dtype != object or not is_dict.any():
+                parts.append(values)
+                continue
+            expanded = True
+            nested = records_frame(
+                [value if found else {} for value, found
+                 in zip(values, is_dict)], info_frame.index)
+            nested.columns = ['%s%s%s' % (column, sep, key)
+                              for key in nested.columns]
+            if not is_dict.all():
+                parts.append(values.where(~is_dict))
+            parts.append(nested)
+        if not expanded:
+            break
+        info_frame = pandas.concat(parts, axis=1)
+    return info_frame
+
+
+def append_data_frame(data_frame, new_data_frame):
+    """Return data_frame with the rows of new_data_frame after its own.
+
+    The categorical columns of data_frame stay categorical.
+    """
+    if data_frame is None or len(data_frame) == 0:
+        return new_data_frame
+    if len(new_data_frame) == 0:
+        return data_frame
+    result = pandas.concat([data_frame, new_data_frame])
+    for column in data_frame.columns:
+        if (isinstance(data_frame[column].dtype, pandas.CategoricalDtype)
+                and not isinstance(result[column].dtype,
+                                   pandas.CategoricalDtype)):
+            result[column] = result[column].astype('category')
+    return result
+
+
+def memory_usage(data_frame):
+    """Return the bytes taken by data_frame, counting the objects."""
+    return int(data_frame.memory_usage(deep=True).sum())
+
+
+class DtypeOptimizer(object):
+
+    """Give the data frames the dtypes that take less memory.
+
+    The strings of a column with at most max_category_ratio distinct
+    values per row become categoricals, the ints and the floats that
+    fit are downcast, and the TIMESTAMP_FIELDS become datetime64. The
+    memory of the frames before and after is added up in stats().
+    """
+
+    def __init__(self, max_category_ratio=0.5):
+        """Init method."""
+        self.max_category_ratio = max_category_ratio
+        self._frames = 0
+        self._before = 0
+        self._after = 0
+
+    def optimize(self, data_frame):
+        """Return a copy of data_frame with the optimized dtypes."""
+        self._frames += 1
+        self._before += memory_usage(data_frame)
+        if len(data_frame) != 0:
+            columns = dict(
+                (column, self._optimize_column(column,
+                                               data_frame[column]).array)
+                for column in data_frame.columns)
+            data_frame = pandas.DataFrame(columns, data_frame.index)
+        self._after += memory_usage(data_frame)
+        return data_frame
+
+    def add_stats(self, stats):
+        """Add the stats of another optimizer, e.g. of another process."""
+        self._frames += stats['frames']
+        self._before += stats['before']
+        self._after += stats['after']
+
+    def stats(self):
+        """Return a dict with the frames optimized and their bytes."""
+        saved = 0.0
+        if self._before != 0:
+            saved = 1 - float(self._after) / self._before
+        return dict(frames=self._frames, before=self._before,
+                    after=self._after, saved=saved)
+
+    def _optimize_column(self, name, values):
+        kind = values.dtype.kind
+        if kind == 'i':
+            return pandas.to_numeric(values, downcast='integer')
+        if kind == 'f':
+            downcast = values.astype(numpy.float32)
+            if (downcast == values).sum() == values.count():
+                return downcast
+            return values
+        if not isinstance(values.dtype, pandas.StringDtype):
+            if values.dtype != object:
+                return values
+            if pandas.api.types.infer_dtype(values, skipna=True) != 'string':
+                return values
+        if name in TIMESTAMP_FIELDS:
+            try:
+                return pandas.to_datetime(values, format='ISO8601')
+            except (TypeError, ValueError):
+                return values
+        if values.nunique() <= self.max_category_ratio * len(values):
+            return values.astype('category')
+        return values
 
 
 def explode_info(item):
-    item_data = item.__dict__['data']
-    protected = list(item_data.keys())
-    if type(item.info) == dict:
-        keys = list(item_data['info'].keys())
-        for k in keys:
-            if k in protected:
-                item_data["_" + k] = item_data['info'][k]
+    """Return a new dict with the data of item and the keys of its info.
+
+    The item is not modified.
+    """
+    item_data = item.data
+    exploded = dict(item_data)
+    if type(item_data.get('info')) == dict:
+        for k, v in item_data['info'].items():
+            if k in item_data:
+                exploded["_" + k] = v
             else:
-                item_data[k] = item_data['info'][k]
-    return item_data
+                exploded[k] = v
+    return exploded
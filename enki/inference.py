@@ -0,0 +1,173 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Inference of the true answers of the tasks from volunteers of varying quality.
+
+The module exports:
+    * DawidSkene: the Dawid-Skene model, which estimates the confusion
+      matrix of every worker and the posterior of the answers of every task
+      with expectation maximization
+
+It works on a frame with a task_id column, a column with the answers and
+the user_id and user_ip of the task runs, like Enki.answers_frame with
+fields=('user_id', 'user_ip'). The tasks, workers and answers are encoded
+as integer arrays and every iteration is a few numpy passes over them.
+"""
+import numpy
+import pandas
+
+
+class DawidSkene(object):
+
+    """Dawid-Skene model of the answers of workers of varying quality.
+
+    The workers are the user_id of the task runs or, for anonymous task
+    runs, their user_ip. fit iterates until the log likelihood improves
+    less than tol, relatively, or for max_iter iterations. smoothing is
+    added to the counts of the confusion matrices, so the answers a worker
+    never gave do not rule out a true answer. With warm_start=True, fit
+    starts from the posteriors of the previous fit for the tasks it had,
+    e.g. after loading new task runs, instead of from the majority vote.
+    """
+
+    def __init__(self, tol=1e-6, max_iter=100, smoothing=0.01,
+                 warm_start=False):
+        """Init method."""
+        self.tol = tol
+        self.max_iter = max_iter
+        self.smoothing = smoothing
+        self.warm_start = warm_start
+        self.posteriors = None
+        self.priors = None
+        self.confusion = None
+        self.iterations = 0
+        self.converged = False
+        self.log_likelihood = None
+
+    def fit(self, frame, key='answer', worker='user_id',
+            anonymous='user_ip'):
+        """Estimate the model from the answers of key in frame.
+
+        Returns self, with posteriors, a frame indexed by task id with the
+        probability of every answer; priors, the probability of every
+        answer; and confusion, a frame indexed by worker and true answer
+        with the probability of every answer given.
+        """
+        workers = frame[worker]
+        if anonymous in frame.columns:
+            workers = workers.where(workers.notna(), frame[anonymous])
+        data = pandas.DataFrame({'task_id': frame['task_id'].values,
+                                 'worker': workers.values,
+                                 key: frame[key].values}).dropna()
+        task_codes, task_ids = pandas.factorize(data['task_id'])
+        worker_codes, worker_ids = pandas.factorize(data['worker'])
+        labels = pandas.Index(pandas.unique(data[key]))
+        if self.warm_start and self.posteriors is not None:
+            previous = self.posteriors.columns
+            labels = previous.append(labels.difference(previous, sort=False))
+        answer_codes = labels.get_indexer(data[key])
+        shape = (len(task_ids), len(worker_ids), len(labels))
+
+        posteriors = self._initial_posteriors(task_codes, answer_codes,
+                                              task_ids, labels)
+        previous_likelihood = None
+        self.converged = False
+        for self.iterations in range(1, self.max_iter + 1):
+            priors, log_confusion = self._maximize(
+                posteriors, task_codes, worker_codes, answer_codes, shape)
+            posteriors, likelihood = self._expect(
+                priors, log_confusion, task_codes, worker_codes,
+                answer_codes, shape)
+            if (previous_likelihood is not None and
+                    abs(likelihood - previous_likelihood)
+                    <= self.tol * abs(likelihood)):
+                self.converged = True
+                break
+            previous_likelihood = likelihood
+
+        self.log_likelihood = likelihood
+        self.posteriors = pandas.DataFrame(
+            posteriors, pandas.Index(task_ids, name='task_id'), labels)
+        self.priors = pandas.Series(priors, labels)
+        index = pandas.MultiIndex.from_product([worker_ids, labels],
+                                               names=['worker', 'truth'])
+        self.confusion = pandas.DataFrame(
+            numpy.exp(log_confusion).reshape(-1, len(labels)), index, labels)
+        return self
+
+    def labels(self):
+        """Return a frame indexed by task id with the most probable answer.
+
+        The columns are label and probability, its posterior.
+        """
+        best = self.posteriors.values.argmax(axis=1)
+        return pandas.DataFrame(dict(
+            label=self.posteriors.columns[best],
+            probability=self.posteriors.values.max(axis=1)),
+            self.posteriors.index)
+
+    def _initial_posteriors(self, task_codes, answer_codes, task_ids,
+                            labels):
+        n_tasks, n_labels = len(task_ids), len(labels)
+        votes = numpy.bincount(task_codes * n_labels + answer_codes,
+                               minlength=n_tasks * n_labels)
+        posteriors = votes.reshape(n_tasks, n_labels).astype(numpy.float64)
+        posteriors /= posteriors.sum(axis=1, keepdims=True)
+        if self.warm_start and self.posteriors is not None:
+            previous = self.posteriors.reindex(columns=labels, fill_value=0)
+            rows = previous.index.get_indexer(task_ids)
+            known = rows >= 0
+            posteriors[known] = previous.values[rows[known]]
+        return posteriors
+
+    def _maximize(self, posteriors, task_codes, worker_codes, answer_codes,
+                  shape):
+        """Return the priors and the log of the confusion matrices.
+
+        The confusion matrices are indexed by worker, true answer and
+        answer given.
+        """
+        n_tasks, n_workers, n_labels = shape
+        priors = posteriors.mean(axis=0)
+        cells = worker_codes * n_labels + answer_codes
+        weights = posteriors[task_codes]
+        counts = numpy.empty((n_labels, n_workers * n_labels))
+        for truth in range(n_labels):
+            counts[truth] = numpy.bincount(cells, weights[:, truth],
+                                           n_workers * n_labels)
+        counts = counts.reshape(n_labels, n_workers, n_labels)
+        counts = counts.transpose(1, 0, 2) + self.smoothing
+        confusion = counts / counts.sum(axis=2, keepdims=True)
+        return priors, numpy.log(confusion)
+
+    def _expect(self, priors, log_confusion, task_codes, worker_codes,
+                answer_codes, shape):
+        """Return the posteriors of the tasks and the log likelihood."""
+        n_tasks, n_workers, n_labels = shape
+        answers = log_confusion[worker_codes, :, answer_codes]
+        log_posteriors = numpy.empty((n_tasks, n_labels))
+        for truth in range(n_labels):
+            log_posteriors[:, truth] = numpy.bincount(
+                task_codes, answers[:, truth], n_tasks)
+        with numpy.errstate(divide='ignore'):
+            log_posteriors += numpy.log(priors)
+        top = log_posteriors.max(axis=1, keepdims=True)
+        posteriors = numpy.exp(log_posteriors - top)
+        totals = posteriors.sum(axis=1, keepdims=True)
+        posteriors /= totals
+        return posteriors, float((numpy.log(totals) + top).sum())
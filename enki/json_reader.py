@@ -0,0 +1,140 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Read the JSON files exported by PyBossa.
+
+The module exports:
+    * open_json_file: open a JSON file, gzipped or inside a ZIP export
+    * iter_json_array: yield the items of a JSON array one at a time,
+      without reading the whole file in memory
+
+"""
+import gzip
+import io
+import json
+import zipfile
+
+WHITESPACE = ' \t\n\r'
+NUMBER_CHARS = '0123456789+-.eE'
+
+
+def open_json_file(path):
+    """Return a text file object to read the JSON in path.
+
+    path can be a plain JSON file, a gzipped one or a ZIP file with a
+    single JSON file in it, like the ones exported by PyBossa. Compressed
+    files are decompressed while they are read, never to disk.
+    """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            names = [name for name in archive.namelist()
+                     if not name.endswith('/')]
+            json_names = [name for name in names if name.endswith('.json')]
+            if len(json_names) == 1:
+                names = json_names
+            if len(names) != 1:
+                raise ValueError("%s should contain one JSON file, found %s"
+                                 % (path, names))
+            return io.TextIOWrapper(archive.open(names[0]), encoding='utf-8')
+    with open(path, 'rb') as json_file:
+        magic = json_file.read(2)
+    if magic == b'\x1f\x8b':
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path)
+
+
+class _Buffer(object):
+
+    """Text read from a file, consumed from pos onwards."""
+
+    def __init__(self, fileobj, chunk_size):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.text = ''
+        self.pos = 0
+        self.eof = False
+
+    def read_more(self):
+        """Read more text, at least as much as the pending one."""
+        size = max(self.chunk_size, len(self.text) - self.pos)
+        chunk = self.fileobj.read(size)
+        self.text = self.text[self.pos:] + chunk
+        self.pos = 0
+        self.eof = not chunk
+        return not self.eof
+
+    def next_char(self):
+        """Skip the whitespace and return the next char, or None at EOF."""
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.read_more():
+                return None
+
+    def expect(self, chars):
+        char = self.next_char()
+        if char is None or char not in chars:
+            raise ValueError("Expected one of %r at position %s, found %r"
+                             % (chars, self.pos, char))
+        self.pos += 1
+        return char
+
+
+def _number_may_continue(item, buf, end):
+    """Return whether the number item, ending at end, may be incomplete.
+
+    The decoder stops a number at the end of the text, or before a '.' or
+    an 'e' with no digits after them yet, so a number followed only by
+    number characters up to the end of the text may continue in the next
+    chunk.
+    """
+    if buf.eof or type(item) not in (int, float):
+        return False
+    while end < len(buf.text) and buf.text[end] in NUMBER_CHARS:
+        end += 1
+    return end == len(buf.text)
+
+
+def iter_json_array(fileobj, chunk_size=1024 * 1024):
+    """Yield the items of the JSON array in fileobj one by one.
+
+    Only chunk_size characters (or one item, if it is bigger) are kept in
+    memory at any time.
+    """
+    decoder = json.JSONDecoder()
+    buf = _Buffer(fileobj, chunk_size)
+    buf.expect('[')
+    if buf.next_char() == ']':
+        return
+    while True:
+        buf.next_char()
+        try:
+            item, end = decoder.raw_decode(buf.text, buf.pos)
+        except json.JSONDecodeError:
+            if buf.read_more():
+                continue
+            raise
+        if _number_may_continue(item, buf, end):
+            buf.read_more()
+            continue
+        buf.pos = end
+        yield item
+        if buf.expect(',]') == ']':
+            return
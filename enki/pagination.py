@@ -0,0 +1,327 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Helpers shared by the server loaders to page through PyBossa queries.
+
+The module exports:
+    * check_errors: raise the Enki error for a failed PyBossa payload
+    * PageSize: adapt the limit of the queries to the server responses
+    * fetch_page: fetch one page of a query measuring the response
+    * is_last_page: tell whether a page ends its query
+    * map_ordered: apply a function to items using a pool of threads
+    * fetch_all: keyset paginate a query, in parallel id ranges and
+      recording the pages in a checkpoint if asked
+    * call_bounded, gather_ordered and fetch_in_id_ranges_async: the
+      asyncio counterparts used by the async loaders
+
+"""
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from . import session
+from .checkpoint import NullCheckpoint
+from .exceptions import Error, PyBossaServerNoKeysetPagination
+
+
+def check_errors(data):
+    """Check for errors on data payload."""
+    if (type(data) == dict and 'status' in list(data.keys())
+            and data['status'] == 'failed'):
+        if data.get('exception_msg') and 'last_id' in data.get('exception_msg'):
+            raise PyBossaServerNoKeysetPagination
+        else:
+            raise Error(data)
+    return False
+
+
+class PageSize(object):
+
+    """Adapt the limit of the queries to the measured responses.
+
+    The limit is halved when a page takes longer than target_seconds or
+    weighs more than target_bytes, and doubled when a full page takes
+    less than half of both. It always stays between min_limit and
+    max_limit, the biggest page the server may return. The first limit
+    is taken as one the server honors; a bigger one is confirmed when
+    the server returns a full page with it.
+    """
+
+    def __init__(self, limit=100, max_limit=100, min_limit=10,
+                 target_seconds=1.0, target_bytes=1024 * 1024):
+        """Init method."""
+        self.max_limit = max_limit
+        self.min_limit = min(min_limit, max_limit)
+        self.limit = max(self.min_limit, min(limit, max_limit))
+        self.confirmed_limit = self.limit
+        self.target_seconds = target_seconds
+        self.target_bytes = target_bytes
+        self._lock = threading.Lock()
+
+    def measure(self, items, limit, seconds, size=None):
+        """Update the limit with a page of items fetched with limit.
+
+        size is the bytes of the response, when they are known.
+        """
+        if type(items) != list:
+            return
+        heavy = size is not None and size > self.target_bytes
+        light = size is None or size < self.target_bytes / 2
+        with self._lock:
+            if seconds > self.target_seconds or heavy:
+                self.limit = max(self.min_limit, limit // 2)
+            elif (len(items) == limit
+                    and seconds < self.target_seconds / 2 and light):
+                self.limit = min(self.max_limit, max(self.limit, limit * 2))
+
+    def is_last(self, items, limit):
+        """Return whether a page of items fetched with limit is the last.
+
+        An empty page is, and so is a page shorter than a confirmed
+        limit. A page shorter than an unconfirmed limit may be cut by the
+        server, so max_limit is lowered to its length and the next page
+        tells.
+        """
+        with self._lock:
+            if len(items) >= limit:
+                self.confirmed_limit = max(self.confirmed_limit, limit)
+                return False
+            if len(items) < self.confirmed_limit:
+                return True
+            self.max_limit = len(items)
+            self.min_limit = min(self.min_limit, self.max_limit)
+            self.limit = min(self.limit, self.max_limit)
+            return False
+
+
+def fetch_page(find, query, page_size=None):
+    """Return the page of query, checking for errors.
+
+    With a page_size, the limit of query is set from it before the
+    request and the response is measured to adapt the next limit.
+    """
+    if page_size is None:
+        page = find(**query)
+    else:
+        query['limit'] = page_size.limit
+        session.take_response_size()
+        start = time.time()
+        page = find(**query)
+        page_size.measure(page, query['limit'], time.time() - start,
+                          session.take_response_size())
+    check_errors(page)
+    return page
+
+
+def is_last_page(page, limit, page_size=None):
+    """Return whether page, fetched with limit, is the last of its query.
+
+    Without a page_size the limit is fixed and a short page is the last.
+    """
+    if page_size is None:
+        return len(page) < limit
+    return page_size.is_last(page, limit)
+
+
+def map_ordered(func, items, max_workers=1):
+    """Return func applied to every item, in the same order as items.
+
+    When max_workers is greater than one the calls run in a pool of
+    threads. The first exception raised by a worker is raised again here
+    and the calls that did not start yet are cancelled.
+    """
+    if max_workers <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(func, item) for item in items]
+        done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+        for future in pending:
+            future.cancel()
+        for future in done:
+            if future.exception() is not None:
+                raise future.exception()
+        return [future.result() for future in futures]
+
+
+def split_id_range(lower, upper, parts):
+    """Split the (lower, upper] interval of ids in consecutive ranges."""
+    step = max(1, -(-(upper - lower) // parts))
+    ranges = []
+    start = lower
+    while start < upper:
+        end = min(start + step, upper)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def highest_id(find, query):
+    """Return the highest id matching query, or None if it is unknown."""
+    query = dict(query, limit=1, orderby='id', desc=True)
+    query.pop('offset', None)
+    query.pop('last_id', None)
+    items = find(**query)
+    if type(items) != list or len(items) == 0:
+        return None
+    return items[0].id
+
+
+def fetch_id_range(find, query, lower, upper, page_size=None, progress=None):
+    """Keyset paginate query from id lower (excluded) to upper (included).
+
+    The pages are recorded in progress, and a resumed progress goes on
+    from its last page.
+    """
+    if progress is None:
+        progress = NullCheckpoint().track(None, None)
+    if progress.done:
+        return progress.items
+    if progress.last_id is not None:
+        lower = progress.last_id
+    query = dict(query, last_id=lower)
+    query.pop('offset', None)
+    items = progress.items
+    while True:
+        page = fetch_page(find, query, page_size)
+        kept = [item for item in page if item.id <= upper]
+        items += kept
+        progress.add(kept)
+        if (is_last_page(page, query['limit'], page_size)
+                or page[-1].id >= upper):
+            progress.finish()
+            return items
+        query['last_id'] = page[-1].id
+
+
+def fetch_all(find, query, cls, max_workers=1, page_size=None,
+              checkpoint=None):
+    """Return all the items of query, keyset paginating from its start.
+
+    With max_workers greater than one, the ids after the first page up to
+    the highest one known by the server are split in one range per worker
+    and every range is paginated in its own thread. The items are returned
+    ordered by id.
+
+    The pages are recorded in checkpoint, as cls objects. When it was
+    resumed, only the pages that are not in it are fetched.
+    """
+    checkpoint = checkpoint or NullCheckpoint()
+    query = dict(query)
+    head = checkpoint.track('head', cls)
+    items = head.items
+    if head.last_id is not None:
+        query.pop('offset', None)
+        query['last_id'] = head.last_id
+    ranges = checkpoint.plan
+    if ranges is None and not head.done:
+        page = fetch_page(find, query, page_size)
+        query.pop('offset', None)
+        items += page
+        head.add(page)
+        last = is_last_page(page, query['limit'], page_size)
+        if max_workers > 1 and not last:
+            upper = highest_id(find, query)
+            # A server that ignores the order gives a lower id, then the
+            # query is paginated sequentially.
+            if upper is not None and upper > page[-1].id:
+                ranges = split_id_range(page[-1].id, upper, max_workers)
+                checkpoint.set_plan(ranges)
+        while ranges is None and not last:
+            query['last_id'] = page[-1].id
+            page = fetch_page(find, query, page_size)
+            items += page
+            head.add(page)
+            last = is_last_page(page, query['limit'], page_size)
+        head.finish()
+    if ranges is None:
+        return items
+    pages = map_ordered(
+        lambda r: fetch_id_range(find, query, r[0], r[1], page_size,
+                                 checkpoint.track('range-%s-%s' % tuple(r),
+                                                  cls)),
+        ranges, max_workers)
+    return items + [item for page in pages for item in page]
+
+
+async def call_bounded(executor, func, *args, **kwargs):
+    """Run the blocking func in executor.
+
+    executor is a ThreadPoolExecutor owned by the async loader, whose
+    max_workers caps the calls running at the same time. The default
+    executor of the loop is not used, as it has a few threads only.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        executor, functools.partial(func, *args, **kwargs))
+
+
+async def fetch_page_async(executor, find, query, page_size=None):
+    """Asynchronous version of fetch_page."""
+    return await call_bounded(executor, fetch_page, find, query, page_size)
+
+
+async def gather_ordered(coros):
+    """Await coros concurrently and return their results in order.
+
+    If one of them raises, the others are cancelled and the exception is
+    raised again.
+    """
+    tasks = [asyncio.ensure_future(coro) for coro in coros]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+async def fetch_id_range_async(executor, find, query, lower, upper,
+                               page_size=None):
+    """Asynchronous version of fetch_id_range."""
+    query = dict(query, last_id=lower)
+    query.pop('offset', None)
+    items = []
+    while True:
+        page = await fetch_page_async(executor, find, query, page_size)
+        items += [item for item in page if item.id <= upper]
+        if (is_last_page(page, query['limit'], page_size)
+                or page[-1].id >= upper):
+            return items
+        query['last_id'] = page[-1].id
+
+
+async def fetch_in_id_ranges_async(executor, find, query, lower, parts,
+                                   page_size=None):
+    """Return the items of query with id greater than lower.
+
+    Like the parallel part of fetch_all, the ids up to the highest one are
+    split in parts ranges, paginated concurrently. The number of requests
+    in flight is capped by the threads of executor. Returns None when the
+    server does not tell its highest id, or tells one that is not above
+    lower because it ignores the order, so the caller can paginate
+    sequentially.
+    """
+    upper = await call_bounded(executor, highest_id, find, query)
+    if upper is None or upper <= lower:
+        return None
+    ranges = split_id_range(lower, upper, parts)
+    pages = await gather_ordered(
+        fetch_id_range_async(executor, find, query, start, end, page_size)
+        for start, end in ranges)
+    return [item for page in pages for item in page]
@@ -0,0 +1,207 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Trim and store compactly the records loaded from a server or a file.
+
+The module exports:
+    * Projection: keep only some fields of the records and some keys of
+      their info, as soon as they are parsed, optionally as compact records
+    * CompactTask and CompactTaskRun: records that keep their values in a
+      tuple instead of a dict, with the attribute access of pbclient
+    * compact_columns: the columns of a list of compact records
+
+"""
+import hashlib
+import json
+import pbclient
+
+# The loaders need them to page, filter and group the records.
+KEPT_FIELDS = ('id', 'project_id', 'task_id', 'state')
+
+
+class Projection(object):
+
+    """The fields and info keys of the records to keep.
+
+    columns are the fields of the records, info_keys the keys of their
+    info dict. None keeps them all. The KEPT_FIELDS are always kept, and
+    info too when info_keys are given. With compact=True the records are
+    CompactTask and CompactTaskRun objects instead of pbclient ones.
+    """
+
+    def __init__(self, columns=None, info_keys=None, compact=False):
+        """Init method."""
+        self.compact = compact
+        self.columns = None
+        if columns is not None:
+            self.columns = set(columns) | set(KEPT_FIELDS)
+            if info_keys is not None:
+                self.columns.add('info')
+        self.info_keys = None
+        if info_keys is not None:
+            self.info_keys = set(info_keys)
+
+    def __eq__(self, other):
+        return (isinstance(other, Projection)
+                and self.columns == other.columns
+                and self.info_keys == other.info_keys
+                and self.compact == other.compact)
+
+    @property
+    def keeps_all(self):
+        return self.columns is None and self.info_keys is None
+
+    def name(self, name):
+        """Return name, suffixed for the records of this projection.
+
+        The cache entries and checkpoints of projected records use it, so
+        they are not mistaken for the full records.
+        """
+        if self.keeps_all:
+            return name
+        key = json.dumps([sorted(self.columns or []),
+                          sorted(self.info_keys or [])])
+        return '%s-%s' % (name, hashlib.sha1(key.encode('utf-8'))
+                          .hexdigest()[:8])
+
+    def project(self, data):
+        """Return a dict with the fields of data to keep."""
+        if self.keeps_all:
+            return data
+        if self.columns is not None:
+            data = dict((field, value) for field, value in data.items()
+                        if field in self.columns)
+        if self.info_keys is not None and type(data.get('info')) == dict:
+            data = dict(data, info=dict(
+                (key, value) for key, value in data['info'].items()
+                if key in self.info_keys))
+        return data
+
+    def record_class(self, cls):
+        """Return the class of the records of the pbclient class cls."""
+        if self.compact:
+            return COMPACT_CLASSES[cls]
+        return cls
+
+    def record(self, cls, data):
+        """Return a record of the pbclient class cls with data projected."""
+        return self.record_class(cls)(self.project(data))
+
+    def project_page(self, page):
+        """Return a page of pbclient objects trimmed, and compacted if asked.
+
+        Payloads that are not pages, like errors, are returned as they are.
+        """
+        if type(page) != list:
+            return page
+        if self.compact:
+            return [self.record(type(item), item.data) for item in page]
+        if not self.keeps_all:
+            for item in page:
+                item.data = self.project(item.data)
+        return page
+
+
+class _Layout(object):
+
+    """The keys of the records with the same fields, in the same order."""
+
+    __slots__ = ('keys', 'index')
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.index = dict((key, i) for i, key in enumerate(keys))
+
+
+_layouts = {}
+
+
+def _layout(keys):
+    layout = _layouts.get(keys)
+    if layout is None:
+        layout = _layouts.setdefault(keys, _Layout(keys))
+    return layout
+
+
+class CompactRecord(object):
+
+    """A record with its values in a tuple and its keys in a shared layout.
+
+    It takes a fraction of the memory of a pbclient object, which has a
+    __dict__ and a data dict of its own. The fields are read as
+    attributes, like in pbclient, and data returns a new dict with them.
+    """
+
+    __slots__ = ('_layout', '_values')
+
+    def __init__(self, data):
+        """Init method."""
+        object.__setattr__(self, '_layout', _layout(tuple(data.keys())))
+        object.__setattr__(self, '_values', tuple(data.values()))
+
+    @property
+    def data(self):
+        return dict(zip(self._layout.keys, self._values))
+
+    def __getattr__(self, name):
+        layout = object.__getattribute__(self, '_layout')
+        if name in layout.index:
+            return self._values[layout.index[name]]
+        raise AttributeError('unknown attribute: ' + name)
+
+    def __setattr__(self, name, value):
+        if name == 'data':
+            self.__init__(value)
+            return
+        if name not in self._layout.index:
+            raise AttributeError('unknown attribute: ' + name)
+        values = list(self._values)
+        values[self._layout.index[name]] = value
+        object.__setattr__(self, '_values', tuple(values))
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self.data)
+
+
+class CompactTask(CompactRecord):
+
+    __slots__ = ()
+
+
+class CompactTaskRun(CompactRecord):
+
+    __slots__ = ()
+
+
+COMPACT_CLASSES = {pbclient.Task: CompactTask,
+                   pbclient.TaskRun: CompactTaskRun}
+
+
+def compact_columns(items):
+    """Return a dict with the list of values of every field of items.
+
+    Returns None unless items are compact records with the same layout.
+    """
+    if len(items) == 0 or not isinstance(items[0], CompactRecord):
+        return None
+    layout = items[0]._layout
+    for item in items:
+        if not isinstance(item, CompactRecord) or item._layout is not layout:
+            return None
+    values = zip(*[item._values for item in items])
+    return dict(zip(layout.keys, map(list, values)))
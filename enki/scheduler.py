@@ -0,0 +1,173 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Schedule the pbclient requests within the rate limits of the server.
+
+PyBossa answers 429 when a client goes over its quota, and tells the
+quota left in the X-RateLimit-* headers of every response. This module
+exports:
+    * RequestScheduler: a transport for pbclient that paces the requests
+      with those headers and retries the transient failures
+
+"""
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+import requests
+from .session import record_response_size
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+def parse_retry_after(value, now):
+    """Return the seconds to wait from a Retry-After header, or None."""
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - now)
+    except (TypeError, ValueError):
+        return None
+
+
+class RequestScheduler(object):
+
+    """Pace and retry the requests sent through transport.
+
+    While less than half of the quota is left, the requests are spread
+    evenly until the quota is reset, so it never runs out. The responses
+    with status 429 or 5xx and the connection errors are retried up to
+    max_retries times, waiting as long as Retry-After says or an
+    exponential backoff with full jitter.
+    """
+
+    def __init__(self, transport=None, max_retries=5, backoff=0.5,
+                 max_backoff=60.0, sleep=time.sleep, clock=time.time):
+        """Init method.
+
+        transport is the requests module or a PooledSession. The n-th
+        retry waits a random time up to backoff * 2 ** n seconds, capped
+        to max_backoff.
+        """
+        self.transport = requests if transport is None else transport
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.sleep = sleep
+        self.clock = clock
+        self.interval = 0.0
+        self.next_time = 0.0
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._retries = 0
+        self._waited = 0.0
+
+    def get(self, url, **kwargs):
+        return self.request('get', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('post', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('put', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('delete', url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        """Send a request when the quota allows it, retrying failures."""
+        send = getattr(self.transport, method)
+        attempt = 0
+        while True:
+            self._wait_turn()
+            try:
+                response = send(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+                response = None
+            if response is not None:
+                record_response_size(response)
+                self._update_quota(response)
+                if (response.status_code not in RETRY_STATUS
+                        or attempt >= self.max_retries):
+                    return response
+            self._wait_retry(response, attempt)
+            attempt += 1
+
+    def stats(self):
+        """Return a dict with the requests, retries and seconds waited."""
+        return dict(requests=self._requests, retries=self._retries,
+                    waited=self._waited, interval=self.interval)
+
+    def _wait_turn(self):
+        """Sleep until the next request is allowed by the quota."""
+        with self._lock:
+            now = self.clock()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+            self._requests += 1
+        self._pause(start - now)
+
+    def _wait_retry(self, response, attempt):
+        now = self.clock()
+        delay = None
+        if response is not None:
+            delay = parse_retry_after(response.headers.get('Retry-After'),
+                                      now)
+        if delay is None:
+            cap = min(self.max_backoff, self.backoff * 2 ** attempt)
+            delay = random.uniform(0, cap)
+        with self._lock:
+            self._retries += 1
+            if response is not None and response.status_code == 429:
+                # Every worker waits, not only the throttled one.
+                self.next_time = max(self.next_time, now + delay)
+        self._pause(delay)
+
+    def _update_quota(self, response):
+        """Set the interval between requests from the rate limit headers."""
+        headers = response.headers
+        try:
+            limit = int(headers['X-RateLimit-Limit'])
+            remaining = int(headers['X-RateLimit-Remaining'])
+            reset = float(headers['X-RateLimit-Reset'])
+        except (KeyError, TypeError, ValueError):
+            return
+        now = self.clock()
+        # PyBossa sends the time of the reset, other servers the seconds.
+        window = reset - now if reset > 1e9 else reset
+        with self._lock:
+            if remaining <= 0:
+                self.next_time = max(self.next_time, now + window)
+                self.interval = 0.0
+            elif remaining < limit / 2.0:
+                self.interval = max(0.0, window) / remaining
+                self.next_time = max(self.next_time, now + self.interval)
+            else:
+                self.interval = 0.0
+
+    def _pause(self, seconds):
+        if seconds > 0:
+            with self._lock:
+                self._waited += seconds
+            self.sleep(seconds)
@@ -0,0 +1,116 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Keep-alive HTTP session shared by all the pbclient requests.
+
+pbclient sends every request with the module level functions of
+requests, so a new connection is opened each time. This module exports:
+    * PooledSession: a requests.Session with a connection pool, exposing
+      the get/post/put/delete functions pbclient uses
+    * install: make pbclient send its requests through a session
+    * record_response_size and take_response_size: pass the size of the
+      last response of a thread to the pagination, which weighs the pages
+
+"""
+import threading
+import pbclient
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class PooledSession(object):
+
+    """Pool of keep-alive connections used by pbclient."""
+
+    def __init__(self, pool_size=10):
+        """Init method.
+
+        pool_size is the number of connections kept open per host. When
+        more threads than pool_size send requests, they wait for a free
+        connection instead of opening a new one.
+        """
+        self.pool_size = pool_size
+        self.adapter = HTTPAdapter(pool_connections=pool_size,
+                                   pool_maxsize=pool_size,
+                                   pool_block=True)
+        self.session = requests.Session()
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+        self._lock = threading.Lock()
+        self._requests = 0
+
+    def get(self, url, **kwargs):
+        return self.request('get', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('post', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('put', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('delete', url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        """Send a request using one of the pooled connections."""
+        with self._lock:
+            self._requests += 1
+        response = self.session.request(method, url, **kwargs)
+        record_response_size(response)
+        return response
+
+    def stats(self):
+        """Return a dict with the usage of the connection pool."""
+        pools = self.adapter.poolmanager.pools
+        connections = sum(pools[key].num_connections for key in pools.keys())
+        return dict(pool_size=self.pool_size,
+                    hosts=len(pools),
+                    requests=self._requests,
+                    connections=connections,
+                    reused=max(0, self._requests - connections))
+
+    def close(self):
+        """Close all the pooled connections."""
+        self.session.close()
+
+
+_responses = threading.local()
+
+
+def record_response_size(response):
+    """Keep the size of the body of response for the thread that got it."""
+    content = getattr(response, 'content', None)
+    _responses.size = None if content is None else len(content)
+
+
+def take_response_size():
+    """Return the size recorded for this thread, once, or None."""
+    size = getattr(_responses, 'size', None)
+    _responses.size = None
+    return size
+
+
+def install(session):
+    """Send the pbclient requests through session.
+
+    session is a PooledSession, a RequestScheduler or anything else with
+    the get/post/put/delete functions of requests.
+
+    With session None pbclient goes back to use the requests module.
+    """
+    pbclient.requests = requests if session is None else session
@@ -0,0 +1,264 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Snapshots of the exploded data frames in a columnar format.
+
+The module exports:
+    * save_snapshot: write tasks_df and task_runs_df to a directory
+    * load_snapshot: read them back, with the task runs in a single frame
+    * split_task_frames: the frame of every task, as it was saved
+    * records: the records to rebuild the tasks and task runs
+
+A snapshot is a directory with tasks and task_runs files, in Feather or
+Parquet format, and a metadata.json file. The task runs of all the tasks
+are written as a single frame, the metadata tells the columns and dtypes
+of the task frames to split it back. Columns with dicts, lists or mixed
+values, like info, are stored as JSON strings. pyarrow is needed to read
+and write snapshots.
+"""
+import json
+import os
+import numpy
+import pandas
+from . import dataframer
+
+FORMATS = ('feather', 'parquet')
+VERSION = 1
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.feather
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Snapshots need pyarrow. Install it with "
+                          "pip install pyarrow")
+    return pyarrow
+
+
+def save_snapshot(path, tasks, task_runs, tasks_df, task_runs_df,
+                  format='feather', **metadata):
+    """Write the data frames in a snapshot directory at path.
+
+    tasks and task_runs are the items the frames were built from. Extra
+    keyword arguments are stored in the metadata.
+    """
+    pyarrow = _import_pyarrow()
+    if format not in FORMATS:
+        raise ValueError("Unknown snapshot format %s, use one of %s"
+                         % (format, FORMATS))
+    if not os.path.exists(path):
+        os.makedirs(path)
+    frames = [df for df in task_runs_df.values() if len(df) != 0]
+    combined = pandas.concat(frames) if frames else pandas.DataFrame()
+    all_task_runs = [tr for trs in task_runs.values() for tr in trs]
+    metadata = dict(metadata,
+                    version=VERSION,
+                    format=format,
+                    task_ids=list(task_runs_df.keys()),
+                    tasks=_write_frame(pyarrow, path, 'tasks', tasks_df,
+                                       format),
+                    task_runs=_write_frame(pyarrow, path, 'task_runs',
+                                           combined, format),
+                    task_frames=_frame_layouts(task_runs_df),
+                    task_fields=_fields(tasks),
+                    task_run_fields=_fields(all_task_runs))
+    with open(os.path.join(path, 'metadata.json'), 'w') as metadata_file:
+        json.dump(metadata, metadata_file)
+
+
+def load_snapshot(path):
+    """Return tasks_df, task_runs_df and the metadata of a snapshot.
+
+    task_runs_df is a TaskRunFrames with the frame of all the task runs,
+    as it was read, indexed by (task_id, taskrun_id). Feather files are
+    memory mapped, and converted to pandas once for all the tasks.
+    """
+    pyarrow = _import_pyarrow()
+    with open(os.path.join(path, 'metadata.json')) as metadata_file:
+        metadata = json.load(metadata_file)
+    tasks_df = _read_frame(pyarrow, path, 'tasks', metadata['format'],
+                           metadata['tasks'])
+    combined = _read_frame(pyarrow, path, 'task_runs', metadata['format'],
+                           metadata['task_runs'])
+    if len(combined) == 0:
+        return (tasks_df, dataframer.combine_task_run_data_frames(
+            dict.fromkeys(metadata['task_ids'], combined)), metadata)
+    combined.index = pandas.MultiIndex.from_arrays(
+        [combined['task_id'].values, combined.index],
+        names=['task_id', 'taskrun_id'])
+    return (tasks_df, dataframer.TaskRunFrames(metadata['task_ids'], combined),
+            metadata)
+
+
+def split_task_frames(task_runs_df, metadata):
+    """Return a dict with the frame of every task, as it was saved.
+
+    The tasks whose frames had the same columns and dtypes are selected
+    together, and their dtypes set once, then every task gets a slice.
+    """
+    combined = task_runs_df.frame
+    positions = task_runs_df.positions()
+    frames = {}
+    for layout in metadata['task_frames']:
+        task_ids = [task_id for task_id in layout['task_ids']
+                    if task_id in positions]
+        if len(task_ids) == 0:
+            continue
+        rows = numpy.concatenate([positions[task_id]
+                                  for task_id in task_ids])
+        frame = combined.take(rows)[layout['columns']].astype(
+            dict(zip(layout['columns'], layout['dtypes'])))
+        frame.index = frame.index.droplevel('task_id').rename(None)
+        ends = numpy.cumsum([len(positions[task_id])
+                             for task_id in task_ids])
+        starts = numpy.concatenate([[0], ends[:-1]])
+        for task_id, start, end in zip(task_ids, starts, ends):
+            frames[task_id] = frame.iloc[start:end]
+    return dict((task_id, frames[task_id] if task_id in frames
+                 else dataframer.create_data_frame([]))
+                for task_id in task_runs_df)
+
+
+def records(data_frame, fields):
+    """Return the rows of data_frame as dicts, like the items they came from.
+
+    fields is the metadata of the items fields, so the columns exploded
+    from info are left out. The sparse fields, that not all the items
+    have, are left out of a row when they are missing, the other missing
+    values are None. The int ones get back the ints that pandas turned
+    into floats because of the missing values, and the datetimes of the
+    optimized frames are written back in ISO format.
+    """
+    names = [name for name in data_frame.columns if name in fields['names']]
+    sparse = set(fields['sparse'])
+    ints = set(fields['int'])
+    columns = []
+    missing = {}
+    for name in names:
+        series = data_frame[name]
+        is_missing = series.isna().values
+        values = series.tolist()
+        if is_missing.any():
+            positions = numpy.flatnonzero(is_missing)
+            if name in sparse:
+                missing[name] = positions
+            for position in positions:
+                values[position] = None
+        if name in ints:
+            values = [int(value) if isinstance(value, float) else value
+                      for value in values]
+        if name in dataframer.TIMESTAMP_FIELDS:
+            values = [value.isoformat()
+                      if isinstance(value, pandas.Timestamp) else value
+                      for value in values]
+        columns.append(values)
+    result = [dict(zip(names, row)) for row in zip(*columns)]
+    if len(names) == 0:
+        result = [{} for _ in range(len(data_frame))]
+    for name, positions in missing.items():
+        for position in positions:
+            del result[position][name]
+    return result
+
+
+def _write_frame(pyarrow, path, name, data_frame, format):
+    """Write data_frame to path and return the names of its JSON columns."""
+    data_frame = data_frame.copy()
+    json_columns = [column for column in data_frame.columns
+                    if _needs_json(data_frame[column])]
+    for column in json_columns:
+        data_frame[column] = data_frame[column].map(_to_json)
+    table = pyarrow.Table.from_pandas(data_frame, preserve_index=True)
+    filename = os.path.join(path, '%s.%s' % (name, format))
+    if format == 'feather':
+        # Uncompressed, so the file can be memory mapped as it is.
+        pyarrow.feather.write_feather(table, filename,
+                                      compression='uncompressed')
+    else:
+        pyarrow.parquet.write_table(table, filename)
+    return dict(json_columns=json_columns)
+
+
+def _read_frame(pyarrow, path, name, format, frame_metadata):
+    filename = os.path.join(path, '%s.%s' % (name, format))
+    if format == 'feather':
+        table = pyarrow.feather.read_table(filename, memory_map=True)
+    else:
+        table = pyarrow.parquet.read_table(filename, memory_map=True)
+    data_frame = table.to_pandas()
+    for column in frame_metadata['json_columns']:
+        data_frame[column] = data_frame[column].map(_from_json).astype(object)
+    return data_frame
+
+
+def _frame_layouts(task_runs_df):
+    """Group the task ids by the columns and dtypes of their frames."""
+    layouts = {}
+    for task_id, data_frame in task_runs_df.items():
+        columns = [str(column) for column in data_frame.columns]
+        dtypes = [str(dtype) for dtype in data_frame.dtypes]
+        key = (tuple(columns), tuple(dtypes))
+        layout = layouts.setdefault(key, dict(columns=columns, dtypes=dtypes,
+                                              task_ids=[]))
+        layout['task_ids'].append(task_id)
+    return list(layouts.values())
+
+
+def _fields(items):
+    """Return the fields of the items, the ones that only some of the
+    items have and the ones that only have ints or None."""
+    keys = [set(item.data.keys()) for item in items]
+    if len(keys) == 0:
+        return dict(names=[], sparse=[], int=[])
+    types = {}
+    for item in items:
+        for field, value in item.data.items():
+            if value is not None:
+                types.setdefault(field, set()).add(type(value))
+    return dict(names=sorted(set.union(*keys)),
+                sparse=sorted(set.union(*keys) - set.intersection(*keys)),
+                int=sorted(field for field, found in types.items()
+                           if found == set([int])))
+
+
+def _needs_json(series):
+    if series.dtype != object:
+        return False
+    return any(not isinstance(value, str) for value in series
+               if not _is_missing(value))
+
+
+def _is_missing(value):
+    return (value is None or value is pandas.NaT
+            or (isinstance(value, float) and value != value))
+
+
+def _to_json(value):
+    # NaN, the missing keys, is kept apart from None, the null values.
+    if value is None:
+        return None
+    return json.dumps(value, default=str)
+
+
+def _from_json(value):
+    # pyarrow may read the null cells back as NaN rather than None.
+    if not isinstance(value, str):
+        return None
+    return json.loads(value)
@@ -16,25 +16,124 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
 import json
 import pbclient
+from concurrent.futures import ThreadPoolExecutor
+from .json_reader import open_json_file, iter_json_array
+from .checkpoint import NullCheckpoint
+from .records import Projection
+from .pagination import PageSize, fetch_page, fetch_all, fetch_page_async, \
+    fetch_in_id_ranges_async, is_last_page, highest_id, map_ordered
 
 
 class ServerTasksLoader(object):
 
-    def __init__(self, project_id, task_id=None, state='completed', all=0):
+    def __init__(self, project_id, task_id=None, state='completed', all=0,
+                 max_workers=1, max_page_size=100, last_id=None, cache=None,
+                 checkpoint=None, projection=None):
         self.query = self._build_query(project_id, task_id, state, all)
+        self.projection = projection or Projection()
+        self.max_workers = max_workers
+        self.page_size = None
+        self.cache = None
+        self.checkpoint = NullCheckpoint()
+        if task_id is None:
+            self.page_size = PageSize(self.query['limit'], max_page_size)
+            self.cache = cache
+            self.checkpoint = checkpoint or self.checkpoint
+        if last_id is not None:
+            self._resume_from(last_id)
 
     def load(self):
-        self.tasks = pbclient.find_tasks(**self.query)
-        last_fetched_tasks = self.tasks
-        del self.query['offset']
-        while self._tasks_not_exhausted(last_fetched_tasks):
-            self.query['last_id'] = last_fetched_tasks[-1].id
-            last_fetched_tasks = pbclient.find_tasks(**self.query)
-            self.tasks += last_fetched_tasks
+        try:
+            if self.cache is not None:
+                tasks = self._load_with_cache()
+            else:
+                tasks = self._load()
+        except BaseException:
+            self.checkpoint.flush()
+            raise
+        self.checkpoint.remove()
+        return tasks
+
+    def _load(self):
+        if self.query.get('id') is not None:
+            self.tasks = fetch_page(self._find_tasks, self.query)
+        else:
+            cls = self.projection.record_class(pbclient.Task)
+            self.tasks = fetch_all(self._find_tasks, self.query, cls,
+                                   self.max_workers, self.page_size,
+                                   self.checkpoint)
         return self.tasks
 
+    def _load_with_cache(self):
+        """Load only the tasks newer than the cached ones.
+
+        The older tasks that got task runs since the last load may have
+        changed their state, e.g. from ongoing to completed, so they are
+        downloaded again.
+        """
+        name = self.projection.name('tasks-%s' % self.query['state'])
+        entry = self.cache.load(name)
+        if entry is None:
+            task_run_last_id = self._highest_task_run_id()
+            tasks = self._load()
+            last_id = 0
+        else:
+            cached = dict((t['id'], self.projection.record(pbclient.Task, t))
+                          for t in entry['records'])
+            task_run_last_id = entry.get('task_run_last_id', 0)
+            new = self._fetch_task_runs(task_run_last_id)
+            if len(new) != 0:
+                task_run_last_id = max(task_run_last_id, new[-1].id)
+            changed = sorted(set(tr.task_id for tr in new
+                                 if tr.task_id <= entry['last_id']))
+            fetched = map_ordered(self._fetch_task, changed, self.max_workers)
+            for task_id, found in zip(changed, fetched):
+                cached.pop(task_id, None)
+                for task in found:
+                    cached[task.id] = task
+            self._resume_from(entry['last_id'])
+            for task in self._load():
+                cached[task.id] = task
+            tasks = [cached[task_id] for task_id in sorted(cached.keys())]
+            last_id = entry['last_id']
+        if len(tasks) != 0:
+            last_id = max(last_id, tasks[-1].id)
+        self.cache.save(name, [t.data for t in tasks], last_id,
+                        task_run_last_id=task_run_last_id)
+        self.tasks = tasks
+        return tasks
+
+    def _highest_task_run_id(self):
+        """Return the highest task run id of the project, or 0."""
+        query = dict(project_id=self.query['project_id'],
+                     all=self.query['all'])
+        return highest_id(pbclient.find_taskruns, query) or 0
+
+    def _fetch_task_runs(self, last_id):
+        """Return the task runs of the project newer than last_id."""
+        query = dict(project_id=self.query['project_id'], limit=100,
+                     last_id=last_id, all=self.query['all'])
+        page_size = PageSize(100, self.page_size.max_limit)
+        return fetch_all(pbclient.find_taskruns, query, pbclient.TaskRun,
+                         self.max_workers, page_size)
+
+    def _fetch_task(self, task_id):
+        """Return the task task_id if it still matches the query state."""
+        query = dict(project_id=self.query['project_id'], id=task_id,
+                     limit=1, all=self.query['all'])
+        return [task for task in fetch_page(self._find_tasks, query)
+                if task.state == self.query['state']]
+
+    def _find_tasks(self, **query):
+        return self.projection.project_page(pbclient.find_tasks(**query))
+
+    def _resume_from(self, last_id):
+        self.query.pop('offset', None)
+        self.query['last_id'] = last_id
+
     def _build_query(self, project_id, task_id, state, all):
         if task_id is not None:
             query = dict(project_id=project_id,
@@ -51,30 +150,102 @@ class ServerTasksLoader(object):
         return query
 
     def _tasks_not_exhausted(self, last_fetched_tasks):
-        return (len(last_fetched_tasks) != 0
-                and len(last_fetched_tasks) == self.query['limit']
-                and self.query.get('id') is None)
+        # The limit changes from page to page, so a page is compared with
+        # the limit it was requested with, which is still in the query.
+        return (self.query.get('id') is None
+                and not is_last_page(last_fetched_tasks, self.query['limit'],
+                                     self.page_size))
+
+
+class AsyncServerTasksLoader(ServerTasksLoader):
+
+    """Load the tasks from the server without blocking the event loop.
+
+    At most max_workers requests are in flight at the same time.
+    """
+
+    async def load(self):
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            return await self._load_async(executor)
+        finally:
+            executor.shutdown(wait=False)
+
+    async def _load_async(self, executor):
+        self.tasks = await fetch_page_async(executor, self._find_tasks,
+                                            self.query, self.page_size)
+        last_fetched_tasks = self.tasks
+        self.query.pop('offset', None)
+        not_exhausted = self._tasks_not_exhausted(last_fetched_tasks)
+        if self.max_workers > 1 and not_exhausted:
+            remaining = await fetch_in_id_ranges_async(
+                executor, self._find_tasks, self.query,
+                last_fetched_tasks[-1].id, self.max_workers, self.page_size)
+            if remaining is not None:
+                self.tasks += remaining
+                return self.tasks
+        while not_exhausted:
+            self.query['last_id'] = last_fetched_tasks[-1].id
+            last_fetched_tasks = await fetch_page_async(
+                executor, self._find_tasks, self.query, self.page_size)
+            self.tasks += last_fetched_tasks
+            not_exhausted = self._tasks_not_exhausted(last_fetched_tasks)
+        return self.tasks
 
 
 class JsonTasksLoader(object):
 
-    def __init__(self, json_file, project_id, task_id=None, state=None):
+    def __init__(self, json_file, project_id, task_id=None, state=None,
+                 stream=False, projection=None):
         self.json_file = json_file
         self.project_id = project_id
         self.task_id = task_id
         self.state = state
+        self.stream = stream
+        self.projection = projection or Projection()
 
     def load(self):
-        json_file_data = open(self.json_file).read()
-        file_tasks = json.loads(json_file_data)
-        if self.task_id is None:
-            return [pbclient.Task(t) for t in file_tasks
-                    if (not self.project_id or self.project_id == t['project_id'])
-                    and (not self.state or self.state == t['state'])]
-        return [pbclient.Task(t) for t in file_tasks if t['id'] == self.task_id]
+        with open_json_file(self.json_file) as json_file:
+            if self.stream:
+                file_tasks = iter_json_array(json_file)
+            else:
+                file_tasks = json.load(json_file)
+            record = self.projection.record
+            if self.task_id is None:
+                return [record(pbclient.Task, t) for t in file_tasks
+                        if (not self.project_id or self.project_id == t['project_id'])
+                        and (not self.state or self.state == t['state'])]
+            return [record(pbclient.Task, t) for t in file_tasks
+                    if t['id'] == self.task_id]
+
+
+class AsyncJsonTasksLoader(JsonTasksLoader):
+
+    """Load the tasks from a JSON file in the default executor."""
+
+    async def load(self):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, super().load)
+
+
+def create_tasks_loader(project_id, task_id, state, json_file, all=0,
+                        max_workers=1, max_page_size=100, stream=False,
+                        cache=None, last_id=None, checkpoint=None,
+                        projection=None):
+    if json_file is not None:
+        return JsonTasksLoader(json_file, project_id, task_id, state, stream,
+                               projection)
+    return ServerTasksLoader(project_id, task_id, state, all, max_workers,
+                             max_page_size, last_id=last_id, cache=cache,
+                             checkpoint=checkpoint, projection=projection)
 
 
-def create_tasks_loader(project_id, task_id, state, json_file, all=0):
+def create_async_tasks_loader(project_id, task_id, state, json_file, all=0,
+                              max_workers=1, max_page_size=100, stream=False,
+                              projection=None):
     if json_file is not None:
-        return JsonTasksLoader(json_file, project_id, task_id, state)
-    return ServerTasksLoader(project_id, task_id, state, all)
+        return AsyncJsonTasksLoader(json_file, project_id, task_id, state,
+                                    stream, projection)
+    return AsyncServerTasksLoader(project_id, task_id, state, all,
+                                  max_workers, max_page_size,
+                                  projection=projection)
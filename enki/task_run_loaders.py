@@ -16,58 +16,268 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
 import json
 import pbclient
-from .exceptions import Error, PyBossaServerNoKeysetPagination
+from concurrent.futures import ThreadPoolExecutor
+from .json_reader import open_json_file, iter_json_array
+from .checkpoint import NullCheckpoint
+from .records import Projection
+from .pagination import check_errors, PageSize, fetch_page, map_ordered, \
+    fetch_all, fetch_page_async, gather_ordered, fetch_in_id_ranges_async, \
+    is_last_page
 
 class ServerTaskRunsLoader(object):
 
-    def __init__(self, project_id, tasks, all=0):
+    def __init__(self, project_id, tasks, all=0, project_wide=False,
+                 max_workers=1, max_page_size=100, last_id=None, cache=None,
+                 checkpoint=None, projection=None):
         self.project_id = project_id
         self.tasks = tasks
         self.all = all
+        self.project_wide = project_wide
+        self.max_workers = max_workers
+        self.page_size = PageSize(100, max_page_size)
+        self.last_id = last_id
+        self.cache = cache
+        self.checkpoint = checkpoint or NullCheckpoint()
+        self.projection = projection or Projection()
 
     def check_errors(self, data):
         """Check for errors on data payload."""
-
-        if (type(data) == dict and 'status' in list(data.keys())
-            and data['status'] == 'failed'):
-            if data.get('exception_msg') and 'last_id' in data.get('exception_msg'):
-                raise PyBossaServerNoKeysetPagination
-            else:
-                raise Error(data)
-        return False
+        return check_errors(data)
 
     def load(self):
+        try:
+            task_runs = self._load()
+        except BaseException:
+            self.checkpoint.flush()
+            raise
+        self.checkpoint.remove()
+        return (task_runs, None)
+
+    def iter_task_runs(self):
+        """Yield every task with all its task runs, in the order of tasks.
+
+        The task runs of max_workers tasks at a time are fetched
+        concurrently, and they are not kept, cached or checkpointed.
+        """
+        batch_size = max(1, self.max_workers) * 4
+        for start in range(0, len(self.tasks), batch_size):
+            tasks = self.tasks[start:start + batch_size]
+            fetched = map_ordered(self._load_task_task_runs, tasks,
+                                  self.max_workers)
+            for task, task_runs in zip(tasks, fetched):
+                yield task, task_runs
+
+    def _load(self):
+        if self.cache is not None:
+            return self._load_with_cache()
+        if self.project_wide:
+            return self._load_project_task_runs()
+        fetched = map_ordered(self._load_task_task_runs, self.tasks,
+                              self.max_workers)
         task_runs = {}
+        for t, taskruns in zip(self.tasks, fetched):
+            task_runs[t.id] = taskruns
+        return task_runs
 
-        for t in self.tasks:
-            limit = 100
-            task_runs[t.id] = []
-            taskruns = pbclient.find_taskruns(project_id=self.project_id,
-                                              task_id=t.id,
-                                              limit=limit,
-                                              offset=0,
-                                              all=self.all)
-            while(len(taskruns) != 0):
-                self.check_errors(taskruns)
-                task_runs[t.id] += taskruns
-                last_id = taskruns[-1].id
-                taskruns = pbclient.find_taskruns(
-                    project_id=self.project_id,
-                    task_id=t.id,
-                    limit=limit,
-                    last_id=last_id,
-                    all=self.all)
+    def _load_task_task_runs(self, task, last_id=None):
+        """Return all the task runs of one task newer than last_id.
+
+        The task runs already in the checkpoint are not fetched again.
+        """
+        cls = self.projection.record_class(pbclient.TaskRun)
+        progress = self.checkpoint.track('task-%s' % task.id, cls)
+        if progress.done:
+            return progress.items
+        if progress.last_id is not None:
+            last_id = progress.last_id
+        query = self._task_query(task, last_id)
+        task_runs = progress.items
+        taskruns = fetch_page(self._find_task_runs, query, self.page_size)
+        query.pop('offset', None)
+        while(len(taskruns) != 0):
+            task_runs += taskruns
+            progress.add(taskruns)
+            query['last_id'] = taskruns[-1].id
+            taskruns = fetch_page(self._find_task_runs, query,
+                                  self.page_size)
+        progress.finish()
+        return task_runs
+
+    def _load_project_task_runs(self):
+        """Page through all the project task runs and group them by task."""
+        return self._group_by_task(self._fetch_project_task_runs(self.last_id))
+
+    def _fetch_project_task_runs(self, last_id=None):
+        """Return all the project task runs newer than last_id."""
+        return fetch_all(self._find_task_runs, self._project_query(last_id),
+                         self.projection.record_class(pbclient.TaskRun),
+                         self.max_workers, self.page_size, self.checkpoint)
+
+    def _load_with_cache(self):
+        """Load only the task runs newer than the cached ones."""
+        if self.project_wide:
+            return self._load_project_task_runs_with_cache()
+        name = self.projection.name('task_runs')
+        entry = self.cache.load(name)
+        cached = {}
+        fetched_task_ids = set()
+        if entry is not None:
+            for data in entry['records']:
+                cached.setdefault(data['task_id'], []).append(
+                    self.projection.record(pbclient.TaskRun, data))
+            fetched_task_ids = set(entry['task_ids'])
+
+        def load_task(task):
+            if task.id not in fetched_task_ids:
+                return [], self._load_task_task_runs(task)
+            old = cached.get(task.id, [])
+            last_id = old[-1].id if len(old) != 0 else 0
+            return old, self._load_task_task_runs(task, last_id)
+
+        task_runs = {}
+        fetched = map_ordered(load_task, self.tasks, self.max_workers)
+        for t, (old, new) in zip(self.tasks, fetched):
+            task_runs[t.id] = cached[t.id] = old + new
+        records = [tr.data for trs in cached.values() for tr in trs]
+        last_id = max([data['id'] for data in records] + [0])
+        task_ids = sorted(fetched_task_ids | set(task_runs.keys()))
+        self.cache.save(name, records, last_id, task_ids=task_ids)
+        return task_runs
+
+    def _load_project_task_runs_with_cache(self):
+        name = self.projection.name('project_task_runs')
+        entry = self.cache.load(name)
+        if entry is None:
+            cached, last_id = [], None
+        else:
+            cached = [self.projection.record(pbclient.TaskRun, data)
+                      for data in entry['records']]
+            last_id = entry['last_id']
+        new = self._fetch_project_task_runs(last_id)
+        fetched = cached + new
+        if len(fetched) != 0:
+            last_id = max(last_id or 0, fetched[-1].id)
+        self.cache.save(name, [tr.data for tr in fetched], last_id or 0)
+        return self._group_by_task(fetched)
+
+    def _find_task_runs(self, **query):
+        return self.projection.project_page(pbclient.find_taskruns(**query))
+
+    def _task_query(self, task, last_id=None):
+        query = dict(project_id=self.project_id,
+                     task_id=task.id,
+                     limit=self.page_size.limit,
+                     offset=0,
+                     all=self.all)
+        return self._resume_from(query, last_id)
+
+    def _project_query(self, last_id=None):
+        query = dict(project_id=self.project_id,
+                     limit=self.page_size.limit,
+                     offset=0,
+                     all=self.all)
+        return self._resume_from(query, last_id)
+
+    def _resume_from(self, query, last_id):
+        if last_id is not None:
+            del query['offset']
+            query['last_id'] = last_id
+        return query
+
+    def _group_by_task(self, fetched):
+        """Group the fetched task runs by task.
+
+        Without tasks, the task runs of every task are kept.
+        """
+        if self.tasks is None:
+            task_runs = {}
+            for tr in fetched:
+                task_runs.setdefault(tr.task_id, []).append(tr)
+            return task_runs
+        task_runs = dict((t.id, []) for t in self.tasks)
+        for tr in fetched:
+            if tr.task_id in task_runs:
+                task_runs[tr.task_id].append(tr)
+        return task_runs
+
+
+class AsyncServerTaskRunsLoader(ServerTaskRunsLoader):
+
+    """Load the task runs from the server without blocking the event loop.
+
+    At most max_workers requests are in flight at the same time.
+    """
+
+    async def load(self):
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            if self.project_wide:
+                return (await self._load_project_task_runs(), None)
+            fetched = await gather_ordered(self._load_task_task_runs(t)
+                                           for t in self.tasks)
+        finally:
+            self.executor.shutdown(wait=False)
+        task_runs = {}
+        for t, taskruns in zip(self.tasks, fetched):
+            task_runs[t.id] = taskruns
         return (task_runs, None)
 
+    async def _load_task_task_runs(self, task):
+        """Return all the task runs of one task."""
+        query = self._task_query(task)
+        task_runs = []
+        taskruns = await fetch_page_async(self.executor,
+                                          self._find_task_runs, query,
+                                          self.page_size)
+        query.pop('offset', None)
+        while(len(taskruns) != 0):
+            task_runs += taskruns
+            query['last_id'] = taskruns[-1].id
+            taskruns = await fetch_page_async(self.executor,
+                                              self._find_task_runs, query,
+                                              self.page_size)
+        return task_runs
+
+    async def _load_project_task_runs(self):
+        """Page through all the project task runs and group them by task."""
+        query = self._project_query(self.last_id)
+        taskruns = await fetch_page_async(self.executor,
+                                          self._find_task_runs, query,
+                                          self.page_size)
+        query.pop('offset', None)
+        fetched = list(taskruns)
+        remaining = None
+        last = is_last_page(taskruns, query['limit'], self.page_size)
+        if self.max_workers > 1 and not last:
+            remaining = await fetch_in_id_ranges_async(
+                self.executor, self._find_task_runs, query,
+                taskruns[-1].id, self.max_workers, self.page_size)
+        if remaining is not None:
+            fetched += remaining
+        else:
+            while not last:
+                query['last_id'] = taskruns[-1].id
+                taskruns = await fetch_page_async(self.executor,
+                                                  self._find_task_runs,
+                                                  query, self.page_size)
+                fetched += taskruns
+                last = is_last_page(taskruns, query['limit'],
+                                    self.page_size)
+        return self._group_by_task(fetched)
+
 
 class JsonTaskRunsLoader(object):
 
-    def __init__(self, project_id, tasks, json_file):
+    def __init__(self, project_id, tasks, json_file, stream=False,
+                 projection=None):
         self.project_id = project_id
         self.tasks = tasks
         self.json_file = json_file
+        self.stream = stream
+        self.projection = projection or Projection()
 
     def load(self):
         self.task_runs = {}
@@ -78,19 +288,98 @@ class JsonTaskRunsLoader(object):
         return (self.task_runs, self.task_runs_file)
 
     def _load_from_json(self):
-        json_file_data = open(self.json_file).read()
-        file_task_runs = json.loads(json_file_data)
-        for tr in file_task_runs:
-            self.task_runs_file.append(pbclient.TaskRun(tr))
+        with open_json_file(self.json_file) as json_file:
+            if self.stream:
+                file_task_runs = self._stream_task_runs(json_file)
+            else:
+                file_task_runs = json.load(json_file)
+            record = self.projection.record
+            for tr in file_task_runs:
+                self.task_runs_file.append(record(pbclient.TaskRun, tr))
+
+    def iter_task_runs(self):
+        """Yield every task with all its task runs, as soon as they are read.
+
+        The file is streamed twice, first to count the task runs of every
+        task, then to yield them, so only the task runs of the tasks that
+        are not complete yet are kept in memory. The tasks without task
+        runs come first, then the others in the order they are completed.
+        """
+        counts = dict((t.id, 0) for t in self.tasks)
+        with open_json_file(self.json_file) as json_file:
+            for tr in self._stream_task_runs(json_file):
+                counts[tr['task_id']] += 1
+        tasks = {}
+        for t in self.tasks:
+            if counts[t.id] == 0:
+                yield t, []
+            tasks[t.id] = t
+        pending = {}
+        record = self.projection.record
+        with open_json_file(self.json_file) as json_file:
+            for tr in self._stream_task_runs(json_file):
+                task_runs = pending.setdefault(tr['task_id'], [])
+                task_runs.append(record(pbclient.TaskRun, tr))
+                if len(task_runs) == counts[tr['task_id']]:
+                    del pending[tr['task_id']]
+                    yield tasks[tr['task_id']], task_runs
+
+    def _stream_task_runs(self, json_file):
+        """Yield only the task runs of the loaded tasks."""
+        task_ids = set(t.id for t in self.tasks)
+        for tr in iter_json_array(json_file):
+            if tr['task_id'] in task_ids and tr['project_id'] == self.project_id:
+                yield tr
 
     def _group_json_task_runs_by_task_id(self):
+        self._index_task_runs()
         for t in self.tasks:
-            self.task_runs[t.id] = [tr for tr in self.task_runs_file
-                                    if (tr.task_id == t.id
-                                    and tr.project_id == self.project_id)]
+            self.task_runs[t.id] = self.lookup(t.id)
+
+    def _index_task_runs(self):
+        """Index task_runs_file by (project_id, task_id) in a single pass."""
+        self.index = {}
+        for tr in self.task_runs_file:
+            key = (getattr(tr, 'project_id', None),
+                   getattr(tr, 'task_id', None))
+            self.index.setdefault(key, []).append(tr)
+
+    def lookup(self, task_id, project_id=None):
+        """Return the task runs of task_id in the loaded file."""
+        if project_id is None:
+            project_id = self.project_id
+        return list(self.index.get((project_id, task_id), []))
+
+
+class AsyncJsonTaskRunsLoader(JsonTaskRunsLoader):
+
+    """Load the task runs from a JSON file in the default executor."""
+
+    async def load(self):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, super().load)
+
+
+def create_task_runs_loader(project_id, tasks, json_file, all=0,
+                            project_wide=False, max_workers=1,
+                            max_page_size=100, stream=False, cache=None,
+                            last_id=None, checkpoint=None, projection=None):
+    if json_file is not None:
+        return JsonTaskRunsLoader(project_id, tasks, json_file, stream,
+                                  projection)
+    return ServerTaskRunsLoader(project_id, tasks, all, project_wide,
+                                max_workers, max_page_size, last_id=last_id,
+                                cache=cache, checkpoint=checkpoint,
+                                projection=projection)
 
 
-def create_task_runs_loader(project_id, tasks, json_file, all=0):
+def create_async_task_runs_loader(project_id, tasks, json_file, all=0,
+                                  project_wide=False, max_workers=1,
+                                  max_page_size=100, stream=False,
+                                  projection=None):
     if json_file is not None:
-        return JsonTaskRunsLoader(project_id, tasks, json_file)
-    return ServerTaskRunsLoader(project_id, tasks, all)
+        return AsyncJsonTaskRunsLoader(project_id, tasks, json_file, stream,
+                                       projection)
+    return AsyncServerTaskRunsLoader(project_id, tasks, all, project_wide,
+                                     max_workers, max_page_size,
+                                     projection=projection)
@@ -6,6 +6,7 @@ setup(
     version='3.0.0',
     packages=find_packages(),
     install_requires=['pybossa-client>=3.0.0, <3.1.0', 'pandas'],
+    extras_require={'snapshot': ['pyarrow']},
     # metadata for upload to PyPI
     author='Scifabric LTD',
     author_email='info@scifabric.com',
@@ -109,3 +109,26 @@ class TestEnki(object):
     def check_error_output(self, res, err):
         for k in list(err.keys()):
             assert err[k] == res[k], err
+
+
+def fake_find(items, cls, max_limit=None):
+    """Return a fake pbclient find function paginating over items.
+
+    With max_limit, the pages are capped like the PyBossa server does.
+    """
+    def find(**query):
+        found = [i for i in items
+                 if query.get('id') in (None, i.get('id'))
+                 and query.get('task_id') in (None, i.get('task_id'))
+                 and query.get('state') in (None, i.get('state'))]
+        if query.get('desc'):
+            found = found[::-1]
+        if query.get('last_id') is not None:
+            found = [i for i in found if i['id'] > query['last_id']]
+        else:
+            found = found[query.get('offset', 0):]
+        limit = query['limit']
+        if max_limit is not None:
+            limit = min(limit, max_limit)
+        return [cls(dict(i)) for i in found[:limit]]
+    return find
@@ -0,0 +1,122 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""Package to test the consensus of the task runs."""
+import pandas
+import pbclient
+from enki import aggregation, dataframer
+
+
+def task_runs():
+    answers = {1: ['No', 'Yes', 'Yes'], 2: [None, 'No'], 3: ['Yes', 'No']}
+    scores = {1: [1, 3, '?'], 2: [None, None], 3: [2, 5]}
+    return dict((task_id, [pbclient.TaskRun(dict(
+        id=task_id * 10 + n, task_id=task_id,
+        info=dict(answer=answer, bbox=dict(x=scores[task_id][n]))))
+        for n, answer in enumerate(answers[task_id])])
+        for task_id in answers)
+
+
+class TestAnswersFrame(object):
+
+    def test_one_row_per_task_run(self):
+        """Test the frame has the task id and the keys of every task run."""
+        items = task_runs()
+        items[4] = [pbclient.TaskRun(dict(id=40, task_id=4, info='text')),
+                    pbclient.TaskRun(dict(id=41, task_id=4, info=dict(
+                        answer=['a', 'b'])))]
+        frame = aggregation.answers_frame(items, ['answer', 'bbox.x'])
+        assert list(frame.columns) == ['task_id', 'answer', 'bbox.x']
+        assert list(frame['task_id']) == [1, 1, 1, 2, 2, 3, 3, 4, 4]
+        assert list(frame['bbox.x'][:3]) == [1, 3, '?']
+        assert frame['answer'][8] == ('a', 'b')
+        assert pandas.isna(frame['answer'][7])
+
+    def test_fields(self):
+        """Test the fields of the task runs are added before the keys."""
+        frame = aggregation.answers_frame(task_runs(), ['answer'],
+                                          fields=['id', 'user_id'])
+        assert list(frame.columns) == ['task_id', 'id', 'user_id', 'answer']
+        assert list(frame['id']) == [10, 11, 12, 20, 21, 30, 31]
+        assert frame['user_id'].isna().all()
+
+
+class TestMajorityVote(object):
+
+    def setup_method(self):
+        self.frame = aggregation.answers_frame(task_runs(),
+                                               ['answer', 'bbox.x'])
+
+    def test_majority_vote(self):
+        """Test the most voted answer, its votes and confidence."""
+        result = aggregation.majority_vote(self.frame, 'answer')
+        assert list(result.index) == [1, 2, 3]
+        assert list(result['answer_majority']) == ['Yes', 'No', 'Yes']
+        assert list(result['answer_votes']) == [2, 1, 1]
+        assert list(result['answer_count']) == [3, 1, 2]
+        assert list(result['answer_confidence']) == [2 / 3.0, 1, 0.5]
+
+    def test_categorical_answers(self):
+        """Test the answers of an optimized frame are voted the same."""
+        frame = self.frame.astype(dict(answer='category'))
+        result = aggregation.majority_vote(frame, 'answer')
+        assert list(result['answer_majority']) == ['Yes', 'No', 'Yes']
+        assert list(result['answer_count']) == [3, 1, 2]
+
+    def test_vote_counts(self):
+        """Test the task x answer matrix of votes and its distribution."""
+        counts = aggregation.vote_counts(self.frame, 'answer')
+        assert sorted(counts.columns) == ['No', 'Yes']
+        assert list(counts.loc[1, ['No', 'Yes']]) == [1, 2]
+        assert list(counts.loc[2, ['No', 'Yes']]) == [1, 0]
+        shares = aggregation.vote_counts(self.frame, 'answer', normalize=True)
+        assert list(shares.loc[3, ['No', 'Yes']]) == [0.5, 0.5]
+
+
+class TestAggregate(object):
+
+    def test_numeric_summary(self):
+        """Test the mean and median skip the values that are not numbers."""
+        frame = aggregation.answers_frame(task_runs(), ['bbox.x'])
+        result = aggregation.numeric_summary(frame, 'bbox.x')
+        assert list(result.columns) == ['bbox.x_mean', 'bbox.x_median']
+        assert result.loc[1, 'bbox.x_mean'] == 2
+        assert pandas.isna(result.loc[2, 'bbox.x_mean'])
+        assert result.loc[3, 'bbox.x_median'] == 3.5
+
+    def test_joins_the_tasks(self):
+        """Test the consensus is joined to the tasks, with all of them."""
+        tasks = [pbclient.Task(dict(id=task_id, info=dict(question='q')))
+                 for task_id in range(1, 5)]
+        frame = aggregation.answers_frame(task_runs(), ['answer', 'bbox.x'])
+        result = aggregation.aggregate(frame, numeric=['bbox.x'],
+                                       tasks_df=dataframer.create_data_frame(
+                                           tasks))
+        assert list(result.index) == [1, 2, 3, 4]
+        assert list(result.columns[:3]) == ['id', 'info', 'question']
+        assert list(result['answer_majority'][:3]) == ['Yes', 'No', 'Yes']
+        assert result.loc[3, 'bbox.x_mean'] == 3.5
+        assert pandas.isna(result.loc[4, 'answer_majority'])
+
+    def test_combined_frame(self):
+        """Test the frame of the combined layout can be aggregated."""
+        items = task_runs()
+        tasks = [pbclient.Task(dict(id=task_id)) for task_id in items]
+        combined = dataframer.create_combined_task_run_data_frames(
+            tasks, items, optimizer=dataframer.DtypeOptimizer())
+        result = aggregation.aggregate(combined.frame)
+        assert list(result['answer_majority']) == ['Yes', 'No', 'Yes']
@@ -0,0 +1,113 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""Package to test the agreement of the task runs."""
+import itertools
+import random
+import pandas
+from enki import agreement
+from nose.tools import raises
+
+# Fleiss' example of 10 subjects rated by 14 raters in 5 categories.
+FLEISS_TABLE = [[0, 0, 0, 0, 14], [0, 2, 6, 4, 2], [0, 0, 3, 5, 6],
+                [0, 3, 9, 2, 0], [2, 2, 8, 1, 1], [7, 7, 0, 0, 0],
+                [3, 2, 6, 3, 0], [2, 5, 3, 2, 2], [6, 5, 2, 1, 0],
+                [0, 2, 2, 3, 7]]
+
+
+def answers(table):
+    return pandas.DataFrame(
+        [(task_id, answer) for task_id, row in enumerate(table, 1)
+         for answer, votes in enumerate(row) for _ in range(votes)],
+        columns=['task_id', 'answer'])
+
+
+def random_answers():
+    rng = random.Random(1)
+    rows = []
+    for task_id in range(60):
+        truth = rng.randint(0, 3)
+        for _ in range(rng.randint(1, 6)):
+            rows.append((task_id, truth if rng.random() < 0.6
+                         else rng.randint(0, 3)))
+    frame = pandas.DataFrame(rows, columns=['task_id', 'answer'])
+    frame['x'] = frame['answer'] * 1.5 + 1000
+    return frame
+
+
+def pairwise_alpha(frame, key, distance):
+    """Krippendorff's alpha from its definition, comparing every pair."""
+    groups = [list(group[key]) for _, group in frame.groupby('task_id')
+              if len(group) >= 2]
+    total = sum(map(len, groups))
+    observed = sum(sum(distance(a, b) for a, b in
+                       itertools.permutations(group, 2)) / (len(group) - 1)
+                   for group in groups) / total
+    values = sum(groups, [])
+    expected = sum(distance(a, b) for a, b in
+                   itertools.permutations(values, 2)) / (total * (total - 1))
+    return 1 - observed / expected
+
+
+class TestFleissKappa(object):
+
+    def test_fleiss_example(self):
+        """Test the kappa of the example of Fleiss."""
+        result = agreement.fleiss_kappa(answers(FLEISS_TABLE), 'answer')
+        assert round(result.value, 3) == 0.210, result
+        assert list(result.tasks['answers']) == [14] * 10
+        assert result.tasks.loc[1, 'agreement'] == 1
+        assert round(result.tasks.loc[2, 'agreement'], 3) == 0.253
+
+    def test_skips_tasks_with_one_answer(self):
+        """Test the tasks with a single answer have no agreement."""
+        frame = answers(FLEISS_TABLE + [[0, 1, 0, 0, 0]])
+        result = agreement.fleiss_kappa(frame, 'answer')
+        assert round(result.value, 3) == 0.210, result
+        assert 11 not in result.tasks.index
+
+
+class TestKrippendorffAlpha(object):
+
+    def test_nominal(self):
+        """Test the nominal alpha is the one of its definition."""
+        frame = random_answers()
+        result = agreement.krippendorff_alpha(frame, 'answer')
+        expected = pairwise_alpha(frame, 'answer', lambda a, b: a != b)
+        assert abs(result.value - expected) < 1e-12, (result, expected)
+
+    def test_interval(self):
+        """Test the interval alpha is the one of its definition."""
+        frame = random_answers()
+        result = agreement.krippendorff_alpha(frame, 'x', 'interval')
+        expected = pairwise_alpha(frame, 'x', lambda a, b: (a - b) ** 2)
+        assert abs(result.value - expected) < 1e-9, (result, expected)
+        tasks = result.tasks
+        assert (tasks['answers'] >= 2).all()
+        assert (tasks['alpha'][tasks['disagreement'] == 0] == 1).all()
+
+    def test_perfect_agreement(self):
+        """Test the tasks that agree have an alpha of 1."""
+        frame = answers([[3, 0], [0, 2], [2, 0]])
+        result = agreement.krippendorff_alpha(frame, 'answer')
+        assert result.value == 1, result
+        assert list(result.tasks['alpha']) == [1, 1, 1]
+
+    @raises(ValueError)
+    def test_unknown_level(self):
+        """Test an unknown level raises ValueError."""
+        agreement.krippendorff_alpha(random_answers(), 'x', 'ordinal')
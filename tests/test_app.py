@@ -16,11 +16,19 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
 """Package to test Enki package."""
+import asyncio
+import os
+import shutil
+import tempfile
+import zipfile
 import enki
+from enki import agreement
+from enki.records import Projection, CompactTask, CompactTaskRun
 from enki.exceptions import ProjectNotFound, ProjectError, \
     ProjectWithoutTasks, ProjectWithoutTaskRuns
 from mock import patch, MagicMock
-from base import TestEnki
+from pandas.testing import assert_frame_equal
+from base import TestEnki, fake_find
 from nose.tools import raises
 from pbclient import Project, Task, TaskRun
 
@@ -175,7 +183,10 @@ class Test(TestEnki):
         e = enki.Enki(api_key='key', endpoint='http://localhost:5000',
                       project_short_name=self.project['short_name'], all=1)
         e.get_tasks()
-        f.assert_called_with(e.project.id, None, 'completed', None, 1)
+        f.assert_called_with(e.project.id, None, 'completed', None, 1,
+                             max_workers=1, max_page_size=100,
+                             stream=False, cache=None, checkpoint=None,
+                             projection=Projection())
 
     @patch('pbclient.requests.get')
     def test_get_tasks_with_file(self, Mock):
@@ -275,7 +286,11 @@ class Test(TestEnki):
         loader.load.return_value = (task_runs, None)
         f.return_value = loader
         e.get_task_runs()
-        f.assert_called_with(e.project.id, e.tasks, None, 1)
+        f.assert_called_with(e.project.id, e.tasks, None, 1,
+                             project_wide=False, max_workers=1,
+                             max_page_size=100, stream=False,
+                             cache=None, checkpoint=None,
+                             projection=Projection())
 
     @patch('pbclient.requests.get')
     def test_get_task_runs_with_file_no_dict(self, Mock):
@@ -328,3 +343,460 @@ class Test(TestEnki):
         assert len(e.task_runs[self.task['id']]) is 1
         print(self.ongoing_task)
         assert e.task_runs[self.ongoing_task['id']] == []
+
+    @patch('pbclient.requests.get')
+    def test_get_tasks_and_task_runs_async(self, Mock):
+        """Test the async API loads the same structures."""
+        Mock.return_value = self.create_fake_request([self.project], 200)
+        e = enki.Enki(api_key='key', endpoint='http://localhost:5000',
+                      project_short_name=self.project['short_name'])
+        Mock.side_effect = [self.create_fake_request([self.task], 200)]
+        asyncio.run(e.get_tasks_async())
+        Mock.side_effect = [self.create_fake_request([self.taskrun], 200),
+                            self.create_fake_request([], 200)]
+        asyncio.run(e.get_task_runs_async())
+
+        assert e.tasks_df['id'].count() == 1, e.tasks_df
+        assert len(e.task_runs[self.task['id']]) == 1, e.task_runs
+        desc = e.task_runs_df[e.tasks[0].id]['info'].describe()
+        assert desc['top'] == self.taskrun['info'], desc
+
+    @patch('pbclient.requests.get')
+    def test_get_task_runs_async_with_file(self, Mock):
+        """Test the async API works with JSON files."""
+        Mock.return_value = self.create_fake_request([self.project], 200)
+        e = enki.Enki(api_key='key', endpoint='http://localhost:5000',
+                      project_short_name=self.project['short_name'])
+        asyncio.run(e.get_tasks_async(json_file='tests/task.json'))
+        asyncio.run(e.get_task_runs_async(json_file='tests/taskrun.json'))
+
+        desc = e.task_runs_df[e.tasks[0].id]['answer'].describe()
+        assert desc['count'] == 2, desc
+        assert desc['top'] == 'Yes', desc
+
+    @patch('pbclient.requests.get')
+    def test_get_task_runs_with_zip_file(self, Mock):
+        """Test get_tasks and get_task_runs read PyBossa ZIP exports."""
+        Mock.return_value = self.create_fake_request([self.project], 200)
+        e = enki.Enki(api_key='key', endpoint='http://localhost:5000',
+                      project_short_name=self.project['short_name'])
+        tmp_dir = tempfile.mkdtemp()
+        for name in ('task', 'taskrun'):
+            path = os.path.join(tmp_dir, '%s.zip' % name)
+            with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+                archive.write('tests/%s.json' % name, '%s.json' % name)
+        e.get_tasks(json_file=os.path.join(tmp_dir, 'task.zip'))
+        e.get_task_runs(json_file=os.path.join(tmp_dir, 'taskrun.zip'),
+                        stream=True)
+        shutil.rmtree(tmp_dir)
+
+        desc = e.task_runs_df[e.tasks[0].id]['answer'].describe()
+        assert desc['count'] == 2, desc
+        assert desc['top'] == 'Yes', desc
+
+    @patch('pbclient.find_taskruns')
+    @patch('pbclient.find_tasks')
+    @patch('pbclient.find_project')
+    def test_refresh_appends_only_new_records(self, fake_project, fake_tasks,
+                                              fake_taskruns):
+        """Test refresh loads the new tasks and task runs."""
+        fake_project.return_value = [Project(self.project)]
+        tasks = [dict(self.task, id=n, info=dict(n=n)) for n in (1, 2)]
+        task_runs = [dict(self.taskrun, id=n, task_id=1 + n % 2,
+                          info=dict(answer=n)) for n in range(1, 5)]
+        fake_tasks.side_effect = fake_find(tasks, Task)
+        fake_taskruns.side_effect = fake_find(task_runs, TaskRun)
+        e = enki.Enki(api_key='key', endpoint='http://localhost:5000',
+                      project_short_name=self.project['short_name'])
+        e.get_tasks()
+        e.get_task_runs()
+        untouched = e.task_runs_df[1]
+
+        tasks.append(dict(self.task, id=3, info=dict(n=3)))
+        task_runs.append(dict(self.taskrun, id=5, task_id=2,
+                              info=dict(answer=5)))
+        task_runs.append(dict(self.taskrun, id=6, task_id=3,
+                              info=dict(answer=6)))
+        fake_tasks.reset_mock()
+        fake_taskruns.reset_mock()
+        changed = e.refresh()
+
+        assert changed == [2, 3], changed
+        assert list(e.tasks_df.index) == [1, 2, 3], e.tasks_df
+        assert [t.id for t in e.tasks] == [1, 2, 3], e.tasks
+        assert list(e.task_runs_df[2]['answer']) == [1, 3, 5]
+        assert list(e.task_runs_df[3]['answer']) == [6]
+        assert e.task_runs_df[1] is untouched
+        assert fake_tasks.mock_calls[0][2]['last_id'] == 2
+        assert fake_taskruns.call_count == 1, fake_taskruns.mock_calls
+        assert fake_taskruns.mock_calls[0][2]['last_id'] == 4
+
+    @patch('pbclient.find_taskruns')
+    @patch('pbclient.find_tasks')
+    @patch('pbclient.find_project')
+    def test_refresh_adds_the_tasks_completed_since(self, fake_project,
+                                                    fake_tasks,
+                                                    fake_taskruns):
+        """Test refresh loads the older tasks that got completed."""
+        fake_project.return_value = [Project(self.project)]
+        tasks = [dict(self.task, id=1, state='ongoing'),
+                 dict(self.task, id=2, state='completed')]
+        task_runs = [dict(self.taskrun, id=n, task_id=n,
+                          info=dict(answer=n)) for n in (1, 2)]
+        fake_tasks.side_effect = fake_find(tasks, Task)
+        fake_taskruns.side_effect = fake_find(task_runs, TaskRun)
+        e = enki.Enki(api_key='key', endpoint='http://localhost:5000',
+                      project_short_name=self.project['short_name'])
+        e.get_tasks()
+        e.get_task_runs()
+        assert [t.id for t in e.tasks] == [2]
+
+        tasks[0]['state'] = 'completed'
+        task_runs.append(dict(self.taskrun, id=3, task_id=1,
+                              info=dict(answer=3)))
+        changed = e.refresh()
+
+        assert changed == [1], changed
+        assert [t.id for t in e.tasks] == [2, 1], e.tasks
+        assert sorted(e.tasks_df.index) == [1, 2], e.tasks_df
+        assert [tr.id for tr in e.task_runs[1]] == [1, 3], e.task_runs
+        assert list(e.task_runs_df[1]['answer']) == [1, 3]
+        assert list(e.task_runs_df[2]['answer']) == [2]
+
+    @patch('pbclient.find_taskruns')
+    @patch('pbclient.find_tasks')
+    @patch('pbclient.find_project')
+    def test_combined_task_runs_layout(self, fake_project, fake_tasks,
+                                       fake_taskruns):
+        """Test the combined layout keeps task_runs_df[task_id] working."""
+        fake_project.return_value = [Project(self.project)]
+        tasks = [dict(self.task, id=n, info=dict(n=n)) for n in (1, 2, 3)]
+        task_runs = [dict(self.taskrun, id=n, task_id=1 + n % 2,
+                          info=dict(answer=n)) for n in range(1, 5)]
+        fake_tasks.side_effect = fake_find(tasks, Task)
+        fake_taskruns.side_effect = fake_find(task_runs, TaskRun)
+        e = enki.Enki(api_key='key', endpoint='http://localhost:5000',
+                      project_short_name=self.project['short_name'],
+                      task_runs_layout='combined')
+        e.get_tasks()
+        e.get_task_runs()
+
+        frame = e.task_runs_df.frame
+        assert frame.index.names == ['task_id', 'taskrun_id'], frame.index
+        assert list(frame.index) == [(1, 2), (1, 4), (2, 1), (2, 3)]
+        assert list(e.task_runs_df.keys()) == [1, 2, 3]
+        assert list(e.task_runs_df[2].index) == [1, 3]
+        assert list(e.task_runs_df[2]['answer']) == [1, 3]
+        assert len(e.task_runs_df[3]) == 0
+        means = frame.groupby(level='task_id')['answer'].mean()
+        assert list(means) == [3, 2], means
+
+        tasks.append(dict(self.task, id=4, info=dict(n=4)))
+        task_runs.append(dict(self.taskrun, id=5, task_id=3,
+                              info=dict(answer=5)))
+        task_runs.append(dict(self.taskrun, id=6, task_id=2,
+                              info=dict(answer=6)))
+        assert e.refresh() == [2, 3, 4]
+        assert list(e.task_runs_df.keys()) == [1, 2, 3, 4]
+        assert list(e.task_runs_df[2]['answer']) == [1, 3, 6]
+        assert list(e.task_runs_df[3]['answer']) == [5]
+        assert len(e.task_runs_df[4]) == 0
+
+    @patch('pbclient.find_taskruns')
+    @patch('pbclient.find_tasks')
+    @patch('pbclient.find_project')
+    def test_lazy_task_runs_layout(self, fake_project, fake_tasks,
+                                   fake_taskruns):
+        """Test the lazy layout builds the task frames when used."""
+        fake_project.return_value = [Project(self.project)]
+        tasks = [dict(self.task, id=n, info=dict(n=n)) for n in (1, 2, 3)]
+        task_runs = [dict(self.taskrun, id=n, task_id=1 + n % 2,
+                          info=dict(answer=n)) for n in range(1, 5)]
+        fake_tasks.side_effect = fake_find(tasks, Task)
+        fake_taskruns.side_effect = fake_find(task_runs, TaskRun)
+        e = enki.Enki(api_key='key', endpoint='http://localhost:5000',
+                      project_short_name=self.project['short_name'],
+                      task_runs_layout='lazy', max_task_run_frames=2)
+        e.get_tasks()
+        e.get_task_runs()
+
+        assert e.task_runs_df.cached() == []
+        assert list(e.task_runs_df.keys()) == [1, 2, 3]
+        assert list(e.task_runs_df[2]['answer']) == [1, 3]
+        assert len(e.task_runs_df[3]) == 0
+        assert e.task_runs_df.cached() == [2, 3]
+
+        task_runs.append(dict(self.taskrun, id=5, task_id=2,
+                              info=dict(answer=5)))
+        assert e.refresh() == [2]
+        assert list(e.task_runs_df[2]['answer']) == [1, 3, 5]
+
+    @patch('pbclient.find_taskruns')
+    @patch('pbclient.find_tasks')
+    @patch('pbclient.find_project')
+    def test_optimize_dtypes(self, fake_project, fake_tasks, fake_taskruns):
+        """Test optimize_dtypes builds smaller frames and reports it."""
+        fake_project.return_value = [Project(self.project)]
+        tasks = [dict(self.task, id=n) for n in (1, 2)]
+        task_runs = [dict(self.taskrun, id=n, task_id=1 + n % 2,
+                          info=dict(answer=['Yes', 'No'][n % 2]))
+                     for n in range(1, 9)]
+        fake_tasks.side_effect = fake_find(tasks, Task)
+        fake_taskruns.side_effect = fake_find(task_runs, TaskRun)
+        e = enki.Enki(api_key='key', endpoint='http://localhost:5000',
+                      project_short_name=self.project['short_name'],
+                      task_runs_layout='combined', optimize_dtypes=True)
+        assert e.memory_stats()['frames'] == 0
+        e.get_tasks()
+        e.get_task_runs()
+
+        assert e.task_runs_df.frame['answer'].dtype == 'category'
+        assert e.task_runs_df.frame['project_id'].dtype == 'int8'
+        stats = e.memory_stats()
+        assert stats['frames'] == 2, stats
+        assert stats['after'] < stats['before'], stats
+
+        task_runs.append(dict(self.taskrun, id=9, task_id=2,
+                              info=dict(answer='No')))
+        e.refresh()
+        assert e.task_runs_df.frame['answer'].dtype == 'category'
+        assert list(e.task_runs_df[2]['answer']) == ['No'] * 5
+
+    @patch('enki.dataframer._available_cpus')
+    @patch('pbclient.find_taskruns')
+    @patch('pbclient.find_tasks')
+    @patch('pbclient.find_project')
+    def test_processes(self, fake_project, fake_tasks, fake_taskruns,
+                       available_cpus):
+        """Test the frames built by processes are the serial ones."""
+        fake_project.return_value = [Project(self.project)]
+        tasks = [dict(self.task, id=n) for n in (1, 2, 3)]
+        task_runs = [dict(self.taskrun, id=n, task_id=1 + n % 3,
+                          info=dict(answer=n)) for n in range(1, 9)]
+        fake_tasks.side_effect = fake_find(tasks, Task)
+        fake_taskruns.side_effect = fake_find(task_runs, TaskRun)
+        frames = []
+        # The pool is only used with more than one CPU.
+        available_cpus.return_value = 2
+        for processes in (None, 2):
+            e = enki.Enki(api_key='key', endpoint='http://localhost:5000',
+                          project_short_name=self.project['short_name'],
+                          processes=processes)
+            e.get_all()
+            frames.append(e.task_runs_df)
+
+        assert list(frames[1]) == [1, 2, 3]
+        for task_id in frames[0]:
+            assert_frame_equal(frames[1][task_id], frames[0][task_id])
+
+    @patch('pbclient.find_taskruns')
+    @patch('pbclient.find_tasks')
+    @patch('pbclient.find_project')
+    def test_aggregate(self, fake_project, fake_tasks, fake_taskruns):
+        """Test aggregate joins the consensus of every task to tasks_df."""
+        fake_project.return_value = [Project(self.project)]
+        tasks = [dict(self.task, id=n) for n in (1, 2, 3)]
+        task_runs = [dict(self.taskrun, id=n, task_id=1 + n % 2, info=dict(
+                          answer=['Yes', 'No', 'No'][n % 3], bbox=dict(x=n)))
+                     for n in range(1, 7)]
+        fake_tasks.side_effect = fake_find(tasks, Task)
+        fake_taskruns.side_effect = fake_find(task_runs, TaskRun)
+        e = enki.Enki(api_key='key', endpoint='http://localhost:5000',
+                      project_short_name=self.project['short_name'],
+                      task_runs_layout='lazy')
+        e.get_all()
+
+        result = e.aggregate(numeric=['bbox.x'])
+        assert list(result.index) == [1, 2, 3]
+        assert list(result['answer_majority'][:2]) == ['No', 'No']
+        assert list(result['answer_confidence'][:2]) == [2 / 3.0, 2 / 3.0]
+        assert list(result['bbox.x_mean'][:2]) == [4, 3]
+        assert e.task_runs_df.cached() == []
+        columns = e.aggregate(answer=None).columns
+        assert list(columns) == list(e.tasks_df.columns)
+
+    @patch('pbclient.find_taskruns')
+    @patch('pbclient.find_tasks')
+    @patch('pbclient.find_project')
+    def test_answers_frame(self, fake_project, fake_tasks, fake_taskruns):
+        """Test answers_frame gives the agreement of the task runs."""
+        fake_project.return_value = [Project(self.project)]
+        tasks = [dict(self.task, id=n) for n in (1, 2)]
+        task_runs = [dict(self.taskrun, id=n, task_id=1 + n % 2,
+                          info=dict(answer=n % 2))
+                     for n in range(1, 7)]
+        fake_tasks.side_effect = fake_find(tasks, Task)
+        fake_taskruns.side_effect = fake_find(task_runs, TaskRun)
+        e = enki.Enki(api_key='key', endpoint='http://localhost:5000',
+                      project_short_name=self.project['short_name'])
+        e.get_all()
+
+        frame = e.answers_frame()
+        assert list(frame.columns) == ['task_id', 'answer']
+        assert len(frame) == 6
+        result = agreement.krippendorff_alpha(frame, 'answer')
+        assert result.value == 1
+        assert list(result.tasks['answers']) == [3, 3]
+
+    @patch('pbclient.find_project')
+    def test_memory_stats_without_optimize_dtypes(self, fake_project):
+        """Test there are no memory stats by default."""
+        fake_project.return_value = [Project(self.project)]
+        e = enki.Enki(api_key='key', endpoint='http://localhost:5000',
+                      project_short_name=self.project['short_name'])
+        assert e.memory_stats() is None
+
+    @patch('pbclient.find_taskruns')
+    @patch('pbclient.find_tasks')
+    @patch('pbclient.find_project')
+    def test_cached_tasks_that_get_completed(self, fake_project, fake_tasks,
+                                             fake_taskruns):
+        """Test a cached load adds the tasks completed since the last one."""
+        fake_project.return_value = [Project(self.project)]
+        tasks = [dict(self.task, id=1, state='ongoing'),
+                 dict(self.task, id=2, state='completed')]
+        task_runs = [dict(self.taskrun, id=1, task_id=2)]
+        fake_tasks.side_effect = fake_find(tasks, Task)
+        fake_taskruns.side_effect = fake_find(task_runs, TaskRun)
+        for project_wide in (False, True):
+            tasks[0]['state'] = 'ongoing'
+            del task_runs[1:]
+            cache_dir = tempfile.mkdtemp()
+            try:
+                loaded = []
+                for run in range(3):
+                    if run == 1:
+                        tasks[0]['state'] = 'completed'
+                        task_runs.append(dict(self.taskrun, id=2, task_id=1))
+                    e = enki.Enki('key', 'http://localhost:5000',
+                                  self.project['short_name'],
+                                  cache_dir=cache_dir)
+                    e.get_tasks()
+                    e.get_task_runs(project_wide=project_wide)
+                    loaded.append(sorted(e.task_runs))
+            finally:
+                shutil.rmtree(cache_dir)
+            assert loaded == [[2], [1, 2], [1, 2]], (project_wide, loaded)
+
+    @patch('pbclient.find_taskruns')
+    @patch('pbclient.find_tasks')
+    @patch('pbclient.find_project')
+    def test_columns_and_info_keys(self, fake_project, fake_tasks,
+                                   fake_taskruns):
+        """Test only the columns and info keys asked for are loaded."""
+        fake_project.return_value = [Project(self.project)]
+        tasks = [dict(self.task, id=n, links=['<link/>']) for n in (1, 2)]
+        task_runs = [dict(self.taskrun, id=n, task_id=1 + n % 2,
+                          info=dict(answer=n, comment='text'))
+                     for n in range(1, 5)]
+        fake_tasks.side_effect = fake_find(tasks, Task)
+        fake_taskruns.side_effect = fake_find(task_runs, TaskRun)
+        cache_dir = tempfile.mkdtemp()
+        try:
+            e = enki.Enki(api_key='key', endpoint='http://localhost:5000',
+                          project_short_name=self.project['short_name'],
+                          cache_dir=cache_dir)
+            e.get_tasks(columns=['n_answers'])
+            e.get_task_runs(columns=['user_id'], info_keys=['answer'])
+            full = enki.Enki(api_key='key', endpoint='http://localhost:5000',
+                             project_short_name=self.project['short_name'],
+                             cache_dir=cache_dir)
+            full.get_tasks()
+        finally:
+            shutil.rmtree(cache_dir)
+
+        assert sorted(e.tasks_df.columns) == ['id', 'n_answers',
+                                              'project_id', 'state']
+        assert (sorted(e.task_runs_df[2].columns)
+                == ['answer', 'id', 'info', 'project_id', 'task_id',
+                    'user_id']), e.task_runs_df[2].columns
+        assert 'links' in full.tasks_df.columns
+
+        task_runs.append(dict(self.taskrun, id=5, task_id=2,
+                              info=dict(answer=5, comment='text')))
+        e.refresh()
+        assert e.task_runs[2][-1].info == dict(answer=5)
+
+    @patch('pbclient.find_taskruns')
+    @patch('pbclient.find_tasks')
+    @patch('pbclient.find_project')
+    def test_compact_records(self, fake_project, fake_tasks, fake_taskruns):
+        """Test compact_records keeps compact records with the same data."""
+        fake_project.return_value = [Project(self.project)]
+        tasks = [dict(self.task, id=n) for n in (1, 2)]
+        task_runs = [dict(self.taskrun, id=n, task_id=1 + n % 2,
+                          info=dict(answer=n)) for n in range(1, 5)]
+        fake_tasks.side_effect = fake_find(tasks, Task)
+        fake_taskruns.side_effect = fake_find(task_runs, TaskRun)
+        e = enki.Enki(api_key='key', endpoint='http://localhost:5000',
+                      project_short_name=self.project['short_name'],
+                      compact_records=True)
+        e.get_tasks()
+        e.get_task_runs(info_keys=['answer'])
+
+        assert all(isinstance(t, CompactTask) for t in e.tasks)
+        assert e.task_runs[2][0].info == dict(answer=1)
+        assert e.task_runs[2][0].data == task_runs[0]
+        assert list(e.task_runs_df[2]['answer']) == [1, 3]
+
+        task_runs.append(dict(self.taskrun, id=5, task_id=2,
+                              info=dict(answer=5)))
+        e.refresh()
+        assert isinstance(e.task_runs[2][-1], CompactTaskRun)
+        assert list(e.task_runs_df[2]['answer']) == [1, 3, 5]
+
+        e.get_tasks(json_file='tests/task.json')
+        e.get_task_runs(json_file='tests/taskrun.json')
+        assert isinstance(e.task_runs[e.tasks[0].id][0], CompactTaskRun)
+
+    @patch('pbclient.find_taskruns')
+    @patch('pbclient.find_tasks')
+    @patch('pbclient.find_project')
+    def test_iter_task_runs(self, fake_project, fake_tasks, fake_taskruns):
+        """Test the task runs are given in chunks of complete tasks."""
+        fake_project.return_value = [Project(self.project)]
+        tasks = [dict(self.task, id=n) for n in range(1, 6)]
+        task_runs = [dict(self.taskrun, id=n, task_id=1 + n % 4,
+                          info=dict(answer=n)) for n in range(1, 11)]
+        fake_tasks.side_effect = fake_find(tasks, Task)
+        fake_taskruns.side_effect = fake_find(task_runs, TaskRun)
+        e = enki.Enki(api_key='key', endpoint='http://localhost:5000',
+                      project_short_name=self.project['short_name'],
+                      max_workers=2)
+        e.get_tasks()
+
+        chunks = list(e.iter_task_runs(chunk_size=4))
+
+        assert [len(chunk) for chunk in chunks] == [5, 5], chunks
+        assert not hasattr(e, 'task_runs_df')
+        assert (list(chunks[0].index.get_level_values('task_id').unique())
+                == [1, 2])
+        e.get_task_runs(project_wide=True)
+        for chunk in chunks:
+            for task_id, data_frame in chunk.groupby(level='task_id'):
+                assert (list(data_frame['answer'])
+                        == list(e.task_runs_df[task_id]['answer']))
+
+    @patch('pbclient.requests.get')
+    def test_iter_task_runs_from_a_file(self, Mock):
+        """Test the task runs of a file are given in chunks."""
+        Mock.return_value = self.create_fake_request([self.project], 200)
+        e = enki.Enki(api_key='key', endpoint='http://localhost:5000',
+                      project_short_name=self.project['short_name'])
+        e.get_tasks(json_file='tests/task.json')
+
+        chunks = list(e.iter_task_runs(json_file='tests/taskrun.json',
+                                       info_keys=['answer']))
+
+        assert len(chunks) == 1
+        assert list(chunks[0]['answer']) == ['Yes', 'Yes']
+        assert '_id' not in chunks[0].columns
+
+    @raises(ValueError)
+    @patch('pbclient.find_project')
+    def test_unknown_task_runs_layout(self, fake_project):
+        """Test an unknown task_runs_layout is refused."""
+        fake_project.return_value = [Project(self.project)]
+        enki.Enki(api_key='key', endpoint='http://localhost:5000',
+                  project_short_name=self.project['short_name'],
+                  task_runs_layout='nested')
@@ -0,0 +1,155 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""Package to test the local cache."""
+import shutil
+import tempfile
+import time
+import pbclient
+from mock import patch
+from base import fake_find
+from enki.cache import Cache
+from enki.task_loaders import ServerTasksLoader
+from enki.task_run_loaders import ServerTaskRunsLoader
+
+
+class TestCache(object):
+
+    def setup_method(self, method=None):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = Cache(self.cache_dir, 'http://server', 1)
+
+    def teardown_method(self, method=None):
+        shutil.rmtree(self.cache_dir)
+
+    def test_save_and_load(self):
+        self.cache.save('tasks-completed', [{'id': 1}], 1)
+
+        entry = self.cache.load('tasks-completed')
+
+        assert entry['records'] == [{'id': 1}], entry
+        assert entry['last_id'] == 1, entry
+
+    def test_entries_depend_on_endpoint_and_project(self):
+        self.cache.save('tasks-completed', [{'id': 1}], 1)
+
+        other_server = Cache(self.cache_dir, 'http://other', 1)
+        other_project = Cache(self.cache_dir, 'http://server', 2)
+
+        assert other_server.load('tasks-completed') is None
+        assert other_project.load('tasks-completed') is None
+
+    def test_old_entries_are_ignored(self):
+        self.cache.save('tasks-completed', [{'id': 1}], 1)
+        cache = Cache(self.cache_dir, 'http://server', 1, max_age=10)
+
+        with patch('time.time', return_value=time.time() + 60):
+            assert cache.load('tasks-completed') is None
+
+    def test_invalidate(self):
+        self.cache.save('tasks-completed', [{'id': 1}], 1)
+        self.cache.save('task_runs', [], 0)
+
+        self.cache.invalidate('task_runs')
+        assert self.cache.load('task_runs') is None
+        assert self.cache.load('tasks-completed') is not None
+        self.cache.invalidate()
+        assert self.cache.load('tasks-completed') is None
+
+
+class TestLoadersWithCache(object):
+
+    def setup_method(self, method=None):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = Cache(self.cache_dir, 'http://server', 1)
+
+    def teardown_method(self, method=None):
+        shutil.rmtree(self.cache_dir)
+
+    @patch('pbclient.find_taskruns')
+    @patch('pbclient.find_tasks')
+    def test_tasks_loader_only_downloads_new_tasks(self, fake_client,
+                                                   fake_taskruns):
+        data = [{'id': n, 'state': 'completed'} for n in range(1, 151)]
+        fake_client.side_effect = fake_find(data, pbclient.Task)
+        fake_taskruns.side_effect = fake_find([], pbclient.TaskRun)
+        ServerTasksLoader(1, cache=self.cache).load()
+        data += [{'id': n, 'state': 'completed'} for n in range(151, 161)]
+        fake_client.reset_mock()
+
+        tasks = ServerTasksLoader(1, cache=self.cache).load()
+
+        assert [t.id for t in tasks] == list(range(1, 161))
+        assert fake_client.call_count == 1, fake_client.mock_calls
+        assert fake_client.mock_calls[0][2]['last_id'] == 150
+
+    @patch('pbclient.find_taskruns')
+    @patch('pbclient.find_tasks')
+    def test_tasks_that_get_completed_are_added(self, fake_tasks,
+                                                fake_taskruns):
+        tasks_data = [{'id': 1, 'state': 'ongoing'},
+                      {'id': 2, 'state': 'completed'}]
+        runs_data = [{'id': 1, 'task_id': 2}]
+        fake_tasks.side_effect = fake_find(tasks_data, pbclient.Task)
+        fake_taskruns.side_effect = fake_find(runs_data, pbclient.TaskRun)
+        tasks = ServerTasksLoader(1, cache=self.cache).load()
+        assert [t.id for t in tasks] == [2]
+
+        tasks_data[0]['state'] = 'completed'
+        runs_data.append({'id': 2, 'task_id': 1})
+        tasks = ServerTasksLoader(1, cache=self.cache).load()
+
+        assert [t.id for t in tasks] == [1, 2], tasks
+        assert all(t.state == 'completed' for t in tasks)
+        fake_tasks.reset_mock()
+        tasks = ServerTasksLoader(1, cache=self.cache).load()
+        assert [t.id for t in tasks] == [1, 2], tasks
+        assert fake_tasks.call_count == 1, fake_tasks.mock_calls
+
+    @patch('pbclient.find_taskruns')
+    def test_task_runs_loader_resumes_every_task(self, fake_client):
+        tasks = [pbclient.Task({'id': 1}), pbclient.Task({'id': 2})]
+        data = [{'id': 1, 'task_id': 1}, {'id': 2, 'task_id': 2}]
+        fake_client.side_effect = fake_find(data, pbclient.TaskRun)
+        ServerTaskRunsLoader(1, tasks, cache=self.cache).load()
+        data.append({'id': 3, 'task_id': 1})
+        fake_client.reset_mock()
+
+        task_runs, _ = ServerTaskRunsLoader(1, tasks, cache=self.cache).load()
+
+        assert [tr.id for tr in task_runs[1]] == [1, 3], task_runs
+        assert [tr.id for tr in task_runs[2]] == [2], task_runs
+        last_ids = [c[2].get('last_id') for c in fake_client.mock_calls]
+        assert 'offset' not in str(fake_client.mock_calls)
+        assert last_ids[0] == 1 and 2 in last_ids, last_ids
+
+    @patch('pbclient.find_taskruns')
+    def test_project_wide_task_runs_loader_resumes(self, fake_client):
+        tasks = [pbclient.Task({'id': 1}), pbclient.Task({'id': 2})]
+        data = [{'id': n, 'task_id': 1 + n % 2} for n in range(1, 201)]
+        fake_client.side_effect = fake_find(data, pbclient.TaskRun)
+        ServerTaskRunsLoader(1, tasks, project_wide=True,
+                             cache=self.cache).load()
+        data += [{'id': n, 'task_id': 1 + n % 2} for n in range(201, 211)]
+        fake_client.reset_mock()
+
+        task_runs, _ = ServerTaskRunsLoader(1, tasks, project_wide=True,
+                                            cache=self.cache).load()
+
+        assert len(task_runs[1]) == len(task_runs[2]) == 105, task_runs
+        assert fake_client.call_count == 1, fake_client.mock_calls
+        assert fake_client.mock_calls[0][2]['last_id'] == 200
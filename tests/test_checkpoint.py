@@ -0,0 +1,192 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""Package to test the resumable checkpoints of the server loaders."""
+import os
+import shutil
+import tempfile
+import pbclient
+from mock import patch
+from nose.tools import raises
+from base import fake_find
+from enki.checkpoint import Checkpoint
+from enki.task_loaders import ServerTasksLoader
+from enki.task_run_loaders import ServerTaskRunsLoader
+
+
+class Interrupted(Exception):
+    pass
+
+
+def failing_find(find, fail_at=None, fail_after=None):
+    """Return find, raising Interrupted on its call number fail_at or
+    when it is asked for the page after id fail_after."""
+    calls = []
+
+    def find_or_fail(**query):
+        calls.append(query)
+        if (len(calls) == fail_at
+                or (fail_after and query.get('last_id') == fail_after)):
+            raise Interrupted
+        return find(**query)
+    find_or_fail.calls = calls
+    return find_or_fail
+
+
+class TestCheckpoint(object):
+
+    def setup_method(self):
+        self.checkpoint_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.checkpoint_dir, 'load.checkpoint')
+
+    def teardown_method(self):
+        shutil.rmtree(self.checkpoint_dir)
+
+    def test_pages_are_written_periodically(self):
+        """Test the pages are appended every `every` lines."""
+        checkpoint = Checkpoint(self.path, every=2)
+        progress = checkpoint.track('task-1', pbclient.TaskRun)
+        progress.add([pbclient.TaskRun({'id': 1})])
+        assert os.path.getsize(self.path) == 0
+        progress.add([pbclient.TaskRun({'id': 2})])
+        resumed = Checkpoint(self.path, resume=True).track('task-1',
+                                                           pbclient.TaskRun)
+        assert [tr.id for tr in resumed.items] == [1, 2]
+        assert resumed.last_id == 2
+        assert not resumed.done
+
+    def test_resume_ignores_a_cut_line(self):
+        """Test a line cut by a killed process is ignored."""
+        checkpoint = Checkpoint(self.path, every=1)
+        checkpoint.track('head', pbclient.Task).add([pbclient.Task({'id': 1})])
+        with open(self.path, 'a') as checkpoint_file:
+            checkpoint_file.write('{"key": "head", "reco')
+        progress = Checkpoint(self.path, resume=True).track('head',
+                                                            pbclient.Task)
+        assert progress.last_id == 1
+
+    def test_no_resume_discards_the_progress(self):
+        """Test a new checkpoint starts from scratch unless resumed."""
+        checkpoint = Checkpoint(self.path, every=1)
+        checkpoint.track('head', pbclient.Task).finish()
+        progress = Checkpoint(self.path).track('head', pbclient.Task)
+        assert not progress.done
+
+
+class TestResumeLoaders(object):
+
+    def setup_method(self):
+        self.checkpoint_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.checkpoint_dir, 'load.checkpoint')
+
+    def teardown_method(self):
+        shutil.rmtree(self.checkpoint_dir)
+
+    def interrupt(self, loader):
+        try:
+            loader.load()
+        except Interrupted:
+            return
+        raise AssertionError("the load was not interrupted")
+
+    @patch('enki.task_run_loaders.pbclient.find_taskruns')
+    def test_resume_per_task_task_runs(self, find_taskruns):
+        """Test the finished tasks are not queried again."""
+        tasks = [pbclient.Task({'id': n}) for n in (1, 2, 3)]
+        task_runs = [dict(id=n, task_id=n % 3 + 1) for n in range(1, 31)]
+        find = fake_find(task_runs, pbclient.TaskRun)
+        find_taskruns.side_effect = failing_find(find, fail_at=5)
+        self.interrupt(ServerTaskRunsLoader(
+            1, tasks, checkpoint=Checkpoint(self.path)))
+
+        find_taskruns.side_effect = failing_find(find)
+        loaded, _ = ServerTaskRunsLoader(
+            1, tasks, checkpoint=Checkpoint(self.path, resume=True)).load()
+
+        calls = find_taskruns.side_effect.calls
+        assert [c['task_id'] for c in calls] == [3, 3], calls
+        assert 'offset' in calls[0]
+        for task in tasks:
+            expected = [tr['id'] for tr in task_runs
+                        if tr['task_id'] == task.id]
+            assert [tr.id for tr in loaded[task.id]] == expected
+        assert not os.path.exists(self.path)
+
+    @patch('enki.task_run_loaders.pbclient.find_taskruns')
+    def test_resume_project_task_runs(self, find_taskruns):
+        """Test a project wide load goes on from its last page."""
+        tasks = [pbclient.Task({'id': n}) for n in (1, 2, 3)]
+        task_runs = [dict(id=n, task_id=n % 3 + 1) for n in range(1, 351)]
+        find = fake_find(task_runs, pbclient.TaskRun)
+        find_taskruns.side_effect = failing_find(find, fail_at=3)
+        self.interrupt(ServerTaskRunsLoader(
+            1, tasks, project_wide=True, checkpoint=Checkpoint(self.path)))
+
+        find_taskruns.side_effect = failing_find(find)
+        loaded, _ = ServerTaskRunsLoader(
+            1, tasks, project_wide=True,
+            checkpoint=Checkpoint(self.path, resume=True)).load()
+
+        calls = find_taskruns.side_effect.calls
+        assert [c.get('last_id') for c in calls] == [200, 300], calls
+        ids = sorted(tr.id for trs in loaded.values() for tr in trs)
+        assert ids == list(range(1, 351))
+
+    @patch('enki.task_run_loaders.pbclient.find_taskruns')
+    def test_resume_parallel_ranges(self, find_taskruns):
+        """Test a parallel load reuses its ranges and finished ones."""
+        tasks = [pbclient.Task({'id': n}) for n in (1, 2, 3)]
+        task_runs = [dict(id=n, task_id=n % 3 + 1) for n in range(1, 601)]
+        find = fake_find(task_runs, pbclient.TaskRun)
+        find_taskruns.side_effect = failing_find(find, fail_after=450)
+        self.interrupt(ServerTaskRunsLoader(
+            1, tasks, project_wide=True, max_workers=2,
+            checkpoint=Checkpoint(self.path)))
+
+        find_taskruns.side_effect = failing_find(find)
+        loaded, _ = ServerTaskRunsLoader(
+            1, tasks, project_wide=True, max_workers=2,
+            checkpoint=Checkpoint(self.path, resume=True)).load()
+
+        calls = find_taskruns.side_effect.calls
+        assert [c.get('last_id') for c in calls] == [450, 550], calls
+        ids = [tr.id for trs in loaded.values() for tr in trs]
+        assert sorted(ids) == list(range(1, 601))
+
+    @patch('enki.task_loaders.pbclient.find_tasks')
+    def test_resume_tasks(self, find_tasks):
+        """Test the tasks load goes on from its last page."""
+        tasks = [dict(id=n, state='completed') for n in range(1, 251)]
+        find = fake_find(tasks, pbclient.Task)
+        find_tasks.side_effect = failing_find(find, fail_at=3)
+        self.interrupt(ServerTasksLoader(1, checkpoint=Checkpoint(self.path)))
+
+        find_tasks.side_effect = failing_find(find)
+        loaded = ServerTasksLoader(
+            1, checkpoint=Checkpoint(self.path, resume=True)).load()
+
+        calls = find_tasks.side_effect.calls
+        assert [c.get('last_id') for c in calls] == [200], calls
+        assert [t.id for t in loaded] == list(range(1, 251))
+
+    @raises(ValueError)
+    def test_resume_needs_a_checkpoint_dir(self):
+        """Test Enki refuses to resume without a checkpoint_dir."""
+        from enki import Enki
+        e = Enki.__new__(Enki)
+        e.checkpoint_dir = None
+        e._checkpoint('task_runs', resume=True)
@@ -0,0 +1,298 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""Package to test the data frames built from tasks and task runs."""
+import tracemalloc
+import pandas
+import pbclient
+from mock import patch
+from pandas.testing import assert_frame_equal
+from enki import dataframer
+from enki.records import CompactTaskRun
+
+
+def task_runs():
+    return [pbclient.TaskRun(dict(id=1, task_id=1, info=dict(
+                answer='yes', id=10, bbox=dict(x=1, y=2, size=dict(w=3))))),
+            pbclient.TaskRun(dict(id=2, task_id=1, info=dict(
+                answer='no', bbox='none'))),
+            pbclient.TaskRun(dict(id=3, task_id=1, info='text'))]
+
+
+class TestCreateDataFrame(object):
+
+    def test_explodes_one_level_by_default(self):
+        """Test the info keys become columns, escaping the protected."""
+        data_frame = dataframer.create_data_frame(task_runs())
+        assert list(data_frame.columns) == ['id', 'task_id', 'info', 'answer',
+                                            '_id', 'bbox'], data_frame.columns
+        assert list(data_frame.index) == [1, 2, 3]
+        assert data_frame.loc[1, 'bbox'] == dict(x=1, y=2, size=dict(w=3))
+        assert data_frame.loc[1, '_id'] == 10
+        assert pandas.isna(data_frame.loc[3, 'answer'])
+
+    def test_flattens_nested_info(self):
+        """Test nested dicts are flattened up to max_depth levels."""
+        data_frame = dataframer.create_data_frame(task_runs(), max_depth=2)
+        assert data_frame.loc[1, 'bbox.x'] == 1
+        assert pandas.isna(data_frame.loc[2, 'bbox.x'])
+        assert data_frame.loc[1, 'bbox.size'] == dict(w=3)
+        assert data_frame.loc[2, 'bbox'] == 'none'
+        assert pandas.isna(data_frame.loc[1, 'bbox'])
+
+        data_frame = dataframer.create_data_frame(task_runs(), max_depth=3,
+                                                  sep='__')
+        assert data_frame.loc[1, 'bbox__size__w'] == 3
+        assert data_frame.loc[1, 'bbox__x'] == 1
+
+    def test_numeric_nested_columns(self):
+        """Test the flattened columns of numbers can be computed on."""
+        items = [pbclient.TaskRun(dict(id=n, info=dict(point=dict(x=n))))
+                 for n in range(1, 5)]
+        data_frame = dataframer.create_data_frame(items, max_depth=2)
+        assert data_frame['point.x'].sum() == 10
+        assert 'point' not in data_frame.columns
+
+    def test_bools_mixed_with_numbers(self):
+        """Test the bools of a column of numbers are not made numbers."""
+        items = [pbclient.TaskRun(dict(id=n, info=dict(answer=answer,
+                                                       score=score)))
+                 for n, (answer, score) in enumerate([(1, 0.5),
+                                                      (True, False)])]
+        data_frame = dataframer.create_data_frame(items)
+        assert data_frame['answer'].dtype == object
+        assert list(data_frame['answer']) == [1, True]
+        assert data_frame['answer'][1] is True
+        assert data_frame['score'].dtype == object
+        assert data_frame['score'][1] is False
+
+    def test_without_items(self):
+        """Test an empty list of items gives an empty frame."""
+        assert len(dataframer.create_data_frame([])) == 0
+
+    def test_does_not_modify_the_items(self):
+        """Test building a frame twice gives the same frame and items."""
+        items = task_runs()
+        before = [dict(item.data) for item in items]
+        first = dataframer.create_data_frame(items, max_depth=2)
+        second = dataframer.create_data_frame(items, max_depth=2)
+        assert_frame_equal(first, second)
+        assert [item.data for item in items] == before
+
+    def test_items_do_not_grow(self):
+        """Test the items do not keep a copy of their exploded info."""
+        items = [pbclient.TaskRun(dict(id=n, task_id=n, info=dict(
+                     answer=n, comment='answer %s' % n, x=n, y=n)))
+                 for n in range(10000)]
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            data_frame = dataframer.create_data_frame(items)
+            del data_frame
+            retained = tracemalloc.get_traced_memory()[0] - before
+        finally:
+            tracemalloc.stop()
+        # Adding the four info keys to every item would take ~2 MB.
+        assert retained < 200 * 1024, retained
+
+
+    def test_compact_records_give_the_same_frame(self):
+        """Test compact records build the same frame as pbclient ones."""
+        items = [pbclient.TaskRun(dict(id=n, task_id=1, user_id=None,
+                                       info=dict(answer=n, bbox=dict(x=n))))
+                 for n in range(1, 4)]
+        compact = [CompactTaskRun(item.data) for item in items]
+        assert_frame_equal(dataframer.create_data_frame(compact, max_depth=2),
+                           dataframer.create_data_frame(items, max_depth=2))
+        mixed = compact[:1] + items[1:]
+        assert_frame_equal(dataframer.create_data_frame(mixed),
+                           dataframer.create_data_frame(items))
+
+
+class TestExplodeInfo(object):
+
+    def test_returns_a_new_dict(self):
+        """Test explode_info leaves the item as it was."""
+        item = task_runs()[0]
+        exploded = dataframer.explode_info(item)
+        assert exploded['answer'] == 'yes'
+        assert exploded['_id'] == 10
+        assert exploded['id'] == 1
+        assert 'answer' not in item.data
+        assert exploded is not item.data
+
+
+class TestLazyTaskRunFrames(object):
+
+    def setup_method(self):
+        self.task_runs = dict((task_id, [pbclient.TaskRun(dict(
+            id=task_id * 10 + n, task_id=task_id, info=dict(answer=n)))
+            for n in range(2)]) for task_id in range(1, 6))
+        self.frames = dataframer.LazyTaskRunFrames(
+            range(1, 6), self.task_runs, max_frames=2)
+
+    def test_builds_the_frames_on_use(self):
+        """Test a frame is only built when it is looked up."""
+        assert self.frames.cached() == []
+        assert list(self.frames[3]['answer']) == [0, 1]
+        assert self.frames.cached() == [3]
+        assert self.frames[3] is self.frames[3]
+
+    def test_keeps_the_most_recently_used(self):
+        """Test the least recently used frame is dropped over max_frames."""
+        self.frames[1]
+        self.frames[2]
+        self.frames[1]
+        self.frames[3]
+        assert self.frames.cached() == [1, 3]
+
+    def test_iterates_all_the_tasks(self):
+        """Test all the frames can be iterated within max_frames."""
+        sizes = dict((task_id, len(data_frame))
+                     for task_id, data_frame in self.frames.items())
+        assert sizes == dict((task_id, 2) for task_id in range(1, 6))
+        assert self.frames.cached() == [4, 5]
+
+    def test_unknown_task(self):
+        """Test a task that was not loaded raises KeyError."""
+        try:
+            self.frames[6]
+        except KeyError:
+            return
+        assert False, "KeyError not raised"
+
+    def test_append_rebuilds_the_frames(self):
+        """Test the frames of the appended tasks see their new task runs."""
+        self.frames[1]
+        self.task_runs[1].append(pbclient.TaskRun(dict(
+            id=12, task_id=1, info=dict(answer=2))))
+        self.task_runs[6] = []
+        self.frames.append([1, 6])
+        assert list(self.frames[1]['answer']) == [0, 1, 2]
+        assert len(self.frames[6]) == 0
+        assert len(self.frames) == 6
+
+
+class TestDtypeOptimizer(object):
+
+    def items(self):
+        return [pbclient.TaskRun(dict(
+            id=n, project_id=1, user_ip='10.0.0.%s' % (n % 2),
+            created='2016-01-01T00:00:%02d.5' % n,
+            info=dict(answer=['Yes', 'No'][n % 2], score=n / 2.0,
+                      ratio=n / 3.0, comment='comment %s' % n)))
+            for n in range(10)]
+
+    def test_optimizes_the_dtypes(self):
+        """Test the columns get the dtypes that take less memory."""
+        optimizer = dataframer.DtypeOptimizer()
+        data_frame = dataframer.create_data_frame(self.items(),
+                                                  optimizer=optimizer)
+        dtypes = data_frame.dtypes
+        assert dtypes['answer'] == 'category', dtypes
+        assert dtypes['user_ip'] == 'category', dtypes
+        assert dtypes['project_id'] == 'int8', dtypes
+        assert dtypes['score'] == 'float32', dtypes
+        assert dtypes['ratio'] == 'float64', dtypes
+        assert dtypes['comment'] != 'category', dtypes
+        assert dtypes['info'] == object, dtypes
+        assert data_frame['created'].dt.second.sum() == 45
+        assert list(data_frame['answer'][:2]) == ['Yes', 'No']
+        assert data_frame['ratio'][1] == 1 / 3.0
+
+    def test_reports_the_memory(self):
+        """Test the stats add up the bytes before and after."""
+        optimizer = dataframer.DtypeOptimizer()
+        plain = dataframer.create_data_frame(self.items())
+        dataframer.create_data_frame(self.items(), optimizer=optimizer)
+        dataframer.create_data_frame([], optimizer=optimizer)
+        stats = optimizer.stats()
+        assert stats['frames'] == 2, stats
+        assert stats['before'] >= dataframer.memory_usage(plain), stats
+        assert stats['after'] < stats['before'], stats
+        assert 0 < stats['saved'] < 1, stats
+
+    def test_append_keeps_the_categories(self):
+        """Test appending frames with categoricals keeps them."""
+        optimizer = dataframer.DtypeOptimizer()
+        items = self.items()
+        data_frame = dataframer.append_data_frame(
+            dataframer.create_data_frame(items[:4], optimizer=optimizer),
+            dataframer.create_data_frame(items[4:], optimizer=optimizer))
+        assert data_frame['answer'].dtype == 'category'
+        assert len(data_frame) == 10
+
+
+class TestProcesses(object):
+
+    def setup_method(self):
+        # The pool is only used with more than one CPU.
+        self.cpus = patch('enki.dataframer._available_cpus', return_value=4)
+        self.cpus.start()
+        self.tasks = [pbclient.Task(dict(id=task_id))
+                      for task_id in range(1, 10)]
+        self.task_runs = dict((task.id, [pbclient.TaskRun(dict(
+            id=task.id * 10 + n, task_id=task.id, user_ip='10.0.0.%s' % n,
+            info=dict(answer=['Yes', 'No'][n % 2], bbox=dict(x=n))))
+            for n in range(task.id % 4)]) for task in self.tasks)
+
+    def teardown_method(self):
+        self.cpus.stop()
+
+    def test_builds_serially_with_one_cpu(self):
+        """Test the frames are built serially without CPUs to share."""
+        self.cpus.stop()
+        with patch('enki.dataframer._available_cpus', return_value=1), \
+                patch('multiprocessing.get_context') as get_context:
+            frames = dataframer.create_task_run_data_frames(
+                self.tasks, self.task_runs, processes=4)
+        self.cpus.start()
+        assert not get_context.called
+        assert list(frames) == [task.id for task in self.tasks]
+
+    def test_builds_the_same_frames(self):
+        """Test the pool builds the frames the serial build does."""
+        serial = dataframer.create_task_run_data_frames(
+            self.tasks, self.task_runs, max_depth=2)
+        pooled = dataframer.create_task_run_data_frames(
+            self.tasks, self.task_runs, max_depth=2, processes=2)
+        assert list(pooled) == list(serial)
+        for task_id in serial:
+            assert_frame_equal(pooled[task_id], serial[task_id])
+
+    def test_adds_up_the_optimizer_stats(self):
+        """Test the stats of the processes are added to the optimizer."""
+        serial_optimizer = dataframer.DtypeOptimizer()
+        serial = dataframer.create_task_run_data_frames(
+            self.tasks, self.task_runs, optimizer=serial_optimizer)
+        optimizer = dataframer.DtypeOptimizer()
+        pooled = dataframer.create_task_run_data_frames(
+            self.tasks, self.task_runs, optimizer=optimizer, processes=3)
+        for task_id in serial:
+            assert_frame_equal(pooled[task_id], serial[task_id])
+        assert optimizer.stats() == serial_optimizer.stats()
+
+    def test_builds_a_partition_from_its_data(self):
+        """Test a process can build the frames from the sent data."""
+        data = [[tr.data for tr in self.task_runs[task_id]]
+                for task_id in (2, 3)]
+        frames, stats = dataframer._build_partition(([2, 3], data, 1, '.',
+                                                     None))
+        assert stats is None
+        for task_id in (2, 3):
+            assert_frame_equal(frames[task_id], dataframer.create_data_frame(
+                self.task_runs[task_id]))
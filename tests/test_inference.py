@@ -0,0 +1,135 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""Package to test the inference of the true answers."""
+import math
+import numpy
+import pandas
+from enki.inference import DawidSkene
+from enki import aggregation
+
+
+def simulate(n_tasks=300, seed=0):
+    """Return the answers of workers of varying accuracy and the truth."""
+    rng = numpy.random.default_rng(seed)
+    labels = numpy.array(['cat', 'dog', 'fox'], dtype=object)
+    truth = rng.integers(0, 3, n_tasks)
+    accuracy = numpy.array([0.95, 0.9, 0.9, 0.4, 0.35, 0.35, 0.35])
+    rows = []
+    for task_id in range(n_tasks):
+        for worker in rng.choice(len(accuracy), 5, replace=False):
+            answer = truth[task_id]
+            if rng.random() > accuracy[worker]:
+                answer = rng.integers(0, 3)
+            rows.append((task_id, worker, None, labels[answer]))
+    frame = pandas.DataFrame(rows, columns=['task_id', 'user_id', 'user_ip',
+                                            'answer'])
+    return frame, pandas.Series(labels[truth])
+
+
+def em_step(frame, smoothing):
+    """One iteration of Dawid-Skene from the majority vote, with loops."""
+    labels = list(pandas.unique(frame['answer']))
+    tasks = list(pandas.unique(frame['task_id']))
+    workers = list(pandas.unique(frame['user_id']))
+    posteriors = {}
+    for task_id in tasks:
+        answers = list(frame['answer'][frame['task_id'] == task_id])
+        posteriors[task_id] = [answers.count(label) / float(len(answers))
+                               for label in labels]
+    priors = [sum(posteriors[t][k] for t in tasks) / len(tasks)
+              for k in range(len(labels))]
+    confusion = {}
+    for worker in workers:
+        for k in range(len(labels)):
+            counts = [smoothing] * len(labels)
+            for _, row in frame[frame['user_id'] == worker].iterrows():
+                counts[labels.index(row['answer'])] += \
+                    posteriors[row['task_id']][k]
+            confusion[worker, k] = [c / sum(counts) for c in counts]
+    result = {}
+    for task_id in tasks:
+        scores = list(priors)
+        for _, row in frame[frame['task_id'] == task_id].iterrows():
+            for k in range(len(labels)):
+                scores[k] *= confusion[row['user_id'], k][
+                    labels.index(row['answer'])]
+        result[task_id] = [score / sum(scores) for score in scores]
+    return pandas.DataFrame.from_dict(result, 'index', columns=labels)
+
+
+class TestDawidSkene(object):
+
+    def test_one_iteration(self):
+        """Test an iteration is the one of the definition of the model."""
+        frame = simulate(20)[0]
+        model = DawidSkene(max_iter=1, smoothing=0.5).fit(frame)
+        expected = em_step(frame, 0.5)
+        assert model.iterations == 1
+        assert numpy.allclose(model.posteriors.values,
+                              expected.loc[model.posteriors.index,
+                                           model.posteriors.columns].values)
+
+    def test_finds_the_good_workers(self):
+        """Test the model beats the majority vote and finds the workers."""
+        frame, truth = simulate()
+        model = DawidSkene().fit(frame)
+        assert model.converged
+        labels = model.labels()
+        assert list(labels.columns) == ['label', 'probability']
+        accuracy = (labels['label'] == truth[labels.index]).mean()
+        majority = aggregation.majority_vote(frame, 'answer')
+        baseline = (majority['answer_majority'] == truth[majority.index])
+        assert accuracy > baseline.mean(), (accuracy, baseline.mean())
+        assert accuracy > 0.95, accuracy
+        correct = model.confusion.groupby(level='worker').apply(
+            lambda matrix: numpy.diag(matrix.values).mean())
+        assert correct[0] > 0.85 and correct[5] < 0.6, correct
+
+    def test_distributions(self):
+        """Test the posteriors, priors and confusion rows add up to 1."""
+        model = DawidSkene().fit(simulate(50)[0])
+        assert numpy.allclose(model.posteriors.sum(axis=1), 1)
+        assert numpy.allclose(model.confusion.sum(axis=1), 1)
+        assert math.isclose(model.priors.sum(), 1)
+        assert model.confusion.index.names == ['worker', 'truth']
+        assert model.posteriors.index.name == 'task_id'
+
+    def test_anonymous_workers(self):
+        """Test the task runs without user_id are told apart by user_ip."""
+        frame = pandas.DataFrame(dict(
+            task_id=[1, 1, 2, 2], user_id=[7, None, 7, None],
+            user_ip=[None, '10.0.0.1', None, '10.0.0.2'],
+            answer=['a', 'a', 'b', 'b']))
+        model = DawidSkene().fit(frame)
+        workers = model.confusion.index.get_level_values('worker').unique()
+        assert sorted(map(str, workers)) == ['10.0.0.1', '10.0.0.2', '7.0']
+        assert list(model.labels()['label']) == ['a', 'b']
+
+    def test_warm_start(self):
+        """Test a warm start begins from the previous posteriors."""
+        frame = simulate()[0]
+        cold = DawidSkene().fit(frame)
+        model = DawidSkene(warm_start=True).fit(frame[frame['task_id'] < 250])
+        model.fit(frame)
+        assert model.iterations < cold.iterations, (model.iterations,
+                                                    cold.iterations)
+        assert len(model.posteriors) == 300
+        assert numpy.allclose(model.posteriors.values,
+                              cold.posteriors[model.posteriors.columns]
+                              .values, atol=1e-2)
+        assert (model.labels()['label'] == cold.labels()['label']).all()
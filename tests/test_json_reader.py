@@ -0,0 +1,117 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""Package to test the JSON reader."""
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+from nose.tools import raises
+from enki.json_reader import open_json_file, iter_json_array
+
+
+class TestIterJsonArray(object):
+
+    def test_yields_the_same_items_as_json_loads(self):
+        data = [{'id': n, 'info': {'answer': 'Yes', 'x': n * 1.5},
+                 'text': '[{, "quoted" ]}'} for n in range(50)]
+        data += [12345678, "string", None, [1, [2]], True]
+        text = json.dumps(data, indent=2)
+
+        for chunk_size in (1, 3, 7, 1024):
+            items = list(iter_json_array(io.StringIO(text), chunk_size))
+            assert items == data, chunk_size
+
+    def test_numbers_split_between_chunks(self):
+        text = '[1234567, 89]'
+
+        items = list(iter_json_array(io.StringIO(text), chunk_size=4))
+
+        assert items == [1234567, 89], items
+
+    def test_fractions_and_exponents_split_between_chunks(self):
+        for text, data in (('[10, 0.25]', [10, 0.25]),
+                           ('[10, 1e-07]', [10, 1e-07]),
+                           ('[10, 2.5E+20]', [10, 2.5e+20])):
+            for chunk_size in range(1, len(text) + 1):
+                items = list(iter_json_array(io.StringIO(text), chunk_size))
+                assert items == data, (text, chunk_size)
+
+    def test_empty_array(self):
+        assert list(iter_json_array(io.StringIO(' [ ] '))) == []
+
+    def test_items_are_parsed_lazily(self):
+        text = '[{"id": 1}, {"id": 2}, this is not json'
+
+        items = iter_json_array(io.StringIO(text), chunk_size=4)
+
+        assert next(items) == {'id': 1}
+        assert next(items) == {'id': 2}
+
+    @raises(ValueError)
+    def test_raises_if_not_an_array(self):
+        list(iter_json_array(io.StringIO('{"id": 1}')))
+
+    @raises(ValueError)
+    def test_raises_if_truncated(self):
+        list(iter_json_array(io.StringIO('[{"id": 1}, {"id"'), chunk_size=4))
+
+
+class TestOpenJsonFile(object):
+
+    json_file = 'tests/different_task_runs.json'
+
+    def setup_method(self, method=None):
+        self.tmp_dir = tempfile.mkdtemp()
+        with open(self.json_file) as json_file:
+            self.data = json.load(json_file)
+
+    def teardown_method(self, method=None):
+        shutil.rmtree(self.tmp_dir)
+
+    def read(self, path):
+        with open_json_file(path) as json_file:
+            return list(iter_json_array(json_file))
+
+    def test_plain_file(self):
+        assert self.read(self.json_file) == self.data
+
+    def test_zip_file(self):
+        path = os.path.join(self.tmp_dir, 'project_task_run_json.zip')
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.write(self.json_file, 'project_task_run.json')
+
+        assert self.read(path) == self.data
+
+    def test_gzip_file(self):
+        path = os.path.join(self.tmp_dir, 'task_runs.json.gz')
+        with open(self.json_file, 'rb') as src, gzip.open(path, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+
+        assert self.read(path) == self.data
+
+    @raises(ValueError)
+    def test_zip_file_with_several_json_files(self):
+        path = os.path.join(self.tmp_dir, 'export.zip')
+        with zipfile.ZipFile(path, 'w') as archive:
+            archive.write(self.json_file, 'a.json')
+            archive.write(self.json_file, 'b.json')
+
+        open_json_file(path)
@@ -15,12 +15,18 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+import asyncio
+import threading
+import time
 import pbclient
 from mock import patch, call
-from base import TestEnki
-from enki.task_loaders import ServerTasksLoader, JsonTasksLoader
-from enki.task_run_loaders import ServerTaskRunsLoader, JsonTaskRunsLoader
+from base import TestEnki, fake_find
+from enki.task_loaders import ServerTasksLoader, JsonTasksLoader, \
+    AsyncServerTasksLoader
+from enki.task_run_loaders import ServerTaskRunsLoader, JsonTaskRunsLoader, \
+    AsyncServerTaskRunsLoader
 from nose.tools import raises
+from enki.records import Projection
 from enki.exceptions import PyBossaServerNoKeysetPagination, Error
 
 
@@ -72,6 +78,119 @@ class TestServerTasksLoader(TestEnki):
         assert len(tasks) == 102
         assert fake_client.mock_calls[1] == call(**second_query)
 
+    @patch('pbclient.find_tasks')
+    def test_load_grows_page_size_up_to_server_maximum(self, fake_client):
+        data = [{'id': n, 'state': 'completed'} for n in range(1, 1001)]
+        fake_client.side_effect = fake_find(data, pbclient.Task)
+
+        loader = ServerTasksLoader(1, max_page_size=400)
+        tasks = loader.load()
+
+        assert [t.id for t in tasks] == list(range(1, 1001))
+        limits = [c[2]['limit'] for c in fake_client.mock_calls]
+        assert limits == [100, 200, 400, 400], limits
+
+    @patch('pbclient.find_tasks')
+    def test_load_detects_end_with_the_page_limit(self, fake_client):
+        data = [{'id': n, 'state': 'completed'} for n in range(1, 251)]
+        fake_client.side_effect = fake_find(data, pbclient.Task)
+
+        loader = ServerTasksLoader(1, max_page_size=400)
+        tasks = loader.load()
+
+        assert len(tasks) == 250, len(tasks)
+        # The short page at the unconfirmed limit of 200 is checked with
+        # one more request.
+        limits = [c[2]['limit'] for c in fake_client.mock_calls]
+        assert limits == [100, 200, 150], limits
+
+    @patch('pbclient.find_tasks')
+    def test_load_does_not_stop_at_the_server_page_cap(self, fake_client):
+        data = [{'id': n, 'state': 'completed'} for n in range(1, 1001)]
+        fake_client.side_effect = fake_find(data, pbclient.Task,
+                                            max_limit=100)
+
+        loader = ServerTasksLoader(1, max_page_size=1000)
+        tasks = loader.load()
+
+        assert [t.id for t in tasks] == list(range(1, 1001))
+        limits = [c[2]['limit'] for c in fake_client.mock_calls]
+        assert limits == [100, 200] + [100] * 9, limits
+
+    @patch('pbclient.find_tasks')
+    def test_load_with_workers_and_a_server_page_cap(self, fake_client):
+        data = [{'id': n, 'state': 'completed'} for n in range(1, 1001)]
+        fake_client.side_effect = fake_find(data, pbclient.Task,
+                                            max_limit=100)
+
+        loader = ServerTasksLoader(1, max_workers=4, max_page_size=1000)
+        tasks = loader.load()
+
+        assert [t.id for t in tasks] == list(range(1, 1001))
+
+    @patch('pbclient.find_tasks')
+    def test_load_with_workers_fetches_id_ranges_in_order(self, fake_client):
+        data = [{'id': n, 'state': 'completed'} for n in range(1, 1001)]
+        fake_client.side_effect = fake_find(data, pbclient.Task)
+
+        loader = ServerTasksLoader(1, max_workers=4)
+        tasks = loader.load()
+
+        assert [t.id for t in tasks] == list(range(1, 1001))
+        last_ids = [c[2].get('last_id') for c in fake_client.mock_calls]
+        assert 100 in last_ids and 325 in last_ids, last_ids
+
+    @patch('pbclient.find_tasks')
+    def test_load_with_workers_and_a_server_ignoring_order(self, fake_client):
+        data = [{'id': n, 'state': 'completed'} for n in range(1, 1001)]
+        find = fake_find(data, pbclient.Task)
+        fake_client.side_effect = lambda **q: find(**dict(q, desc=None))
+
+        loader = ServerTasksLoader(1, max_workers=4)
+        tasks = loader.load()
+
+        assert [t.id for t in tasks] == list(range(1, 1001))
+
+    @patch('pbclient.find_tasks')
+    def test_load_with_workers_falls_back_without_highest_id(self, fake_client):
+        data = [{'id': n, 'state': 'completed'} for n in range(1, 251)]
+        find = fake_find(data, pbclient.Task)
+        failed = dict(status='failed', exception_msg='orderby')
+        fake_client.side_effect = lambda **q: (failed if q.get('desc')
+                                               else find(**q))
+
+        loader = ServerTasksLoader(1, max_workers=4)
+        tasks = loader.load()
+
+        assert [t.id for t in tasks] == list(range(1, 251))
+
+    @patch('pbclient.find_tasks')
+    def test_load_projects_every_page(self, fake_client):
+        data = [{'id': n, 'state': 'completed', 'project_id': 1,
+                 'links': ['<link/>'], 'info': {'url': n, 'big': 'x' * 100}}
+                for n in range(1, 251)]
+        fake_client.side_effect = fake_find(data, pbclient.Task)
+
+        loader = ServerTasksLoader(1, max_workers=2,
+                                   projection=Projection(info_keys=['url']))
+        tasks = loader.load()
+
+        assert [t.id for t in tasks] == list(range(1, 251))
+        assert all(t.info == {'url': t.id} for t in tasks)
+        assert 'big' in data[0]['info']
+
+    @raises(PyBossaServerNoKeysetPagination)
+    @patch('pbclient.find_tasks')
+    def test_load_with_workers_raises_worker_errors(self, fake_client):
+        data = [{'id': n, 'state': 'completed'} for n in range(1, 1001)]
+        find = fake_find(data, pbclient.Task)
+        failed = dict(status='failed', exception_msg='last_id')
+        fake_client.side_effect = lambda **q: (
+            failed if q.get('last_id', 0) > 500 else find(**q))
+
+        loader = ServerTasksLoader(1, max_workers=4)
+        loader.load()
+
 
 class TestJsonTasksLoader(object):
     json_file = 'tests/different_tasks.json'
@@ -103,6 +222,15 @@ class TestJsonTasksLoader(object):
         assert len(tasks) == 2, tasks
         assert_all_tasks_belong_to_project(tasks, project_id=1)
 
+    def test_load_streaming_returns_the_same_tasks(self):
+        for query in [dict(project_id=1, task_id=2), dict(project_id=2),
+                      dict(project_id=1, state='ongoing')]:
+            tasks = JsonTasksLoader(json_file=self.json_file, **query).load()
+            streamed = JsonTasksLoader(json_file=self.json_file, stream=True,
+                                       **query).load()
+
+            assert [t.data for t in streamed] == [t.data for t in tasks]
+
 
 class TestServerTaskRunsLoader(object):
 
@@ -148,6 +276,100 @@ class TestServerTaskRunsLoader(object):
         assert fake_client.mock_calls == [call(**first_query), call(**second_query)]
 
 
+    @patch('pbclient.find_taskruns')
+    def test_load_project_wide_groups_taskruns_by_task(self, fake_client):
+        tasks = [pbclient.Task({'id': 1}), pbclient.Task({'id': 2})]
+        loader = ServerTaskRunsLoader(project_id=1, tasks=tasks,
+                                      project_wide=True)
+        fake_client.side_effect = [
+            [pbclient.TaskRun({'id': 1, 'task_id': 1, 'project_id': 1}),
+             pbclient.TaskRun({'id': 2, 'task_id': 2, 'project_id': 1}),
+             pbclient.TaskRun({'id': 3, 'task_id': 3, 'project_id': 1}),
+             pbclient.TaskRun({'id': 4, 'task_id': 1, 'project_id': 1})]]
+
+        task_runs, _ = loader.load()
+
+        assert sorted(task_runs.keys()) == [1, 2], task_runs
+        assert [tr.id for tr in task_runs[1]] == [1, 4], task_runs
+        assert [tr.id for tr in task_runs[2]] == [2], task_runs
+        assert_task_runs_grouped_by_task(task_runs)
+        fake_client.assert_called_once_with(project_id=1, limit=100,
+                                            offset=0, all=0)
+
+    @patch('pbclient.find_taskruns')
+    def test_load_project_wide_uses_keyset_pagination(self, fake_client):
+        tasks = [pbclient.Task({'id': 1})]
+        loader = ServerTaskRunsLoader(project_id=1, tasks=tasks,
+                                      project_wide=True)
+        first_response = [pbclient.TaskRun({'id': n, 'task_id': 1})
+                          for n in range(100)]
+        second_response = [pbclient.TaskRun({'id': 100, 'task_id': 1})]
+        fake_client.side_effect = [first_response, second_response]
+        second_query = dict(project_id=1, limit=100, last_id=99, all=0)
+
+        task_runs, _ = loader.load()
+
+        assert len(task_runs[1]) == 101, task_runs
+        assert fake_client.call_count == 2
+        assert fake_client.mock_calls[1] == call(**second_query)
+
+    @patch('pbclient.find_taskruns')
+    def test_load_with_workers_keeps_tasks_order(self, fake_client):
+        tasks = [pbclient.Task({'id': n}) for n in range(1, 21)]
+        data = [{'id': n, 'task_id': 1 + n % 20} for n in range(1, 401)]
+        fake_client.side_effect = fake_find(data, pbclient.TaskRun)
+        loader = ServerTaskRunsLoader(project_id=1, tasks=tasks,
+                                      max_workers=4)
+
+        task_runs, _ = loader.load()
+
+        assert list(task_runs.keys()) == list(range(1, 21))
+        assert [len(trs) for trs in task_runs.values()] == [20] * 20
+        assert_task_runs_grouped_by_task(task_runs)
+
+    @patch('pbclient.find_taskruns')
+    def test_load_project_wide_with_workers(self, fake_client):
+        tasks = [pbclient.Task({'id': n}) for n in range(1, 11)]
+        data = [{'id': n, 'task_id': 1 + n % 10} for n in range(1, 1001)]
+        fake_client.side_effect = fake_find(data, pbclient.TaskRun)
+        loader = ServerTaskRunsLoader(project_id=1, tasks=tasks,
+                                      project_wide=True, max_workers=3)
+
+        task_runs, _ = loader.load()
+
+        assert sum(len(trs) for trs in task_runs.values()) == 1000
+        for trs in task_runs.values():
+            ids = [tr.id for tr in trs]
+            assert ids == sorted(ids), ids
+        assert_task_runs_grouped_by_task(task_runs)
+
+    @patch('pbclient.find_taskruns')
+    def test_iter_task_runs_yields_every_task_in_order(self, fake_client):
+        data = [{'id': n, 'task_id': 1 + n % 7, 'project_id': 1}
+                for n in range(1, 101)]
+        fake_client.side_effect = fake_find(data, pbclient.TaskRun)
+        tasks = [pbclient.Task({'id': n}) for n in range(1, 10)]
+        loader = ServerTaskRunsLoader(project_id=1, tasks=tasks,
+                                      max_workers=2)
+
+        fetched = list(loader.iter_task_runs())
+
+        assert [task.id for task, _ in fetched] == list(range(1, 10))
+        for task, task_runs in fetched:
+            assert ([tr.id for tr in task_runs]
+                    == [d['id'] for d in data if d['task_id'] == task.id])
+
+    @raises(PyBossaServerNoKeysetPagination)
+    @patch('pbclient.find_taskruns')
+    def test_load_project_wide_checks_errors(self, fake_client):
+        tasks = [pbclient.Task({'id': 1})]
+        loader = ServerTaskRunsLoader(project_id=1, tasks=tasks,
+                                      project_wide=True)
+        fake_client.return_value = dict(status='failed',
+                                        exception_msg='last_id')
+
+        loader.load()
+
     @raises(PyBossaServerNoKeysetPagination)
     def test_keyset_pagination_works(self):
         """Test keyset error pagination works."""
@@ -183,6 +405,99 @@ class TestServerTaskRunsLoader(object):
         assert loader.check_errors(data) is False, type(data)
 
 
+class TestAsyncServerLoaders(object):
+
+    @patch('pbclient.find_tasks')
+    def test_load_tasks_returns_same_tasks_as_sync_loader(self, fake_client):
+        data = [{'id': n, 'state': 'completed'} for n in range(1, 1001)]
+        fake_client.side_effect = fake_find(data, pbclient.Task)
+
+        tasks = asyncio.run(AsyncServerTasksLoader(1, max_workers=4).load())
+        sync_tasks = ServerTasksLoader(1).load()
+
+        assert [t.id for t in tasks] == [t.id for t in sync_tasks]
+
+    @patch('pbclient.find_tasks')
+    def test_load_tasks_with_a_server_ignoring_order(self, fake_client):
+        data = [{'id': n, 'state': 'completed'} for n in range(1, 1001)]
+        find = fake_find(data, pbclient.Task)
+        fake_client.side_effect = lambda **q: find(**dict(q, desc=None))
+
+        tasks = asyncio.run(AsyncServerTasksLoader(1, max_workers=4).load())
+
+        assert [t.id for t in tasks] == list(range(1, 1001))
+
+    @patch('pbclient.find_taskruns')
+    def test_load_task_runs_caps_requests_in_flight(self, fake_client):
+        tasks = [pbclient.Task({'id': n}) for n in range(1, 21)]
+        data = [{'id': n, 'task_id': 1 + n % 20} for n in range(1, 201)]
+        find = fake_find(data, pbclient.TaskRun)
+        lock = threading.Lock()
+        in_flight = [0, 0]
+
+        def slow_find(**query):
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight)
+            time.sleep(0.01)
+            with lock:
+                in_flight[0] -= 1
+            return find(**query)
+        fake_client.side_effect = slow_find
+        loader = AsyncServerTaskRunsLoader(project_id=1, tasks=tasks,
+                                           max_workers=3)
+
+        task_runs, _ = asyncio.run(loader.load())
+
+        assert list(task_runs.keys()) == list(range(1, 21))
+        assert [len(trs) for trs in task_runs.values()] == [10] * 20
+        assert 1 < in_flight[1] <= 3, in_flight
+        assert_task_runs_grouped_by_task(task_runs)
+
+    @patch('pbclient.find_taskruns')
+    def test_load_task_runs_beyond_the_default_executor(self, fake_client):
+        # The default executor has at most 32 threads.
+        tasks = [pbclient.Task({'id': n}) for n in range(1, 41)]
+        find = fake_find([], pbclient.TaskRun)
+        barrier = threading.Barrier(40, timeout=5)
+
+        def find_together(**query):
+            if query.get('last_id') is None:
+                barrier.wait()
+            return find(**query)
+        fake_client.side_effect = find_together
+        loader = AsyncServerTaskRunsLoader(project_id=1, tasks=tasks,
+                                           max_workers=40)
+
+        task_runs, _ = asyncio.run(loader.load())
+
+        assert list(task_runs.keys()) == list(range(1, 41))
+
+    @patch('pbclient.find_taskruns')
+    def test_load_task_runs_project_wide(self, fake_client):
+        tasks = [pbclient.Task({'id': n}) for n in range(1, 11)]
+        data = [{'id': n, 'task_id': 1 + n % 10} for n in range(1, 1001)]
+        fake_client.side_effect = fake_find(data, pbclient.TaskRun)
+        loader = AsyncServerTaskRunsLoader(project_id=1, tasks=tasks,
+                                           project_wide=True, max_workers=3)
+
+        task_runs, _ = asyncio.run(loader.load())
+
+        assert sum(len(trs) for trs in task_runs.values()) == 1000
+        assert_task_runs_grouped_by_task(task_runs)
+
+    @raises(PyBossaServerNoKeysetPagination)
+    @patch('pbclient.find_taskruns')
+    def test_load_task_runs_raises_errors(self, fake_client):
+        tasks = [pbclient.Task({'id': n}) for n in range(1, 5)]
+        fake_client.return_value = dict(status='failed',
+                                        exception_msg='last_id')
+        loader = AsyncServerTaskRunsLoader(project_id=1, tasks=tasks,
+                                           max_workers=2)
+
+        asyncio.run(loader.load())
+
+
 class TestJsonTaskRunsLoader(object):
     json_file = 'tests/different_task_runs.json'
 
@@ -205,6 +520,55 @@ class TestJsonTaskRunsLoader(object):
         assert len(task_runs) == 2
         assert_task_runs_grouped_by_task(task_runs)
 
+    def test_load_streaming_keeps_only_task_runs_of_the_tasks(self):
+        tasks = [pbclient.Task({'id': 1, 'project_id': 1})]
+        loader = JsonTaskRunsLoader(project_id=1, tasks=tasks,
+                                    json_file=self.json_file)
+        streaming_loader = JsonTaskRunsLoader(project_id=1, tasks=tasks,
+                                              json_file=self.json_file,
+                                              stream=True)
+
+        task_runs, task_runs_file = loader.load()
+        streamed, streamed_file = streaming_loader.load()
+
+        assert ([tr.data for tr in streamed[1]]
+                == [tr.data for tr in task_runs[1]]), streamed
+        assert len(streamed_file) == len(streamed[1]) < len(task_runs_file)
+
+    def test_load_projects_the_task_runs(self):
+        tasks = [pbclient.Task({'id': 1})]
+        loader = JsonTaskRunsLoader(1, tasks, self.json_file, stream=True,
+                                    projection=Projection(['user_id'],
+                                                          ['answer']))
+
+        task_runs, task_runs_file = loader.load()
+
+        data = task_runs[1][0].data
+        assert sorted(data) == ['id', 'info', 'project_id', 'task_id',
+                                'user_id'], data
+        assert sorted(data['info']) == ['answer'], data
+
+    def test_iter_task_runs_yields_complete_tasks(self):
+        tasks = [pbclient.Task({'id': n}) for n in (3, 2, 1)]
+        loader = JsonTaskRunsLoader(project_id=1, tasks=tasks,
+                                    json_file=self.json_file)
+
+        fetched = [(task.id, [tr.id for tr in task_runs])
+                   for task, task_runs in loader.iter_task_runs()]
+
+        assert fetched == [(3, []), (1, [1, 2]), (2, [3])], fetched
+
+    def test_lookup_uses_the_project_and_task_index(self):
+        tasks = [pbclient.Task({'id': 1, 'project_id': 1})]
+        loader = JsonTaskRunsLoader(project_id=1, tasks=tasks,
+                                    json_file=self.json_file)
+
+        task_runs, _ = loader.load()
+
+        assert [tr.id for tr in task_runs[1]] == [1, 2], task_runs
+        assert [tr.task_id for tr in loader.lookup(2)] == [2]
+        assert [tr.project_id for tr in loader.lookup(33, 2)] == [2]
+        assert loader.lookup(33) == []
 
 
 def assert_all_tasks_belong_to_project(tasks, project_id):
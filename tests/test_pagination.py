@@ -0,0 +1,97 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""Package to test the pagination helpers."""
+import pbclient
+from enki.pagination import PageSize, split_id_range
+
+
+def make_tasks(n, info='x'):
+    return [pbclient.Task({'id': i, 'info': info}) for i in range(n)]
+
+
+class TestPageSize(object):
+
+    def test_limit_grows_with_fast_full_pages(self):
+        page_size = PageSize(100, max_limit=500)
+
+        page_size.measure(make_tasks(100), 100, 0.01)
+        assert page_size.limit == 200, page_size.limit
+        page_size.measure(make_tasks(200), 200, 0.01)
+        page_size.measure(make_tasks(400), 400, 0.01)
+        assert page_size.limit == 500, page_size.limit
+
+    def test_limit_does_not_grow_with_short_pages(self):
+        page_size = PageSize(100, max_limit=500)
+
+        page_size.measure(make_tasks(10), 100, 0.01)
+
+        assert page_size.limit == 100, page_size.limit
+
+    def test_limit_shrinks_with_slow_pages(self):
+        page_size = PageSize(100, max_limit=500, min_limit=20)
+
+        page_size.measure(make_tasks(100), 100, 5)
+        assert page_size.limit == 50, page_size.limit
+        page_size.measure(make_tasks(50), 50, 5)
+        page_size.measure(make_tasks(25), 25, 5)
+        assert page_size.limit == 20, page_size.limit
+
+    def test_limit_shrinks_with_big_pages(self):
+        page_size = PageSize(100, max_limit=500, target_bytes=1000)
+
+        page_size.measure(make_tasks(100), 100, 0.01, size=2000)
+
+        assert page_size.limit == 50, page_size.limit
+
+    def test_limit_grows_without_the_size(self):
+        page_size = PageSize(100, max_limit=500, target_bytes=1000)
+
+        page_size.measure(make_tasks(100), 100, 0.01, size=None)
+
+        assert page_size.limit == 200, page_size.limit
+
+    def test_short_page_at_a_confirmed_limit_is_the_last(self):
+        page_size = PageSize(100, max_limit=500)
+
+        assert not page_size.is_last(make_tasks(100), 100)
+        assert page_size.is_last(make_tasks(99), 100)
+        assert page_size.is_last([], 400)
+
+    def test_short_page_at_an_unconfirmed_limit_lowers_the_maximum(self):
+        page_size = PageSize(100, max_limit=500)
+        page_size.limit = 400
+
+        assert not page_size.is_last(make_tasks(250), 400)
+        assert page_size.max_limit == 250, page_size.max_limit
+        assert page_size.limit == 250, page_size.limit
+        assert not page_size.is_last(make_tasks(250), 250)
+        assert page_size.confirmed_limit == 250
+        assert page_size.is_last(make_tasks(120), 250)
+
+    def test_limit_ignores_failed_payloads(self):
+        page_size = PageSize(100, max_limit=500)
+
+        page_size.measure(dict(status='failed'), 100, 10)
+
+        assert page_size.limit == 100, page_size.limit
+
+
+def test_split_id_range():
+    assert split_id_range(0, 10, 3) == [(0, 4), (4, 8), (8, 10)]
+    assert split_id_range(5, 7, 4) == [(5, 6), (6, 7)]
+    assert split_id_range(5, 5, 4) == []
@@ -0,0 +1,128 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""Package to test the projection of the loaded records."""
+import pbclient
+from nose.tools import raises
+from enki.records import Projection, CompactTask, CompactTaskRun, \
+    compact_columns
+
+RECORD = dict(id=1, project_id=1, task_id=2, user_ip='1.2.3.4',
+              created='2016-01-01T00:00:00', links=['<link/>'],
+              info=dict(answer='yes', comment='long text', x=1))
+
+
+class TestProjection(object):
+
+    def test_keeps_the_columns_and_the_needed_fields(self):
+        """Test only the columns and the fields the loaders need are kept."""
+        data = Projection(columns=['created']).project(RECORD)
+        assert data == dict(id=1, project_id=1, task_id=2,
+                            created='2016-01-01T00:00:00'), data
+
+    def test_keeps_the_info_keys(self):
+        """Test only the info keys are kept, with all the fields."""
+        data = Projection(info_keys=['answer', 'x']).project(RECORD)
+        assert data['info'] == dict(answer='yes', x=1), data
+        assert data['links'] == ['<link/>']
+        assert RECORD['info']['comment'] == 'long text'
+
+    def test_keeps_info_with_columns_and_info_keys(self):
+        """Test info is kept when info_keys are given with the columns."""
+        data = Projection(columns=[], info_keys=['answer']).project(RECORD)
+        assert data == dict(id=1, project_id=1, task_id=2,
+                            info=dict(answer='yes')), data
+
+    def test_keeps_info_that_is_not_a_dict(self):
+        """Test an info that is not a dict is kept as it is."""
+        data = Projection(info_keys=['answer']).project(dict(id=1,
+                                                             info='text'))
+        assert data == dict(id=1, info='text')
+
+    def test_keeps_all_by_default(self):
+        """Test the records are untouched without columns or info_keys."""
+        assert Projection().project(RECORD) is RECORD
+        assert Projection().name('task_runs') == 'task_runs'
+
+    def test_projects_pages(self):
+        """Test the items of a page are trimmed and errors are returned."""
+        page = [pbclient.TaskRun(dict(RECORD))]
+        projection = Projection(columns=['user_ip'])
+        assert projection.project_page(page) is page
+        assert sorted(page[0].data) == ['id', 'project_id', 'task_id',
+                                        'user_ip']
+        error = dict(status='failed')
+        assert projection.project_page(error) is error
+
+    def test_name(self):
+        """Test the names tell the projections apart."""
+        first = Projection(columns=['created'])
+        assert first.name('tasks') == Projection(['created']).name('tasks')
+        assert first.name('tasks').startswith('tasks-')
+        assert first.name('tasks') != Projection(['info']).name('tasks')
+        assert first == Projection(['created'])
+        assert first != Projection(['created'], ['answer'])
+
+
+class TestCompactRecord(object):
+
+    def test_reads_the_fields_as_attributes(self):
+        """Test the fields are attributes and data has them all."""
+        task_run = CompactTaskRun(dict(RECORD))
+        assert task_run.id == 1
+        assert task_run.info['answer'] == 'yes'
+        assert task_run.data == RECORD
+        assert list(task_run.data) == list(RECORD)
+        assert getattr(task_run, 'missing', None) is None
+
+    @raises(AttributeError)
+    def test_unknown_attribute(self):
+        """Test an unknown attribute raises AttributeError."""
+        CompactTaskRun(dict(RECORD)).finish_time
+
+    def test_sets_the_fields(self):
+        """Test the fields and data can be set, like in pbclient."""
+        task_run = CompactTaskRun(dict(RECORD))
+        task_run.info = dict(answer='no')
+        assert task_run.data['info'] == dict(answer='no')
+        task_run.data = dict(id=3)
+        assert task_run.data == dict(id=3)
+
+    def test_shares_the_layout(self):
+        """Test the records with the same fields share their keys."""
+        first = CompactTaskRun(dict(RECORD))
+        second = CompactTaskRun(dict(RECORD, id=2))
+        assert first._layout is second._layout
+        assert not hasattr(first, '__dict__')
+
+    def test_compact_columns(self):
+        """Test the columns of records with the same fields are given."""
+        task_runs = [CompactTaskRun(dict(id=n, task_id=1)) for n in (1, 2)]
+        assert compact_columns(task_runs) == dict(id=[1, 2], task_id=[1, 1])
+        task_runs.append(CompactTaskRun(dict(task_id=1, id=3)))
+        assert compact_columns(task_runs) is None
+        assert compact_columns([pbclient.TaskRun(dict(id=1))]) is None
+        assert compact_columns([]) is None
+
+    def test_projects_pages_into_compact_records(self):
+        """Test a compact projection turns the pages into compact records."""
+        projection = Projection(info_keys=['answer'], compact=True)
+        page = projection.project_page([pbclient.Task(dict(RECORD)),
+                                        pbclient.TaskRun(dict(RECORD))])
+        assert [type(item) for item in page] == [CompactTask, CompactTaskRun]
+        assert page[1].info == dict(answer='yes')
+        assert projection.record_class(pbclient.TaskRun) is CompactTaskRun
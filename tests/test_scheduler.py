@@ -0,0 +1,173 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""Package to test the rate limit aware request scheduler."""
+import json
+import pbclient
+import requests
+from nose.tools import raises
+from enki.scheduler import RequestScheduler, parse_retry_after
+from enki.session import install
+from enki.task_run_loaders import ServerTaskRunsLoader
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code=200, body=None, **headers):
+        self.status_code = status_code
+        self.text = json.dumps(body if body is not None else [])
+        self.headers = dict((k.replace('_', '-'), str(v))
+                            for k, v in headers.items())
+
+
+class FakeTransport(object):
+
+    """Return the responses in order, raising the exceptions among them."""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def get(self, url, **kwargs):
+        self.calls += 1
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+class FakeClock(object):
+
+    def __init__(self, now=1700000000.0):
+        self.now = now
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestRequestScheduler(object):
+
+    def scheduler(self, responses, **kwargs):
+        self.clock = FakeClock()
+        self.transport = FakeTransport(responses)
+        return RequestScheduler(self.transport, sleep=self.clock.sleep,
+                                clock=self.clock.time, **kwargs)
+
+    def test_retries_throttled_requests_after_retry_after(self):
+        """Test a 429 is retried after the seconds in Retry-After."""
+        scheduler = self.scheduler([FakeResponse(429, Retry_After=7),
+                                    FakeResponse(200)])
+        response = scheduler.get('http://server/api/taskrun')
+        assert response.status_code == 200
+        assert self.clock.sleeps == [7.0], self.clock.sleeps
+        assert scheduler.stats()['retries'] == 1
+
+    def test_retries_with_jittered_exponential_backoff(self):
+        """Test the retries wait at most backoff * 2 ** n seconds."""
+        scheduler = self.scheduler([FakeResponse(503), FakeResponse(502),
+                                    requests.ConnectionError(),
+                                    FakeResponse(200)],
+                                   backoff=1.0)
+        response = scheduler.get('http://server/api/taskrun')
+        assert response.status_code == 200
+        assert len(self.clock.sleeps) == 3
+        for attempt, seconds in enumerate(self.clock.sleeps):
+            assert 0 <= seconds <= 2 ** attempt, self.clock.sleeps
+
+    def test_gives_up_after_max_retries(self):
+        """Test the last failed response is returned after max_retries."""
+        scheduler = self.scheduler([FakeResponse(500)] * 3, max_retries=2)
+        response = scheduler.get('http://server/api/taskrun')
+        assert response.status_code == 500
+        assert self.transport.calls == 3
+
+    @raises(requests.ConnectionError)
+    def test_raises_connection_errors_after_max_retries(self):
+        """Test a connection error is raised again after max_retries."""
+        scheduler = self.scheduler([requests.ConnectionError()] * 2,
+                                   max_retries=1)
+        scheduler.get('http://server/api/taskrun')
+
+    def test_client_errors_are_not_retried(self):
+        """Test a 4xx other than 429 is returned right away."""
+        scheduler = self.scheduler([FakeResponse(404)])
+        assert scheduler.get('http://server/api/taskrun').status_code == 404
+        assert self.clock.sleeps == []
+
+    def test_paces_requests_when_the_quota_is_low(self):
+        """Test the requests are spread until the reset of the quota."""
+        reset = 1700000000.0 + 20
+        scheduler = self.scheduler(
+            [FakeResponse(200, X_RateLimit_Limit=300,
+                          X_RateLimit_Remaining=10,
+                          X_RateLimit_Reset=reset)] * 3)
+        for _ in range(3):
+            scheduler.get('http://server/api/taskrun')
+        assert scheduler.interval > 0
+        # 10 requests left for 20 seconds.
+        assert self.clock.sleeps == [2.0, 2.0], self.clock.sleeps
+
+    def test_does_not_pace_with_plenty_of_quota(self):
+        """Test there is no wait while more than half the quota is left."""
+        scheduler = self.scheduler(
+            [FakeResponse(200, X_RateLimit_Limit=300,
+                          X_RateLimit_Remaining=299,
+                          X_RateLimit_Reset=1700000000.0 + 900)] * 3)
+        for _ in range(3):
+            scheduler.get('http://server/api/taskrun')
+        assert self.clock.sleeps == []
+
+    def test_waits_for_the_reset_when_the_quota_is_over(self):
+        """Test no request is sent until the quota is reset."""
+        scheduler = self.scheduler(
+            [FakeResponse(200, X_RateLimit_Limit=300,
+                          X_RateLimit_Remaining=0,
+                          X_RateLimit_Reset=30),
+             FakeResponse(200)])
+        scheduler.get('http://server/api/taskrun')
+        scheduler.get('http://server/api/taskrun')
+        assert self.clock.sleeps == [30.0], self.clock.sleeps
+
+    def test_parse_retry_after(self):
+        """Test Retry-After is read in seconds or as an HTTP date."""
+        assert parse_retry_after('5', 0) == 5.0
+        assert parse_retry_after('Thu, 01 Jan 1970 00:01:00 GMT', 0) == 60.0
+        assert parse_retry_after('soon', 0) is None
+        assert parse_retry_after(None, 0) is None
+
+    def test_loader_survives_throttling(self):
+        """Test a loader goes on when the server throttles it."""
+        clock = FakeClock()
+        body = [dict(id=1, task_id=1, project_id=1)]
+        transport = FakeTransport([FakeResponse(429, Retry_After=1),
+                                   FakeResponse(200, body),
+                                   FakeResponse(200, [])])
+        pbclient.set('endpoint', 'http://server')
+        install(RequestScheduler(transport, sleep=clock.sleep,
+                                 clock=clock.time))
+        try:
+            task_runs, _ = ServerTaskRunsLoader(
+                1, [pbclient.Task({'id': 1})]).load()
+        finally:
+            install(None)
+        assert [tr.id for tr in task_runs[1]] == [1]
+        assert transport.calls == 3
@@ -0,0 +1,134 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""Package to test the pooled session."""
+import json
+import threading
+import pbclient
+import requests
+import enki
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from base import TestEnki
+from enki.session import PooledSession, install, take_response_size
+from enki.task_run_loaders import ServerTaskRunsLoader
+
+
+class FakePyBossaHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    responses = {}
+
+    def do_GET(self):
+        domain = self.path.split('?')[0].split('/')[-1]
+        body = json.dumps(self.responses.get(domain, [])).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+server = None
+
+
+def setup_module():
+    global server
+    FakePyBossaHandler.responses = dict(project=[TestEnki.project])
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakePyBossaHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+
+def teardown_module():
+    install(None)
+    server.shutdown()
+    server.server_close()
+
+
+class TestPooledSession(TestEnki):
+
+    def teardown_method(self):
+        install(None)
+
+    @property
+    def endpoint(self):
+        return 'http://127.0.0.1:%s' % server.server_port
+
+    def test_install_routes_pbclient_requests(self):
+        """Test install makes pbclient use the session."""
+        session = PooledSession(2)
+        install(session)
+        assert pbclient.requests is session
+        install(None)
+        assert pbclient.requests is requests
+
+    def test_records_the_response_size(self):
+        """Test the size of a response is taken once by its thread."""
+        session = PooledSession(2)
+        install(session)
+        try:
+            pbclient.set('endpoint', self.endpoint)
+            pbclient.find_project(short_name='x')
+        finally:
+            install(None)
+        assert take_response_size() == len(json.dumps([TestEnki.project]))
+        assert take_response_size() is None
+
+    def test_requests_reuse_connections(self):
+        """Test get_project and the loaders share the connections."""
+        e = enki.Enki(api_key='key', endpoint=self.endpoint,
+                      project_short_name=self.project['short_name'],
+                      pool_size=2)
+        tasks = [pbclient.Task({'id': n}) for n in range(1, 6)]
+        ServerTaskRunsLoader(e.project.id, tasks).load()
+
+        stats = e.pool_stats()
+        assert stats['requests'] == 6, stats
+        assert stats['connections'] == 1, stats
+        assert stats['reused'] == 5, stats
+
+    def test_concurrent_workers_reuse_connections(self):
+        """Test the workers never open more connections than pool_size."""
+        e = enki.Enki(api_key='key', endpoint=self.endpoint,
+                      project_short_name=self.project['short_name'],
+                      max_workers=8, pool_size=3)
+        tasks = [pbclient.Task({'id': n}) for n in range(1, 41)]
+        ServerTaskRunsLoader(e.project.id, tasks, max_workers=8).load()
+
+        stats = e.pool_stats()
+        assert stats['requests'] == 41, stats
+        assert stats['connections'] <= 3, stats
+
+    def test_no_pool_by_default(self):
+        """Test Enki does not install a session unless asked."""
+        e = enki.Enki(api_key='key', endpoint=self.endpoint,
+                      project_short_name=self.project['short_name'])
+        assert e.pool_stats() is None
+        assert pbclient.requests is requests
+
+    def test_default_enki_keeps_the_pool(self):
+        """Test an Enki without pool_size keeps the installed pool."""
+        e = enki.Enki(api_key='key', endpoint=self.endpoint,
+                      project_short_name=self.project['short_name'],
+                      pool_size=2)
+        enki.Enki(api_key='key', endpoint=self.endpoint,
+                  project_short_name=self.project['short_name'])
+        assert pbclient.requests is e.session
@@ -0,0 +1,195 @@
+# -*- coding: utf8 -*-
+# This file is part of PyBossa.
+#
+# Copyright (C) 2015 SciFabric LTD.
+#
+# PyBossa is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBossa is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
+"""Package to test the columnar snapshots."""
+import os
+import shutil
+import tempfile
+from unittest import SkipTest
+import enki
+import pandas
+import pbclient
+from mock import patch
+from enki import snapshot
+from enki.records import CompactTaskRun
+from nose.tools import raises
+from pandas.testing import assert_frame_equal
+from base import TestEnki, fake_find
+
+
+def setup_module():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise SkipTest("pyarrow is not installed")
+
+
+TASKS = [dict(id=1, project_id=1, state='completed', info=dict(url='a')),
+         dict(id=2, project_id=1, state='completed', info=dict(url='b',
+                                                                 id=7)),
+         dict(id=3, project_id=1, state='completed', info='text')]
+
+TASK_RUNS = [dict(id=1, task_id=1, project_id=1, user_id=None,
+                  info=dict(answer='yes', score=1)),
+             dict(id=2, task_id=1, project_id=1, user_id=4,
+                  info=dict(answer='no', score=2)),
+             dict(id=3, task_id=2, project_id=1, user_id=5,
+                  info=dict(answer='yes', tags=['x', 'y'])),
+             dict(id=4, task_id=2, project_id=1, user_id=6,
+                  info=dict(answer='no'))]
+
+
+class TestSnapshot(TestEnki):
+
+    def setup_method(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'snapshot')
+
+    def teardown_method(self):
+        shutil.rmtree(os.path.dirname(self.path))
+
+    @patch('enki.task_run_loaders.pbclient.find_taskruns')
+    @patch('enki.task_loaders.pbclient.find_tasks')
+    @patch('pbclient.find_project')
+    def create_enki(self, find_project, find_tasks, find_taskruns,
+                    **options):
+        find_project.return_value = [pbclient.Project(self.project)]
+        find_tasks.side_effect = fake_find(TASKS, pbclient.Task)
+        find_taskruns.side_effect = fake_find(TASK_RUNS, pbclient.TaskRun)
+        e = enki.Enki(api_key='key', endpoint='http://localhost:5000',
+                      project_short_name=self.project['short_name'],
+                      **options)
+        e.get_all()
+        return e
+
+    def check_round_trip(self, format, task_ids=(1, 2, 3)):
+        e = self.create_enki()
+        e.save_snapshot(self.path, format=format)
+        loaded = self.create_enki()
+        loaded.tasks = loaded.task_runs = None
+        loaded.load_snapshot(self.path)
+
+        assert_frame_equal(loaded.tasks_df, e.tasks_df)
+        assert list(loaded.task_runs_df.keys()) == list(task_ids)
+        for task_id, data_frame in e.task_runs_df.items():
+            assert_frame_equal(loaded.task_runs_df[task_id], data_frame)
+        assert [t.data for t in loaded.tasks] == [t.data for t in e.tasks]
+        for task_id, task_runs in e.task_runs.items():
+            assert ([tr.data for tr in loaded.task_runs[task_id]]
+                    == [tr.data for tr in task_runs])
+        assert loaded.state == 'completed'
+
+    def test_feather_round_trip(self):
+        """Test a Feather snapshot loads the same frames and items."""
+        self.check_round_trip('feather')
+
+    def test_parquet_round_trip(self):
+        """Test a Parquet snapshot loads the same frames and items."""
+        self.check_round_trip('parquet')
+
+    def test_null_values_round_trip(self):
+        """Test the null info and info values load back as None."""
+        TASKS.append(dict(id=4, project_id=1, state='completed', info=None))
+        TASK_RUNS.append(dict(id=5, task_id=2, project_id=1, user_id=7,
+                              info=dict(answer=None, tags=None)))
+        try:
+            for format in ('feather', 'parquet'):
+                self.check_round_trip(format, task_ids=[1, 2, 3, 4])
+                shutil.rmtree(self.path)
+        finally:
+            del TASKS[-1], TASK_RUNS[-1]
+
+    def test_combined_layout_round_trip(self):
+        """Test a snapshot loads in the combined layout."""
+        e = self.create_enki()
+        e.save_snapshot(self.path)
+        loaded = self.create_enki(task_runs_layout='combined')
+        loaded.load_snapshot(self.path)
+        assert (list(loaded.task_runs_df.frame.index)
+                == [(1, 1), (1, 2), (2, 3), (2, 4)])
+        assert list(loaded.task_runs_df.keys()) == [1, 2, 3]
+        assert list(loaded.task_runs_df[2]['answer']) == ['yes', 'no']
+        assert len(loaded.task_runs_df[3]) == 0
+
+    def test_compact_records_round_trip(self):
+        """Test a snapshot of compact records loads compact records."""
+        e = self.create_enki(compact_records=True)
+        e.save_snapshot(self.path)
+        loaded = self.create_enki(compact_records=True)
+        loaded.load_snapshot(self.path)
+        assert isinstance(loaded.task_runs[1][0], CompactTaskRun)
+        for task_id, task_runs in e.task_runs.items():
+            assert ([tr.data for tr in loaded.task_runs[task_id]]
+                    == [tr.data for tr in task_runs])
+
+    def test_lazy_layout_round_trip(self):
+        """Test a snapshot saves and loads in the lazy layout."""
+        e = self.create_enki(task_runs_layout='lazy')
+        e.save_snapshot(self.path)
+        loaded = self.create_enki(task_runs_layout='lazy')
+        loaded.load_snapshot(self.path)
+        assert loaded.task_runs_df.cached() == []
+        for task_id, data_frame in e.task_runs_df.items():
+            assert_frame_equal(loaded.task_runs_df[task_id], data_frame)
+
+    def test_optimized_dtypes_round_trip(self):
+        """Test the optimized frames load with the same records."""
+        for n, task_run in enumerate(TASK_RUNS):
+            task_run['created'] = '2016-01-01T00:00:0%s.250000' % n
+        try:
+            e = self.create_enki(optimize_dtypes=True)
+            e.save_snapshot(self.path)
+            loaded = self.create_enki(optimize_dtypes=True)
+            loaded.load_snapshot(self.path)
+        finally:
+            for task_run in TASK_RUNS:
+                del task_run['created']
+        assert loaded.task_runs_df[2]['created'].dtype.kind == 'M'
+        assert loaded.task_runs_df[2]['project_id'].dtype == 'int8'
+        for task_id, task_runs in e.task_runs.items():
+            assert ([tr.data for tr in loaded.task_runs[task_id]]
+                    == [tr.data for tr in task_runs])
+
+    def test_records(self):
+        """Test the rows become the dicts of the items they came from."""
+        data_frame = pandas.DataFrame(dict(
+            id=[1, 2], user_id=[4.0, None], extra=['a', None],
+            created=pandas.to_datetime(['2016-01-01T00:00:01', None]),
+            answer=['yes', 'no']))
+        fields = dict(names=['created', 'extra', 'id', 'user_id'],
+                      sparse=['extra'], int=['id', 'user_id'])
+        assert snapshot.records(data_frame, fields) == [
+            dict(id=1, user_id=4, extra='a', created='2016-01-01T00:00:01'),
+            dict(id=2, user_id=None, created=None)]
+
+    @raises(ValueError)
+    def test_unknown_format(self):
+        """Test an unknown format is refused."""
+        self.create_enki().save_snapshot(self.path, format='csv')
+
+    @raises(ValueError)
+    def test_snapshot_of_another_project(self):
+        """Test a snapshot of another project is refused."""
+        e = self.create_enki()
+        e.save_snapshot(self.path)
+        e.project.data['id'] = 2
+        e.load_snapshot(self.path)
+
+    @raises(ImportError)
+    def test_snapshots_need_pyarrow(self):
+        """Test a clear error is raised without pyarrow."""
+        with patch.dict('sys.modules', {'pyarrow': None}):
+            snapshot.load_snapshot(self.path)